@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""ffmpeg processes per 1000 small titles, single-file vs. batch decrypt
+
+Runs `Shelf.decrypt` over N tiny fake `.aaxc` files (with vouchers) once
+file by file and once with `batch_under`, using a stand-in `ffmpeg` on PATH
+that only logs its invocation and writes the files it was asked for. This
+measures what batching changes - how many processes get spawned - without
+needing real audiobooks.
+
+    PYTHONPATH=src python bench/decrypt_spawns.py --files 1000
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import sys
+import tempfile
+import time
+import typing as t
+
+FAKE_FFMPEG = """#!{python}
+import pathlib
+import sys
+
+with open({log!r}, "a") as log:
+    log.write(" ".join(sys.argv[1:]) + "\\n")
+for arg in sys.argv[1:]:
+    if arg.endswith(".meta"):
+        pathlib.Path(arg).write_text(";FFMETADATA1\\ncomment=fake\\n")
+    elif arg.endswith(".m4a"):
+        pathlib.Path(arg).write_bytes(b"\\0" * 64)
+"""
+
+
+def _make_library(directory: pathlib.Path, count: int) -> t.List[pathlib.Path]:
+    files = []
+    for i in range(count):
+        aaxc = directory / f"B{i:09d}_Title-AAX_44_64.aaxc"
+        aaxc.write_bytes(b"\0" * 4096)
+        aaxc.with_suffix(".voucher").write_text(json.dumps({
+            "content_license": {
+                "asin": f"B{i:09d}",
+                "license_response": {"key": "00" * 16, "iv": "11" * 16},
+            }
+        }))
+        files.append(aaxc)
+    return files
+
+
+def _run(files, target_dir: pathlib.Path, log: pathlib.Path, **options):
+    from shelf import Shelf
+
+    for old in target_dir.glob("*.m4a"):
+        old.unlink()
+    log.write_text("")
+    start = time.perf_counter()
+    with Shelf(jobs=options.pop("jobs")) as shelf:
+        results = shelf.decrypt(
+            files,
+            target_dir=target_dir,
+            copy_asin_to_metadata=True,
+            **options
+        )
+    elapsed = time.perf_counter() - start
+    failed = [job for job, error in results if error]
+    if failed:
+        raise RuntimeError(f"{len(failed)} jobs failed")
+    spawns = len(log.read_text().splitlines())
+    return spawns, elapsed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=1000)
+    parser.add_argument("--batch-max", type=int, default=32)
+    parser.add_argument("--jobs", type=int, default=1)
+    opts = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = pathlib.Path(tmp)
+        bin_dir, dl_dir, assets_dir = tmp / "bin", tmp / "dl", tmp / "assets"
+        for d in (bin_dir, dl_dir, assets_dir):
+            d.mkdir()
+        log = tmp / "ffmpeg.log"
+        ffmpeg = bin_dir / "ffmpeg"
+        ffmpeg.write_text(FAKE_FFMPEG.format(python=sys.executable, log=str(log)))
+        ffmpeg.chmod(0o755)
+        os.environ["PATH"] = f"{bin_dir}{os.pathsep}{os.environ['PATH']}"
+
+        files = _make_library(dl_dir, opts.files)
+        per_1000 = 1000 / opts.files
+        for label, options in (
+            ("single", {}),
+            ("batch", {"batch_under": 1024 * 1024,
+                       "batch_max": opts.batch_max}),
+        ):
+            spawns, elapsed = _run(
+                files, assets_dir, log, jobs=opts.jobs, **options
+            )
+            print(
+                f"{label:<7} {spawns * per_1000:8.0f} ffmpeg spawns "
+                f"per 1000 files  {elapsed:7.2f}s for {opts.files} files"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""What a streaming client fetches before the first audio plays
+
+For each `.m4a` given, reports how many HTTP range requests and bytes a
+player needs before it can start decoding: with `moov` at the end it reads
+the head, then seeks to the tail for the index, then back to the first
+chunk; with `--faststart` output one read from the start covers the index
+and the first chunk. If a `<book>.hls/` package sits next to the file, its
+playlist, init segment and first media segment are reported as well.
+
+    PYTHONPATH=src python bench/first_audio.py assets/*.m4a
+"""
+
+import argparse
+import mmap
+import pathlib
+import sys
+
+from shelf.streaming import HLS_INIT, HLS_PLAYLIST, get_hls_dir
+from shelf.verify import _iter_boxes
+
+# what a player typically reads first, before it knows the layout
+FIRST_READ = 64 * 1024
+# decoded audio a player buffers before it starts, as bytes of the file
+START_BUFFER = 256 * 1024
+
+
+def mp4_first_audio(file: pathlib.Path):
+    """Return (layout, requests, bytes) until playback can start"""
+    size = file.stat().st_size
+    with open(file, "rb") as fp, \
+            mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        boxes = {box.type: box for box in _iter_boxes(buf, 0, size)}
+    moov, mdat = boxes[b"moov"], boxes[b"mdat"]
+    if moov.start < mdat.start:
+        needed = max(FIRST_READ, moov.end + START_BUFFER)
+        return "faststart", 1, needed
+    tail = moov.end - moov.start
+    return "moov at end", 3, FIRST_READ + tail + START_BUFFER
+
+
+def hls_first_audio(package: pathlib.Path):
+    playlist = package / HLS_PLAYLIST
+    segments = [
+        line for line in playlist.read_text().splitlines()
+        if line and not line.startswith("#")
+    ]
+    first = package / pathlib.Path(segments[0]).name
+    needed = sum(
+        f.stat().st_size for f in (playlist, package / HLS_INIT, first)
+    )
+    return "hls", 3, needed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="+", type=pathlib.Path)
+    opts = parser.parse_args()
+
+    for file in opts.files:
+        rows = [mp4_first_audio(file)]
+        package = get_hls_dir(file, file.parent)
+        if package.is_dir():
+            rows.append(hls_first_audio(package))
+        for layout, requests, needed in rows:
+            print(
+                f"{file.name:<50} {layout:<12} {requests} requests "
+                f"{needed / 1024:10.0f} KiB before first audio"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
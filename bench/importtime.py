@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""Startup budget for the audible CLI and the shelf plugins.
+
+Runs `audible --help` and `audible <cmd> --help` under `python -X importtime`
+and fails if the plugins take longer than the budget to import, or if a
+heavy dependency gets pulled in by a command that doesn't need it.
+
+Every `audible` invocation imports every plugin in AUDIBLE_PLUGIN_DIR, and
+restock_shelf.sh runs the CLI several times, so this adds up.
+
+The docker image ships precompiled bytecode, so compile first to measure
+the same thing (otherwise the plugins' compile time dominates):
+
+    python -m compileall -q src && python bench/importtime.py
+"""
+
+import argparse
+import os
+import pathlib
+import re
+import subprocess  # noqa: S404
+import sys
+import tempfile
+import typing as t
+
+REPO_ROOT = pathlib.Path(__file__).resolve().parent.parent
+PLUGIN_DIR = REPO_ROOT / "src" / "audible-cli" / "plugins"
+
+IMPORT_LINE = re.compile(
+    r"^import time:\s+(?P<self>\d+) \|\s+(?P<cumulative>\d+) \|"
+    r"(?P<indent>\s+)(?P<module>\S+)$"
+)
+
+# modules that must only be imported when the command that needs them runs
+# (lxml is not on the list, audible_cli itself pulls it in through bs4)
+HEAVY_MODULES = ("podgen", "dateutil", "rfc3986")
+
+# (audible arguments, heavy modules the command is allowed to import)
+COMMANDS: t.List[t.Tuple[t.List[str], t.Tuple[str, ...]]] = [
+    (["--help"], ()),
+    (["decrypt", "--help"], ()),
+    (["rss", "--help"], ()),
+    (["download", "--help"], ()),
+    (["library", "--help"], ()),
+    (["relayout", "--help"], ()),
+    (["publish", "--help"], ()),
+    (["fetch", "--help"], ()),
+    (["restock", "--help"], ()),
+    (["websub", "--help"], ()),
+]
+
+
+def _parse_importtime(stderr: str) -> t.Tuple[t.Dict[str, int], int]:
+    """Return cumulative import time in microseconds per module, and the
+    total of all top-level imports"""
+    times = {}
+    total = 0
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        cumulative = int(match.group("cumulative"))
+        times[match.group("module")] = cumulative
+        if len(match.group("indent")) == 1:
+            total += cumulative
+    return times, total
+
+
+def _plugin_dir() -> pathlib.Path:
+    return pathlib.Path(os.environ.get("AUDIBLE_PLUGIN_DIR", PLUGIN_DIR))
+
+
+def _plugin_modules() -> t.List[str]:
+    return [p.stem for p in _plugin_dir().glob("cmd_*.py")]
+
+
+def _env(plugin_dir: str) -> t.Dict[str, str]:
+    # the plugins import the shelf package from src/
+    pythonpath = [str(REPO_ROOT / "src")]
+    if os.environ.get("PYTHONPATH"):
+        pythonpath.append(os.environ["PYTHONPATH"])
+    return dict(
+        os.environ,
+        AUDIBLE_PLUGIN_DIR=plugin_dir,
+        PYTHONPATH=os.pathsep.join(pythonpath)
+    )
+
+
+def measure(args: t.List[str]) -> t.Tuple[t.Dict[str, int], int]:
+    # audible_cli loads plugins with importlib.import_module, which
+    # `-X importtime` doesn't see. Point it at an empty plugin dir and
+    # import the plugins with plain import statements instead, then attach
+    # them the same way audible_cli would. The collect() keeps a GC pass
+    # triggered by audible_cli's own allocations from landing on a plugin.
+    plugins = _plugin_modules()
+    script = "\n".join([
+        "import gc",
+        "import sys",
+        "from audible_cli.cli import cli",
+        "gc.collect()",
+        f"sys.path.insert(0, {str(_plugin_dir())!r})",
+        *[f"import {mod}" for mod in plugins],
+        *[f"cli.add_command({mod}.cli)" for mod in plugins],
+        f"cli.main({args!r}, prog_name='audible')",
+    ])
+    with tempfile.TemporaryDirectory() as empty_dir:
+        env = _env(empty_dir)
+        cmd = [sys.executable, "-X", "importtime", "-c", script]
+        child = subprocess.run(  # noqa: S603
+            cmd, capture_output=True, text=True, env=env
+        )
+    if child.returncode != 0:
+        raise RuntimeError(f"`audible {' '.join(args)}` failed:\n"
+                           f"{child.stderr}")
+    return _parse_importtime(child.stderr)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=float(os.environ.get("SHELF_IMPORT_BUDGET_MS", 10)),
+        help="max cumulative import time of all plugins, per command"
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=3,
+        help="take the best of N runs to smooth out noise"
+    )
+    opts = parser.parse_args()
+
+    plugins = _plugin_modules()
+    failed = False
+    for args, allowed in COMMANDS:
+        best_plugins = best_total = None
+        for _ in range(opts.runs):
+            times, total_us = measure(args)
+            # shelf shows up under whichever plugin imports it first
+            plugin_us = sum(times.get(mod, 0) for mod in plugins)
+            if best_plugins is None or plugin_us < best_plugins:
+                best_plugins, best_total = plugin_us, total_us
+
+        heavy = [
+            mod for mod in HEAVY_MODULES
+            if mod in times and mod not in allowed
+        ]
+        status = "ok"
+        if best_plugins / 1000 > opts.budget_ms:
+            status = "OVER BUDGET"
+            failed = True
+        if heavy:
+            status = f"imports {', '.join(heavy)}"
+            failed = True
+
+        print(
+            f"audible {' '.join(args):<20} "
+            f"plugins {best_plugins / 1000:7.1f}ms  "
+            f"total {best_total / 1000:7.1f}ms  "
+            f"[{status}]"
+        )
+
+    print(f"budget: {opts.budget_ms}ms of plugin import time per command")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
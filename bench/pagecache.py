@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""Served-file read latency during a decrypt run, with and without drop_cache
+
+Writes SERVED_MB of files standing in for what a web server on the box
+serves and reads them into the page cache. Then `Shelf.decrypt` runs over
+BOOKS fake `.aaxc` files of BOOK_MB each, with a stand-in `ffmpeg` on PATH
+that copies its input to the output like a stream-copy remux, once as is and
+once with `drop_cache`. Meanwhile a thread reads random 64 KiB blocks of the
+served files like the web server would; the read latencies and how much of
+the served files is still cached afterwards (with `fincore` from
+util-linux) are printed per run.
+
+The served files are only evicted once a run streams more than the free
+memory. To see that without writing tens of GB, run it in a cgroup with
+little memory, page cache is charged to it:
+
+    systemd-run --user --scope -p MemoryMax=1G \\
+        env PYTHONPATH=src python bench/pagecache.py --books 8 --book-mb 512
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import typing as t
+
+FAKE_FFMPEG = """#!{python}
+import shutil
+import sys
+
+args = sys.argv[1:]
+source = args[args.index("-i") + 1]
+for arg in args:
+    if arg.endswith(".m4a"):
+        with open(source, "rb") as src, open(arg, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+"""
+
+BLOCK = 64 * 1024
+
+
+def _write(path: pathlib.Path, size: int) -> None:
+    chunk = os.urandom(1024 * 1024)
+    with open(path, "wb") as f:
+        for _ in range(size // len(chunk)):
+            f.write(chunk)
+
+
+def _make_library(
+    directory: pathlib.Path,
+    count: int,
+    size: int
+) -> t.List[pathlib.Path]:
+    files = []
+    for i in range(count):
+        aaxc = directory / f"B{i:09d}_Title-AAX_44_64.aaxc"
+        _write(aaxc, size)
+        aaxc.with_suffix(".voucher").write_text(json.dumps({
+            "content_license": {
+                "asin": f"B{i:09d}",
+                "license_response": {"key": "00" * 16, "iv": "11" * 16},
+            }
+        }))
+        files.append(aaxc)
+    return files
+
+
+def _cached_bytes(files: t.List[pathlib.Path]) -> t.Optional[int]:
+    if shutil.which("fincore") is None:
+        return None
+    child = subprocess.run(  # noqa: S603, S607
+        ["fincore", "--bytes", "--noheadings", "--raw", "--output", "RES"]
+        + [str(f) for f in files],
+        capture_output=True,
+        text=True
+    )
+    if child.returncode != 0:
+        return None
+    return sum(int(line) for line in child.stdout.split())
+
+
+def _serve(
+    files: t.List[pathlib.Path],
+    stop: threading.Event,
+    latencies: t.List[float]
+) -> None:
+    fds = [os.open(f, os.O_RDONLY) for f in files]
+    size = files[0].stat().st_size
+    try:
+        while not stop.is_set():
+            fd = random.choice(fds)  # noqa: S311
+            offset = random.randrange(0, size, BLOCK)  # noqa: S311
+            start = time.perf_counter()
+            os.pread(fd, BLOCK, offset)
+            latencies.append(time.perf_counter() - start)
+            time.sleep(0.001)
+    finally:
+        for fd in fds:
+            os.close(fd)
+
+
+def _run(
+    files: t.List[pathlib.Path],
+    served: t.List[pathlib.Path],
+    target_dir: pathlib.Path,
+    drop_cache: bool
+) -> t.Tuple[t.List[float], float, t.Optional[int]]:
+    from shelf import Shelf
+    from shelf.pagecache import evict
+
+    for old in target_dir.glob("*.m4a"):
+        old.unlink()
+    # every run starts with cold downloads and warm served files
+    evict(files)
+    for file in served:
+        file.read_bytes()
+
+    stop = threading.Event()
+    latencies: t.List[float] = []
+    server = threading.Thread(target=_serve, args=(served, stop, latencies))
+    server.start()
+    start = time.perf_counter()
+    try:
+        with Shelf(drop_cache=drop_cache) as shelf:
+            results = shelf.decrypt(files, target_dir)
+    finally:
+        stop.set()
+        server.join()
+    elapsed = time.perf_counter() - start
+    failed = [job for job, error in results if error]
+    if failed:
+        raise RuntimeError(f"{len(failed)} jobs failed")
+    return latencies, elapsed, _cached_bytes(served)
+
+
+def _percentile(values: t.List[float], share: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--books", type=int, default=8)
+    parser.add_argument("--book-mb", type=int, default=256)
+    parser.add_argument("--served-mb", type=int, default=256)
+    parser.add_argument("--dir", help="Folder to work in, default a tempdir")
+    opts = parser.parse_args()
+
+    mib = 1024 * 1024
+    with tempfile.TemporaryDirectory(dir=opts.dir) as tmp:
+        tmp = pathlib.Path(tmp)
+        bin_dir, dl_dir, assets_dir, www_dir = (
+            tmp / "bin", tmp / "dl", tmp / "assets", tmp / "www"
+        )
+        for d in (bin_dir, dl_dir, assets_dir, www_dir):
+            d.mkdir()
+        ffmpeg = bin_dir / "ffmpeg"
+        ffmpeg.write_text(FAKE_FFMPEG.format(python=sys.executable))
+        ffmpeg.chmod(0o755)
+        os.environ["PATH"] = f"{bin_dir}{os.pathsep}{os.environ['PATH']}"
+
+        served = []
+        for i in range(max(1, opts.served_mb // 16)):
+            served.append(www_dir / f"served-{i}.m4a")
+            _write(served[-1], 16 * mib)
+        files = _make_library(dl_dir, opts.books, opts.book_mb * mib)
+        served_bytes = sum(f.stat().st_size for f in served)
+
+        print(
+            f"{opts.books} books of {opts.book_mb} MiB, "
+            f"{served_bytes // mib} MiB served"
+        )
+        for label, drop_cache in (("keep", False), ("drop", True)):
+            latencies, elapsed, cached = _run(
+                files, served, assets_dir, drop_cache
+            )
+            residency = "n/a" if cached is None \
+                else f"{100 * cached / served_bytes:5.1f}%"
+            print(
+                f"{label:<5} reads p50 {_percentile(latencies, .5) * 1e3:7.3f}"
+                f"ms  p99 {_percentile(latencies, .99) * 1e3:7.3f}ms  "
+                f"max {max(latencies) * 1e3:8.3f}ms  "
+                f"served cached {residency}  run {elapsed:6.2f}s"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,16 +8,138 @@
 : "${SHELF_START_DATE:=1901-12-12}" ; export SHELF_START_DATE
 : "${SHELF_END_DATE:=3000-01-01}" ; export SHELF_END_DATE
 : "${SHELF_IMG_DL_SIZE:=1215}" ; export SHELF_IMG_DL_SIZE
+: "${SHELF_WATCH:=}" ; export SHELF_WATCH
+: "${SHELF_DECRYPT_JOBS:=2}" ; export SHELF_DECRYPT_JOBS
+: "${SHELF_NICE:=10}" ; export SHELF_NICE
+: "${SHELF_IONICE:=best-effort}" ; export SHELF_IONICE
+# drop what decrypt and publish stream through from the page cache, so the
+# web server's files stay cached; empty to keep it
+: "${SHELF_DROP_CACHE=1}" ; export SHELF_DROP_CACHE
+: "${SHELF_FASTSTART:=}" ; export SHELF_FASTSTART
+: "${SHELF_HLS:=}" ; export SHELF_HLS
+# flat or hash, see `audible relayout` to change it for existing assets
+: "${SHELF_LAYOUT:=flat}" ; export SHELF_LAYOUT
+# upload changed assets and feeds after each restock (not with SHELF_WATCH);
+# credentials come from AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY
+: "${SHELF_PUBLISH_BUCKET:=}" ; export SHELF_PUBLISH_BUCKET
+: "${SHELF_PUBLISH_PREFIX:=}" ; export SHELF_PUBLISH_PREFIX
+: "${SHELF_PUBLISH_ENDPOINT:=https://s3.amazonaws.com}" ; export SHELF_PUBLISH_ENDPOINT
+# WebSub hub advertised in the feed, pinged when the feed changed
+: "${SHELF_WEBSUB_HUB:=}" ; export SHELF_WEBSUB_HUB
+# list what a restock would do and exit, see `--plan`
+: "${SHELF_PLAN:=}" ; export SHELF_PLAN
+# work budgets per run, e.g. 50G and 3600; the rest waits for the next run
+: "${SHELF_MAX_BYTES:=}" ; export SHELF_MAX_BYTES
+: "${SHELF_MAX_SECONDS:=}" ; export SHELF_MAX_SECONDS
+: "${SHELF_TELEMETRY:=${SHELF_TARGET_DIR}/telemetry.json}" ; export SHELF_TELEMETRY
+# download audio with `audible fetch` (AAX, resumable) instead of as AAXC
+: "${SHELF_FETCH:=}" ; export SHELF_FETCH
+# e.g. 64 to download no better codec, 5M to cap the download bytes/s
+: "${SHELF_FETCH_MAX_KBPS:=}" ; export SHELF_FETCH_MAX_KBPS
+: "${SHELF_FETCH_LIMIT_RATE:=}" ; export SHELF_FETCH_LIMIT_RATE
+# TOML file with several audible-cli profiles sharing one assets folder,
+# see `audible restock`; the other settings then only apply to downloads
+: "${SHELF_CONFIG:=}" ; export SHELF_CONFIG
+# share decrypting with restocks on other nodes mounting the same folders
+: "${SHELF_DISTRIBUTED:=}" ; export SHELF_DISTRIBUTED
+# keep identical decrypted files and covers once, hardlinked
+: "${SHELF_DEDUP:=}" ; export SHELF_DEDUP
+# space separated, e.g. "opus-32k aac-64k"
+: "${SHELF_VARIANTS:=}" ; export SHELF_VARIANTS
+
+variant_flags=""
+for variant in ${SHELF_VARIANTS}; do
+    variant_flags="${variant_flags} --variant ${variant}"
+done
+
+publish() {
+    audible publish \
+        --dir "$1" \
+        --bucket "${SHELF_PUBLISH_BUCKET}" \
+        --prefix "${SHELF_PUBLISH_PREFIX}" \
+        --endpoint-url "${SHELF_PUBLISH_ENDPOINT}" \
+        ${SHELF_DROP_CACHE:+--drop-cache} \
+        --delete
+}
+
+if [ -n "${SHELF_CONFIG}" ]; then
+    # every profile downloads to its own folder, then one process decrypts
+    # them all and writes every profile's feed
+    audible restock --config "${SHELF_CONFIG}" --show profiles |
+    while read -r profile downloads; do
+        mkdir -p "${downloads}"
+        ( cd "${downloads}" && audible -P "${profile}" download \
+            --aaxc \
+            --pdf \
+            --cover \
+            --cover-size "${SHELF_IMG_DL_SIZE}" \
+            --chapter \
+            --annotation \
+            --jobs 4 \
+            --quality best \
+            --filename-mode asin_ascii \
+            --ignore-podcasts \
+            --all \
+            --start-date "${SHELF_START_DATE}" \
+            --end-date "${SHELF_END_DATE}" )
+    done
+    audible restock --config "${SHELF_CONFIG}" || exit 1
+    if [ -n "${SHELF_PUBLISH_BUCKET}" ]; then
+        publish "$(audible restock --config "${SHELF_CONFIG}" --show assets)"
+    fi
+    exit 0
+fi
 
 cd "${SHELF_TARGET_DIR}" || exit 1
 mkdir -p "assets" "dl"
 cd "dl" || exit 1
 
+if [ -n "${SHELF_PLAN}" ]; then
+    # covers what is downloaded already, `audible download` has no dry run
+    audible decrypt \
+        --layout "${SHELF_LAYOUT}" \
+        --plan \
+        --all \
+        --dir "${SHELF_TARGET_DIR}/assets" \
+        --rebuild-chapters \
+        --force-rebuild-chapters \
+        --copy-asin-to-metadata \
+        --chapters-json \
+        --cover-size "${SHELF_IMG_DL_SIZE}" \
+        ${SHELF_MAX_BYTES:+--max-bytes "${SHELF_MAX_BYTES}"} \
+        ${SHELF_MAX_SECONDS:+--max-seconds "${SHELF_MAX_SECONDS}"} \
+        ${variant_flags}
+    cd "${SHELF_TARGET_DIR}/assets" || exit 1
+    audible rss \
+        --layout "${SHELF_LAYOUT}" \
+        --plan \
+        --all \
+        --name "${SHELF_TITLE}" \
+        --desc "${SHELF_DESC}" \
+        --image "${SHELF_IMAGE}" \
+        --url-prefix "${SHELF_URL_PREFIX}"
+    exit 0
+fi
+
 # audible library export \
 #    --format json
 
+audio_flags="--aaxc"
+if [ -n "${SHELF_FETCH}" ]; then
+    # the rest of every book still comes from `audible download`
+    audio_flags=""
+    audible fetch \
+        --dir . \
+        --assets "${SHELF_TARGET_DIR}/assets" \
+        --layout "${SHELF_LAYOUT}" \
+        ${SHELF_FETCH_MAX_KBPS:+--max-kbps "${SHELF_FETCH_MAX_KBPS}"} \
+        ${SHELF_FETCH_LIMIT_RATE:+--limit-rate "${SHELF_FETCH_LIMIT_RATE}"} \
+        --start-date "${SHELF_START_DATE}" \
+        --end-date "${SHELF_END_DATE}"
+fi
+
 audible download \
-    --aaxc \
+    ${audio_flags} \
     --pdf \
     --cover \
     --cover-size "${SHELF_IMG_DL_SIZE}" \
@@ -31,32 +153,74 @@ audible download \
     --start-date "${SHELF_START_DATE}" \
     --end-date "${SHELF_END_DATE}"
 
+# decrypt remuxes and cover scaling share one I/O-aware scheduler
 audible decrypt \
+    --layout "${SHELF_LAYOUT}" \
     --all \
     --dir "${SHELF_TARGET_DIR}/assets" \
     --rebuild-chapters \
     --force-rebuild-chapters \
-    --copy-asin-to-metadata
+    --copy-asin-to-metadata \
+    --chapters-json \
+    --cover-size "${SHELF_IMG_DL_SIZE}" \
+    --jobs "${SHELF_DECRYPT_JOBS}" \
+    --nice "${SHELF_NICE}" \
+    --ionice "${SHELF_IONICE}" \
+    ${SHELF_DROP_CACHE:+--drop-cache} \
+    ${SHELF_FASTSTART:+--faststart} \
+    ${SHELF_HLS:+--hls} \
+    ${SHELF_MAX_BYTES:+--max-bytes "${SHELF_MAX_BYTES}"} \
+    ${SHELF_MAX_SECONDS:+--max-seconds "${SHELF_MAX_SECONDS}"} \
+    ${SHELF_DISTRIBUTED:+--distributed} \
+    ${SHELF_DEDUP:+--dedup} \
+    ${variant_flags}
 
-for book in *.aaxc; do
-    img_target="${SHELF_TARGET_DIR}/assets/$(basename "${book}" .aaxc).jpg"
-    if [ ! -r "${img_target}" ]; then
-        img_regex="s/-AAX_[0-9_]+.aaxc/_(${SHELF_IMG_DL_SIZE})/"
-        img_src="$(echo "${book}" | sed -E "${img_regex}").jpg"
-        : "${img_src:="${book}"}"
+cd "${SHELF_TARGET_DIR}/assets" || exit 1
 
-        ffmpeg \
-            -i "${img_src}" \
-            -vf "scale=3000:3000:force_original_aspect_ratio=decrease,pad=3000:3000:(ow-iw)/2:(oh-ih)/2" \
-            -frames:v 1 \
-            -update 1 \
-            "${img_target}"
-    fi
-done
+if [ -n "${SHELF_WATCH}" ]; then
+    # keep decrypting new downloads and updating the feed as they land
+    ( cd "${SHELF_TARGET_DIR}/dl" && audible decrypt \
+        --layout "${SHELF_LAYOUT}" \
+        --watch \
+        --dir "${SHELF_TARGET_DIR}/assets" \
+        --rebuild-chapters \
+        --force-rebuild-chapters \
+        --copy-asin-to-metadata \
+        --chapters-json \
+        --cover-size "${SHELF_IMG_DL_SIZE}" \
+        --nice "${SHELF_NICE}" \
+        --ionice "${SHELF_IONICE}" \
+        ${SHELF_DROP_CACHE:+--drop-cache} \
+        ${SHELF_FASTSTART:+--faststart} \
+        ${SHELF_HLS:+--hls} \
+        ${SHELF_DEDUP:+--dedup} \
+        ${variant_flags} ) &
+fi
 
-cd "${SHELF_TARGET_DIR}/assets" || exit 1
+# one smaller feed per variant, rss-<variant> next to rss
+for variant in ${SHELF_VARIANTS}; do
+    audible rss \
+        --layout "${SHELF_LAYOUT}" \
+        --variant "${variant}" \
+        --all \
+        --overwrite \
+        --sort-by-purchase-date \
+        --use-library-api \
+        --start-date "${SHELF_START_DATE}" \
+        --end-date "${SHELF_END_DATE}" \
+        --name "${SHELF_TITLE} (${variant})" \
+        --desc "${SHELF_DESC}" \
+        --image "${SHELF_IMAGE}" \
+        --url-prefix "${SHELF_URL_PREFIX}"
+done
 
 audible rss \
+    --layout "${SHELF_LAYOUT}" \
+    ${SHELF_WATCH:+--watch} \
+    ${SHELF_HLS:+--hls} \
+    ${SHELF_WEBSUB_HUB:+--hub "${SHELF_WEBSUB_HUB}"} \
+    ${SHELF_PUBLISH_BUCKET:+--no-hub-ping} \
+    --library-page \
     --all \
     --overwrite \
     --sort-by-purchase-date \
@@ -67,3 +231,14 @@ audible rss \
     --desc "${SHELF_DESC}" \
     --image "${SHELF_IMAGE}" \
     --url-prefix "${SHELF_URL_PREFIX}"
+
+if [ -n "${SHELF_PUBLISH_BUCKET}" ]; then
+    publish "${SHELF_TARGET_DIR}/assets"
+    # the hub fetches the feed from the bucket, ping once it is there
+    if [ -n "${SHELF_WEBSUB_HUB}" ]; then
+        audible websub ping \
+            --feed "${SHELF_TARGET_DIR}/assets/rss" \
+            --feed-url "${SHELF_URL_PREFIX}rss" \
+            --hub "${SHELF_WEBSUB_HUB}"
+    fi
+fi
@@ -9,564 +9,26 @@ Needs at least ffmpeg 4.4
 """
 
 
-import json
-import operator
 import pathlib
-import re
-import subprocess  # noqa: S404
-import tempfile
 import typing as t
-from enum import Enum
-from functools import reduce
-from glob import glob
 from shutil import which
 
 import click
-from click import echo, secho
+from click import secho
 
 from audible_cli.decorators import pass_session
-from audible_cli.exceptions import AudibleCliException
 
-
-class ChapterError(AudibleCliException):
-    """Base class for all chapter errors."""
-
-
-class SupportedFiles(Enum):
-    AAX = ".aax"
-    AAXC = ".aaxc"
-
-    @classmethod
-    def get_supported_list(cls):
-        return list(set(item.value for item in cls))
-
-    @classmethod
-    def is_supported_suffix(cls, value):
-        return value in cls.get_supported_list()
-
-    @classmethod
-    def is_supported_file(cls, value):
-        return pathlib.PurePath(value).suffix in cls.get_supported_list()
-
-
-def _get_input_files(
-    files: t.Union[t.Tuple[str], t.List[str]],
-    recursive: bool = True
-) -> t.List[pathlib.Path]:
-    filenames = []
-    for filename in files:
-        # if the shell does not do filename globbing
-        expanded = list(glob(filename, recursive=recursive))
-
-        if (
-            len(expanded) == 0
-            and '*' not in filename
-            and not SupportedFiles.is_supported_file(filename)
-        ):
-            raise (click.BadParameter(
-                "{filename}: file not found or supported."
-            ))
-
-        expanded_filter = filter(
-            lambda x: SupportedFiles.is_supported_file(x), expanded
-        )
-        expanded = list(
-            map(lambda x: pathlib.Path(x).resolve(), expanded_filter)
-        )
-        filenames.extend(expanded)
-
-    return filenames
-
-
-def recursive_lookup_dict(key: str, dictionary: t.Dict[str, t.Any]) -> t.Any:
-    if key in dictionary:
-        return dictionary[key]
-    for value in dictionary.values():
-        if isinstance(value, dict):
-            try:
-                item = recursive_lookup_dict(key, value)
-            except KeyError:
-                continue
-            else:
-                return item
-
-    raise KeyError
-
-
-def get_aaxc_credentials(voucher_file: pathlib.Path):
-    if not voucher_file.exists() or not voucher_file.is_file():
-        raise AudibleCliException(f"Voucher file {voucher_file} not found.")
-
-    voucher_dict = json.loads(voucher_file.read_text())
-    try:
-        key = recursive_lookup_dict("key", voucher_dict)
-        iv = recursive_lookup_dict("iv", voucher_dict)
-    except KeyError:
-        raise AudibleCliException(
-            f"No key/iv found in file {voucher_file}."
-        ) from None
-
-    return key, iv
-
-
-def get_aaxc_asin(voucher_file: pathlib.Path):
-    if not voucher_file.exists() or not voucher_file.is_file():
-        raise AudibleCliException(f"Voucher file {voucher_file} not found.")
-
-    voucher_dict = json.loads(voucher_file.read_text())
-    try:
-        asin = recursive_lookup_dict("asin", voucher_dict)
-    except KeyError:
-        raise AudibleCliException(
-            f"No ASIN found in file {voucher_file}."
-        ) from None
-    return asin
-
-
-class ApiChapterInfo:
-    def __init__(self, content_metadata: t.Dict[str, t.Any]) -> None:
-        chapter_info = self._parse(content_metadata)
-        self._chapter_info = chapter_info
-
-    @classmethod
-    def from_file(cls, file: t.Union[pathlib.Path, str]) -> "ApiChapterInfo":
-        file = pathlib.Path(file)
-        if not file.exists() or not file.is_file():
-            raise ChapterError(f"Chapter file {file} not found.")
-        content_string = pathlib.Path(file).read_text("utf-8")
-        content_json = json.loads(content_string)
-        return cls(content_json)
-
-    @staticmethod
-    def _parse(content_metadata: t.Dict[str, t.Any]) -> t.Dict[str, t.Any]:
-        if "chapters" in content_metadata:
-            return content_metadata
-
-        try:
-            return recursive_lookup_dict("chapter_info", content_metadata)
-        except KeyError:
-            raise ChapterError("No chapter info found.") from None
-
-    def count_chapters(self):
-        return len(self.get_chapters())
-
-    def get_chapters(self, separate_intro_outro=False):
-        def extract_chapters(initial, current):
-            if "chapters" in current:
-                return initial + [current] + current["chapters"]
-            else:
-                return initial + [current]
-
-        chapters = list(
-            reduce(
-                extract_chapters,
-                self._chapter_info["chapters"],
-                [],
-            )
-        )
-
-        if separate_intro_outro:
-            return self._separate_intro_outro(chapters)
-
-        return chapters
-
-    def get_intro_duration_ms(self):
-        return self._chapter_info["brandIntroDurationMs"]
-
-    def get_outro_duration_ms(self):
-        return self._chapter_info["brandOutroDurationMs"]
-
-    def get_runtime_length_ms(self):
-        return self._chapter_info["runtime_length_ms"]
-
-    def is_accurate(self):
-        return self._chapter_info["is_accurate"]
-
-    def _separate_intro_outro(self, chapters):
-        echo("Separate Audible Brand Intro and Outro to own Chapter.")
-        chapters.sort(key=operator.itemgetter("start_offset_ms"))
-
-        first = chapters[0]
-        intro_dur_ms = self.get_intro_duration_ms()
-        first["start_offset_ms"] = intro_dur_ms
-        first["start_offset_sec"] = round(first["start_offset_ms"] / 1000)
-        first["length_ms"] -= intro_dur_ms
-
-        last = chapters[-1]
-        outro_dur_ms = self.get_outro_duration_ms()
-        last["length_ms"] -= outro_dur_ms
-
-        chapters.append(
-            {
-                "length_ms": intro_dur_ms,
-                "start_offset_ms": 0,
-                "start_offset_sec": 0,
-                "title": "Intro",
-            }
-        )
-        chapters.append(
-            {
-                "length_ms": outro_dur_ms,
-                "start_offset_ms": self.get_runtime_length_ms() - outro_dur_ms,
-                "start_offset_sec": round(
-                    (self.get_runtime_length_ms() - outro_dur_ms) / 1000
-                ),
-                "title": "Outro",
-            }
-        )
-        chapters.sort(key=operator.itemgetter("start_offset_ms"))
-
-        return chapters
-
-
-class FFMeta:
-    SECTION = re.compile(r"\[(?P<header>[^]]+)\]")
-    OPTION = re.compile(r"(?P<option>.*?)\s*(?:(?P<vi>=)\s*(?P<value>.*))?$")
-
-    def __init__(self, ffmeta_file: t.Union[str, pathlib.Path]) -> None:
-        self._ffmeta_raw = pathlib.Path(ffmeta_file).read_text("utf-8")
-        self._ffmeta_parsed = self._parse_ffmeta()
-
-    def _parse_ffmeta(self):
-        parsed_dict = {}
-        start_section = "_"
-        cursec = parsed_dict[start_section] = {}
-        num_chap = 0
-
-        for line in iter(self._ffmeta_raw.splitlines()):
-            mo = self.SECTION.match(line)
-            if mo:
-                sec_name = mo.group("header")
-                if sec_name == "CHAPTER":
-                    num_chap += 1
-                    if sec_name not in parsed_dict:
-                        parsed_dict[sec_name] = {}
-                    cursec = parsed_dict[sec_name][num_chap] = {}
-                else:
-                    cursec = parsed_dict[sec_name] = {}
-            else:
-                match = self.OPTION.match(line)
-                cursec.update({match.group("option"): match.group("value")})
-
-        return parsed_dict
-
-    def count_chapters(self):
-        return len(self._ffmeta_parsed["CHAPTER"])
-
-    @property
-    def date(self):
-        return self._ffmeta_parsed["_"]['date']
-
-    @property
-    def genre(self):
-        return self._ffmeta_parsed["_"]['genre']
-
-    @property
-    def title(self):
-        return self._ffmeta_parsed["_"]['title']
-
-    @property
-    def artist(self):
-        return self._ffmeta_parsed["_"]['artist']
-
-    @property
-    def album_artist(self):
-        return self._ffmeta_parsed["_"]['album_artist']
-
-    @property
-    def album(self):
-        return self._ffmeta_parsed["_"]['album']
-
-    @property
-    def comment(self):
-        return self._ffmeta_parsed["_"]['comment']
-
-    @property
-    def copyright(self):
-        return self._ffmeta_parsed["_"]['copyright']
-
-    def set_chapter_option(self, num, option, value):
-        chapter = self._ffmeta_parsed["CHAPTER"][num]
-        for chapter_option in chapter:
-            if chapter_option == option:
-                chapter[chapter_option] = value
-
-    def write(self, filename):
-        fp = pathlib.Path(filename).open("w", encoding="utf-8")
-        d = "="
-
-        for section in self._ffmeta_parsed:
-            if section == "_":
-                self._write_section(fp, None, self._ffmeta_parsed[section], d)
-            elif section == "CHAPTER":
-                # TODO: Tue etwas
-                for chapter in self._ffmeta_parsed[section]:
-                    self._write_section(
-                        fp, section, self._ffmeta_parsed[section][chapter], d
-                    )
-            else:
-                self._write_section(
-                    fp, section, self._ffmeta_parsed[section], d
-                )
-
-    @staticmethod
-    def _write_section(fp, section_name, section_items, delimiter):
-        """Write a single section to the specified `fp`."""
-        if section_name is not None:
-            fp.write(f"[{section_name}]\n")
-
-        for key, value in section_items.items():
-            if value is None:
-                fp.write(f"{key}\n")
-            else:
-                fp.write(f"{key}{delimiter}{value}\n")
-
-    def update_chapters_from_chapter_info(
-        self,
-        chapter_info: ApiChapterInfo,
-        force_rebuild_chapters: bool = False,
-        separate_intro_outro: bool = False
-    ) -> None:
-        if not chapter_info.is_accurate():
-            echo("Metadata from API is not accurate. Skip.")
-            return
-
-        if chapter_info.count_chapters() != self.count_chapters():
-            if force_rebuild_chapters:
-                echo("Force rebuild chapters due to chapter mismatch.")
-            else:
-                raise ChapterError("Chapter mismatch")
-
-        echo(f"Found {chapter_info.count_chapters()} chapters to prepare.")
-
-        api_chapters = chapter_info.get_chapters(separate_intro_outro)
-
-        num_chap = 0
-        new_chapters = {}
-        for chapter in api_chapters:
-            chap_start = chapter["start_offset_ms"]
-            chap_end = chap_start + chapter["length_ms"]
-            num_chap += 1
-            new_chapters[num_chap] = {
-                "TIMEBASE": "1/1000",
-                "START": chap_start,
-                "END": chap_end,
-                "title": chapter["title"],
-            }
-        self._ffmeta_parsed["CHAPTER"] = new_chapters
-
-
-def _get_voucher_filename(file: pathlib.Path) -> pathlib.Path:
-    return file.with_suffix(".voucher")
-
-
-def _get_chapter_filename(file: pathlib.Path) -> pathlib.Path:
-    base_filename = file.stem.rsplit("-", 1)[0]
-    return file.with_name(base_filename + "-chapters.json")
-
-
-def _get_ffmeta_file(file: pathlib.Path,
-                     tempdir: pathlib.Path
-                     ) -> pathlib.Path:
-    metaname = file.with_suffix(".meta").name
-    metafile = tempdir / metaname
-    return metafile
-
-
-class FfmpegFileDecrypter:
-    def __init__(
-        self,
-        file: pathlib.Path,
-        target_dir: pathlib.Path,
-        tempdir: pathlib.Path,
-        activation_bytes: t.Optional[str],
-        overwrite: bool,
-        rebuild_chapters: bool,
-        force_rebuild_chapters: bool,
-        skip_rebuild_chapters: bool,
-        separate_intro_outro: bool,
-        copy_asin_to_metadata: bool
-    ) -> None:
-        file_type = SupportedFiles(file.suffix)
-
-        credentials = None
-        asin = None
-        if file_type == SupportedFiles.AAX:
-            if activation_bytes is None:
-                raise AudibleCliException(
-                    "No activation bytes found. Do you ever run "
-                    "`audible activation-bytes`?"
-                )
-            credentials = activation_bytes
-        elif file_type == SupportedFiles.AAXC:
-            voucher_filename = _get_voucher_filename(file)
-            credentials = get_aaxc_credentials(voucher_filename)
-            if copy_asin_to_metadata:
-                asin = get_aaxc_asin(voucher_filename)
-
-        self._source = file
-        self._credentials: t.Optional[t.Union[str, t.Tuple[str]]] = credentials
-        self._target_dir = target_dir
-        self._tempdir = tempdir
-        self._overwrite = overwrite
-        self._rebuild_chapters = rebuild_chapters
-        self._force_rebuild_chapters = force_rebuild_chapters
-        self._skip_rebuild_chapters = skip_rebuild_chapters
-        self._separate_intro_outro = separate_intro_outro
-        self._api_chapter: t.Optional[ApiChapterInfo] = None
-        self._ffmeta: t.Optional[FFMeta] = None
-        self._is_rebuilded: bool = False
-        self._asin = asin
-        self._copy_asin_to_metadata = copy_asin_to_metadata
-
-    @property
-    def api_chapter(self) -> ApiChapterInfo:
-        if self._api_chapter is None:
-            try:
-                voucher_filename = _get_voucher_filename(self._source)
-                self._api_chapter = ApiChapterInfo.from_file(voucher_filename)
-            except ChapterError:
-                voucher_filename = _get_chapter_filename(self._source)
-                self._api_chapter = ApiChapterInfo.from_file(voucher_filename)
-            echo(f"Using chapters from {voucher_filename}")
-        return self._api_chapter
-
-    @property
-    def ffmeta(self) -> FFMeta:
-        if self._ffmeta is None:
-            metafile = _get_ffmeta_file(self._source, self._tempdir)
-
-            base_cmd = [
-                "ffmpeg",
-                "-v",
-                "info",
-                "-stats",
-            ]
-            if isinstance(self._credentials, tuple):
-                key, iv = self._credentials
-                credentials_cmd = [
-                    "-audible_key",
-                    key,
-                    "-audible_iv",
-                    iv,
-                ]
-            else:
-                credentials_cmd = [
-                    "-activation_bytes",
-                    self._credentials,
-                ]
-            base_cmd.extend(credentials_cmd)
-
-            extract_cmd = [
-                "-i",
-                str(self._source),
-                "-f",
-                "ffmetadata",
-                str(metafile),
-            ]
-            base_cmd.extend(extract_cmd)
-
-            subprocess.check_output(base_cmd, text=True)  # noqa: S603
-            self._ffmeta = FFMeta(metafile)
-
-        return self._ffmeta
-
-    def rebuild_chapters(self) -> None:
-        if not self._is_rebuilded:
-            self.ffmeta.update_chapters_from_chapter_info(
-                self.api_chapter,
-                self._force_rebuild_chapters,
-                self._separate_intro_outro
-            )
-            self._is_rebuilded = True
-
-    def run(self):
-        oname = self._source.with_suffix(".m4a").name
-        outfile = self._target_dir / oname
-
-        if outfile.exists():
-            if self._overwrite:
-                secho(f"Overwrite {outfile}: already exists", fg="blue")
-            else:
-                secho(f"Skip {outfile}: already exists", fg="blue")
-                return
-
-        base_cmd = [
-            "ffmpeg",
-            "-v",
-            "info",
-            "-stats",
-        ]
-        if self._overwrite:
-            base_cmd.append("-y")
-        if isinstance(self._credentials, tuple):
-            key, iv = self._credentials
-            credentials_cmd = [
-                "-audible_key",
-                str(key),
-                "-audible_iv",
-                str(iv),
-            ]
-        else:
-            credentials_cmd = [
-                "-activation_bytes",
-                str(self._credentials),
-            ]
-        base_cmd.extend(credentials_cmd)
-        base_cmd.extend(
-            [
-                "-i",
-                str(self._source),
-            ]
-        )
-
-        if self._rebuild_chapters:
-            metafile = _get_ffmeta_file(self._source, self._tempdir)
-            try:
-                self.rebuild_chapters()
-                self.ffmeta.write(metafile)
-            except ChapterError:
-                if self._skip_rebuild_chapters:
-                    echo("Skip rebuild chapters due to chapter mismatch.")
-                else:
-                    raise
-            else:
-                base_cmd.extend(
-                    [
-                        "-i",
-                        str(metafile),
-                        "-map_metadata",
-                        "0",
-                        "-map_chapters",
-                        "1",
-                    ]
-                )
-        else:
-            base_cmd.extend(["-map_metadata", "0"])
-
-        if self._copy_asin_to_metadata and self._asin:
-            base_cmd.extend(
-                [
-                    "-metadata:g",
-                    f"description=DescrpTION {self.ffmeta.comment}",
-                    "-metadata:g",
-                    f"synopsis=SynopSIS {self.ffmeta.comment}",
-                    "-metadata:g",
-                    f"episode_id={self._asin}",
-                ]
-            )
-
-        base_cmd.extend(
-            [
-                "-c",
-                "copy",
-                str(outfile),
-            ]
-        )
-
-        subprocess.check_output(base_cmd, text=True)  # noqa: S603
-
-        echo(f"File decryption successful: {outfile}")
+from shelf import (
+    EncryptedFiles,
+    FileNotSupported,
+    Layout,
+    LeaseDir,
+    Priority,
+    ShelfError,
+)
+from shelf.layout import LAYOUTS
+from shelf.lease import LEASE_DIR, LEASE_TTL
+from shelf.scheduler import IONICE_CLASSES
 
 
 @click.command("decrypt")  # noqa: E302
@@ -633,6 +95,219 @@ class FfmpegFileDecrypter:
         "the decrypted file's metadata tags."
     )
 )
+@click.option(
+    "--split-chapters",
+    is_flag=True,
+    help=(
+        "Write one file per chapter into a folder named after the book, "
+        "cut by stream copy from a single read of the input. Uses the "
+        "rebuilt chapters with `--rebuild-chapters`."
+    )
+)
+@click.option(
+    "--keep-full",
+    is_flag=True,
+    help="With `--split-chapters`, also write the full file in the same pass."
+)
+@click.option(
+    "--chapters-json",
+    is_flag=True,
+    help=(
+        "Write the final chapters of every book as a Podcasting 2.0 JSON "
+        "sidecar (<book>.chapters.json), which `audible rss` links to. "
+        "Existing outputs get theirs without being decrypted again."
+    )
+)
+@click.option(
+    "--faststart",
+    is_flag=True,
+    help=(
+        "Move the MP4 index to the front of every output, so streaming "
+        "clients can start playing and seek without fetching the end first."
+    )
+)
+@click.option(
+    "--hls",
+    is_flag=True,
+    help=(
+        "Also write a fragmented MP4 HLS package (segments and "
+        "index.m3u8) per book into <book>.hls/, in the same pass."
+    )
+)
+@click.option(
+    "--variant",
+    "variants",
+    multiple=True,
+    help=(
+        "Also encode every decrypted book to this codec and bitrate, e.g. "
+        "`opus-32k` or `aac-64k`, into a folder of that name. Repeat for "
+        "more variants, all are encoded from one decode."
+    )
+)
+@click.option(
+    "--layout",
+    type=click.Choice(LAYOUTS),
+    default="flat",
+    show_default=True,
+    help=(
+        "Where in `--dir` every book's files go: all in it, or `hash`ed "
+        "into 256 subfolders, for libraries too big for one folder. Use "
+        "the same with `audible rss`, move existing files with "
+        "`audible relayout`."
+    )
+)
+@click.option(
+    "--cover-size",
+    type=int,
+    help=(
+        "Also scale the covers downloaded with `audible download --cover "
+        "--cover-size COVER_SIZE` to square 3000px jpegs next to the "
+        "decrypted files. Existing covers are kept unless `--overwrite`."
+    )
+)
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(1),
+    default=1,
+    show_default=True,
+    help="Number of decrypt and cover jobs to run at the same time."
+)
+@click.option(
+    "--io-per-device",
+    type=click.IntRange(1),
+    default=2,
+    show_default=True,
+    help=(
+        "Max. decrypt jobs reading from or writing to the same disk at "
+        "the same time, no matter how many `--jobs`."
+    )
+)
+@click.option(
+    "--batch-under",
+    type=click.IntRange(1),
+    help=(
+        "Decrypt files smaller than this many MiB in batches, several "
+        "files per ffmpeg process. Saves process startup and probing for "
+        "short titles."
+    )
+)
+@click.option(
+    "--batch-max",
+    type=click.IntRange(2),
+    default=32,
+    show_default=True,
+    help="Max. files per batch, see `--batch-under`."
+)
+@click.option(
+    "--nice",
+    type=click.IntRange(-20, 19),
+    help="Run ffmpeg with this nice value."
+)
+@click.option(
+    "--ionice",
+    "ionice_class",
+    type=click.Choice(list(IONICE_CLASSES)),
+    help="Run ffmpeg in this ionice scheduling class."
+)
+@click.option(
+    "--drop-cache",
+    is_flag=True,
+    help=(
+        "Drop the downloads and outputs of every decrypt job from the page "
+        "cache once it is done, so they don't push out what a web server "
+        "on this box serves."
+    )
+)
+@click.option(
+    "--watch",
+    is_flag=True,
+    help=(
+        "After decrypting FILES, keep running and decrypt every new aax, "
+        "or aaxc once its voucher exists, in the current folder. "
+        "Linux only (inotify)."
+    )
+)
+@click.option(
+    "--debounce",
+    type=float,
+    default=2.0,
+    show_default=True,
+    help="Seconds a file must be quiet before `--watch` picks it up."
+)
+@click.option(
+    "--plan",
+    "plan_only",
+    is_flag=True,
+    help=(
+        "Only list what would be decrypted, scaled and encoded, with "
+        "estimated bytes and time from past runs, then exit."
+    )
+)
+@click.option(
+    "--max-bytes",
+    help=(
+        "Only do as much work as fits into this many bytes read plus "
+        "written (e.g. 50G), newest downloads first. The rest is left for "
+        "the next run."
+    )
+)
+@click.option(
+    "--max-seconds",
+    type=click.FloatRange(0),
+    help="Like `--max-bytes`, for the estimated run time."
+)
+@click.option(
+    "--distributed",
+    is_flag=True,
+    help=(
+        "Share the work with `audible decrypt --distributed` on other "
+        "nodes that mount the same folders: every job is claimed with a "
+        f"lease file in `--dir`/{LEASE_DIR}, and taken over from nodes "
+        "that stop renewing theirs. Each node exits when all work is done."
+    )
+)
+@click.option(
+    "--lease-ttl",
+    type=click.FloatRange(1),
+    default=LEASE_TTL,
+    show_default=True,
+    help="Seconds without renewal after which a node's lease expires."
+)
+@click.option(
+    "--dedup",
+    is_flag=True,
+    help=(
+        "Keep decrypted files and covers once per content, in "
+        "`--dir`/.shelf-objects, hardlinked to their names; a download "
+        "decrypted before (same voucher key/iv and size) is linked "
+        "instead of decrypted again."
+    )
+)
+@click.option(
+    "--verify",
+    is_flag=True,
+    help=(
+        "Check the already decrypted outputs of FILES instead of "
+        "decrypting: container index, duration against the voucher and, "
+        "with the same chapter/metadata options as the decrypt run, "
+        "chapter count and episode_id tag."
+    )
+)
+@click.option(
+    "--verify-sample",
+    type=click.IntRange(0),
+    default=0,
+    show_default=True,
+    help="With `--verify`, also decode this many random 10s windows per file."
+)
+@click.option(
+    "--verify-tolerance",
+    type=click.FloatRange(0),
+    default=2.0,
+    show_default=True,
+    help="With `--verify`, allowed duration difference in seconds."
+)
 @pass_session
 def cli(
     session,
@@ -645,6 +320,32 @@ def cli(
     skip_rebuild_chapters: bool,
     copy_asin_to_metadata: bool,
     separate_intro_outro: bool,
+    split_chapters: bool,
+    keep_full: bool,
+    chapters_json: bool,
+    faststart: bool,
+    hls: bool,
+    variants: t.Tuple[str],
+    layout: str,
+    cover_size: t.Optional[int],
+    jobs: int,
+    io_per_device: int,
+    batch_under: t.Optional[int],
+    batch_max: int,
+    nice: t.Optional[int],
+    ionice_class: t.Optional[str],
+    drop_cache: bool,
+    watch: bool,
+    debounce: float,
+    plan_only: bool,
+    max_bytes: t.Optional[str],
+    max_seconds: t.Optional[float],
+    distributed: bool,
+    lease_ttl: float,
+    dedup: bool,
+    verify: bool,
+    verify_sample: int,
+    verify_tolerance: float,
 ):
     """Decrypt audiobooks downloaded with audible-cli.
 
@@ -678,23 +379,139 @@ def cli(
             raise click.BadOptionUsage(
                 "If using `--all`, no FILES arguments can be used."
             )
-        files = [
-            f"*{suffix}" for suffix in SupportedFiles.get_supported_list()
-        ]
+        files = EncryptedFiles.get_all_patterns()
+
+    if keep_full and not split_chapters:
+        raise click.BadOptionUsage(
+            "keep_full",
+            "`--keep-full` can only be used together with `--split-chapters`"
+        )
+
+    from shelf.variants import Variant
+
+    try:
+        variants = [Variant.parse(v) for v in variants]
+    except ShelfError as exc:
+        raise click.BadParameter(str(exc), param_hint="--variant") from None
+
+    if max_bytes is not None:
+        from shelf.plan import parse_size
+
+        try:
+            max_bytes = parse_size(max_bytes)
+        except ShelfError as exc:
+            raise click.BadParameter(
+                str(exc), param_hint="--max-bytes"
+            ) from None
+
+    if verify and watch:
+        raise click.BadOptionUsage(
+            "verify", "`--verify` and `--watch` can not be used together"
+        )
 
-    files = _get_input_files(files, recursive=True)
-    with tempfile.TemporaryDirectory() as tempdir:
-        for file in files:
-            decrypter = FfmpegFileDecrypter(
-                file=file,
-                target_dir=pathlib.Path(directory).resolve(),
-                tempdir=pathlib.Path(tempdir).resolve(),
-                activation_bytes=session.auth.activation_bytes,
-                overwrite=overwrite,
-                rebuild_chapters=rebuild_chapters,
-                force_rebuild_chapters=force_rebuild_chapters,
-                skip_rebuild_chapters=skip_rebuild_chapters,
-                separate_intro_outro=separate_intro_outro,
-                copy_asin_to_metadata=copy_asin_to_metadata
+    leases = None
+    if distributed and not (verify or plan_only):
+        leases = LeaseDir(pathlib.Path(directory) / LEASE_DIR, ttl=lease_ttl)
+    store = None
+    if dedup and not (verify or plan_only):
+        from shelf.store import STORE_DIR, ContentStore
+
+        store = ContentStore(pathlib.Path(directory) / STORE_DIR)
+
+    from shelf import Shelf
+
+    shelf = Shelf(
+        jobs=jobs,
+        io_per_device=io_per_device,
+        priority=Priority(nice=nice, ionice_class=ionice_class),
+        layout=Layout(layout),
+        leases=leases,
+        store=store,
+        drop_cache=drop_cache
+    )
+    try:
+        files = shelf.find_encrypted(files, recursive=True)
+    except FileNotSupported as exc:
+        raise click.BadParameter(str(exc)) from None
+
+    decrypter_options = dict(
+        target_dir=directory,
+        activation_bytes=session.auth.activation_bytes,
+        overwrite=overwrite,
+        rebuild_chapters=rebuild_chapters,
+        force_rebuild_chapters=force_rebuild_chapters,
+        skip_rebuild_chapters=skip_rebuild_chapters,
+        separate_intro_outro=separate_intro_outro,
+        copy_asin_to_metadata=copy_asin_to_metadata,
+        split_chapters=split_chapters,
+        keep_full=keep_full,
+        chapters_json=chapters_json,
+        faststart=faststart,
+        hls=hls,
+        cover_size=cover_size,
+        variants=variants,
+        batch_under=batch_under * 1024 * 1024 if batch_under else None,
+        batch_max=batch_max
+    )
+    if verify:
+        results = shelf.verify(
+            files,
+            target_dir=directory,
+            rebuild_chapters=rebuild_chapters,
+            skip_rebuild_chapters=skip_rebuild_chapters,
+            separate_intro_outro=separate_intro_outro,
+            copy_asin_to_metadata=copy_asin_to_metadata,
+            tolerance_ms=int(verify_tolerance * 1000),
+            sample=verify_sample
+        )
+        broken = [result for result in results if not result.ok]
+        for result in broken:
+            secho(f"{result.file}: {'; '.join(result.problems)}", fg="red")
+        if broken:
+            raise click.ClickException(
+                f"{len(broken)} of {len(results)} files failed verification"
+            )
+        secho(f"{len(results)} files ok", fg="green")
+        return
+
+    if plan_only:
+        plan = shelf.plan_decrypt(
+            files,
+            **{k: v for k, v in decrypter_options.items()
+               if k not in ("batch_under", "batch_max")}
+        )
+        plan.echo()
+        if max_bytes is not None or max_seconds is not None:
+            selected, deferred = plan.within(max_bytes, max_seconds)
+            secho(
+                f"Within budget: {len(selected)} files, "
+                f"deferred: {len(deferred)}",
+                fg="blue"
             )
-            decrypter.run()
+        return
+
+    with shelf:
+        results = shelf.decrypt(
+            files,
+            max_bytes=max_bytes,
+            max_seconds=max_seconds,
+            **decrypter_options
+        )
+        failed = [(job, error) for job, error in results if error]
+        for job, error in failed:
+            secho(f"{job.name} failed: {error}", fg="red")
+
+        if watch:
+            from shelf.watch import watch_decrypt
+
+            watch_decrypt(
+                shelf,
+                dl_dir=pathlib.Path.cwd(),
+                debounce=debounce,
+                **decrypter_options
+            )
+
+    if failed:
+        raise click.ClickException(
+            f"{len(failed)} of {len(results)} jobs failed"
+        )
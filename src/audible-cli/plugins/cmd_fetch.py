@@ -0,0 +1,186 @@
+"""Downloads the books that are not on the shelf yet.
+
+Unlike `audible download --all`, which checks every book of the library
+against the download folder, the books to fetch are the library minus the
+ASINs already decrypted to the assets folder (or downloaded). Partial
+downloads resume, large files come in parallel byte ranges.
+"""
+
+import asyncio
+import concurrent.futures
+import pathlib
+import typing as t
+
+import click
+from click import echo, secho
+
+from audible_cli.decorators import (
+    bunch_size_option,
+    end_date_option,
+    pass_client,
+    pass_session,
+    start_date_option,
+)
+
+from shelf import Layout, ShelfError, fetch_library
+from shelf.layout import LAYOUTS
+from shelf.library import PAGE_SIZE
+
+
+@click.command("fetch")  # noqa: E302
+@click.argument("asins", nargs=-1)
+@click.option(
+    "--dir",
+    "-d",
+    "directory",
+    type=click.Path(file_okay=False),
+    default=pathlib.Path.cwd(),
+    help="Folder to download to, as given to `audible decrypt`.",
+    show_default=True
+)
+@click.option(
+    "--assets",
+    type=click.Path(file_okay=False),
+    required=True,
+    help="Assets folder (`audible decrypt --dir`); books in it are skipped."
+)
+@click.option(
+    "--layout",
+    type=click.Choice(LAYOUTS),
+    default="flat",
+    show_default=True,
+    help="Layout of the assets folder."
+)
+@click.option(
+    "--max-kbps",
+    type=click.IntRange(1),
+    help="Highest bit rate to download, e.g. 64. Default: the best."
+)
+@click.option(
+    "--limit-rate",
+    help="Cap all downloads together at this many bytes/s, e.g. 5M."
+)
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(1),
+    default=2,
+    show_default=True,
+    help="Books to download at the same time."
+)
+@click.option(
+    "--segments",
+    type=click.IntRange(1),
+    default=4,
+    show_default=True,
+    help="Byte ranges to download a large book in, in parallel."
+)
+@click.option(
+    "--dry-run",
+    is_flag=True,
+    help="Only list what would be downloaded."
+)
+@bunch_size_option(default=PAGE_SIZE)
+@start_date_option
+@end_date_option
+@pass_session
+@pass_client
+async def cli(
+    session,
+    client,
+    asins: t.Tuple[str, ...],
+    directory: t.Union[pathlib.Path, str],
+    assets: str,
+    layout: str,
+    max_kbps: t.Optional[int],
+    limit_rate: t.Optional[str],
+    jobs: int,
+    segments: int,
+    dry_run: bool,
+):
+    """Download the AAX of every book (or ASINS) not on the shelf yet."""
+    # httpx is only needed here
+    import httpx
+    from shelf.download import (
+        RateLimiter,
+        SegmentedDownload,
+        aax_filename,
+        choose_codec,
+        get_aax_url,
+        local_asins,
+    )
+    from shelf.plan import format_size, parse_size
+
+    limiter = None
+    if limit_rate is not None:
+        try:
+            limiter = RateLimiter(parse_size(limit_rate))
+        except ShelfError as exc:
+            raise click.BadParameter(
+                str(exc), param_hint="--limit-rate"
+            ) from None
+
+    directory = pathlib.Path(directory).resolve()
+    books = await fetch_library(
+        client,
+        bunch_size=session.params.get("bunch_size"),
+        start_date=session.params.get("start_date"),
+        end_date=session.params.get("end_date")
+    )
+    have = local_asins(pathlib.Path(assets), Layout(layout), directory)
+
+    todo = []
+    for asin, book in books.items():
+        if asin in have or (asins and asin not in asins):
+            continue
+        codec = choose_codec(book["codecs"], max_kbps=max_kbps)
+        if codec is None:
+            secho(f"Skip {asin}: no AAX codec to download", fg="yellow")
+            continue
+        name = aax_filename(asin, book["title"], book["codecs"][codec])
+        todo.append((asin, codec, directory / name))
+    echo(f"{len(todo)} books to fetch, {len(have)} on the shelf")
+    if dry_run:
+        for asin, codec, target in todo:
+            echo(f"{target.name} ({codec})")
+        return
+
+    directory.mkdir(parents=True, exist_ok=True)
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(jobs)
+    failed = []
+    # the link is fetched right before each download, they expire
+    with httpx.Client(
+        timeout=httpx.Timeout(30.0, connect=10.0),
+        follow_redirects=True,
+        limits=httpx.Limits(max_connections=jobs * segments)
+    ) as http, concurrent.futures.ThreadPoolExecutor(
+        max_workers=jobs, thread_name_prefix="fetch"
+    ) as executor:
+
+        async def fetch(asin: str, codec: str, target: pathlib.Path):
+            async with semaphore:
+                try:
+                    url = await get_aax_url(client, asin, codec)
+                    download = SegmentedDownload(
+                        url,
+                        target,
+                        http,
+                        segments=segments,
+                        limiter=limiter
+                    )
+                    await loop.run_in_executor(executor, download.run)
+                except (ShelfError, httpx.HTTPError) as exc:
+                    secho(str(exc), fg="red")
+                    failed.append(asin)
+                    return
+            size = format_size(target.stat().st_size)
+            secho(f"Downloaded {target.name} ({size})", fg="green")
+
+        await asyncio.gather(*(fetch(*item) for item in todo))
+
+    if failed:
+        raise click.ClickException(
+            f"{len(failed)} of {len(todo)} downloads failed: "
+            f"{' '.join(failed)}"
+        )
@@ -0,0 +1,106 @@
+"""Uploads the assets folder to S3-compatible object storage.
+
+Only files changed since the last publish are uploaded, media before the
+feeds that point at it.
+"""
+
+import pathlib
+import typing as t
+
+import click
+from click import secho
+
+from shelf import ShelfError
+
+
+@click.command("publish")  # noqa: E302
+@click.option(
+    "--dir",
+    "-d",
+    "directory",
+    type=click.Path(exists=True, file_okay=False),
+    default=pathlib.Path.cwd(),
+    help="Assets folder to publish, feeds included.",
+    show_default=True
+)
+@click.option(
+    "--bucket",
+    required=True,
+    help="Bucket to upload to."
+)
+@click.option(
+    "--prefix",
+    default="",
+    help="Key prefix in the bucket, e.g. `shelf/`."
+)
+@click.option(
+    "--endpoint-url",
+    default="https://s3.amazonaws.com",
+    show_default=True,
+    help=(
+        "S3 API endpoint, e.g. `http://localhost:9000` for MinIO. "
+        "Credentials are read from AWS_ACCESS_KEY_ID and "
+        "AWS_SECRET_ACCESS_KEY."
+    )
+)
+@click.option(
+    "--region",
+    help="Region to sign requests for, default AWS_REGION or us-east-1."
+)
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(1),
+    default=4,
+    show_default=True,
+    help="Files, and parts of large files, to upload at the same time."
+)
+@click.option(
+    "--delete",
+    is_flag=True,
+    help="Delete objects of files removed since the last publish."
+)
+@click.option(
+    "--drop-cache",
+    is_flag=True,
+    help=(
+        "Drop uploaded media from the page cache, to keep what is served "
+        "from this box cached."
+    )
+)
+@click.option(
+    "--dry-run",
+    is_flag=True,
+    help="Only list what would be uploaded and deleted."
+)
+def cli(
+    directory: t.Union[pathlib.Path, str],
+    bucket: str,
+    prefix: str,
+    endpoint_url: str,
+    region: t.Optional[str],
+    jobs: int,
+    delete: bool,
+    drop_cache: bool,
+    dry_run: bool,
+):
+    """Publish changed assets and feeds to a bucket."""
+    # httpx, hashlib and xml are only needed here
+    from shelf.publish import Publisher, S3Bucket
+
+    try:
+        with S3Bucket(endpoint_url, bucket, region=region) as target:
+            publisher = Publisher(
+                pathlib.Path(directory).resolve(),
+                target,
+                prefix=prefix,
+                jobs=jobs,
+                delete=delete,
+                drop_cache=drop_cache
+            )
+            uploaded, deleted = publisher.run(dry_run=dry_run)
+    except ShelfError as exc:
+        raise click.ClickException(str(exc)) from None
+
+    verb = "Would upload" if dry_run else "Uploaded"
+    secho(f"{verb} {uploaded} files, deleted {deleted}", fg="green")
@@ -0,0 +1,52 @@
+"""Moves decrypted files into another assets layout.
+
+Run once after changing `--layout` of `audible decrypt` and `audible rss`,
+then render the feeds again: their URLs change with the layout.
+"""
+
+import pathlib
+import typing as t
+
+import click
+from click import secho
+
+from shelf import Layout
+from shelf.layout import LAYOUTS
+
+
+@click.command("relayout")  # noqa: E302
+@click.option(
+    "--dir",
+    "-d",
+    "directory",
+    type=click.Path(exists=True, file_okay=False),
+    default=pathlib.Path.cwd(),
+    help="Assets folder, as given to `audible decrypt --dir`.",
+    show_default=True
+)
+@click.option(
+    "--layout",
+    type=click.Choice(LAYOUTS),
+    required=True,
+    help="Layout to move the files into."
+)
+@click.option(
+    "--dry-run",
+    is_flag=True,
+    help="Only list what would be moved."
+)
+def cli(
+    directory: t.Union[pathlib.Path, str],
+    layout: str,
+    dry_run: bool,
+):
+    """Move the decrypted files of every book into LAYOUT.
+
+    Covers, chapter sidecars, HLS packages, chapter folders and variants
+    move with their books; other files (feeds, the podcast image) stay.
+    """
+    moved = Layout(layout).migrate(
+        pathlib.Path(directory).resolve(), dry_run=dry_run
+    )
+    verb = "Would move" if dry_run else "Moved"
+    secho(f"{verb} {moved} files and folders", fg="green")
@@ -0,0 +1,130 @@
+"""Restocks the shelves of several Audible profiles in one process.
+
+The profiles share one assets folder, probe cache and worker pool: a book
+two accounts own is decrypted, its cover scaled and its file probed once.
+Every profile keeps its own library snapshot and feed, see
+`shelf.profiles.ShelfConfig` for the config file.
+"""
+
+import asyncio
+import typing as t
+from shutil import which
+
+import click
+from click import echo, secho
+
+from audible_cli.decorators import pass_session
+
+from shelf import (
+    Layout,
+    MediaFiles,
+    Priority,
+    ShelfError,
+)
+
+
+@click.command("restock")  # noqa: E302
+@click.option(
+    "--config",
+    "-c",
+    "config_file",
+    type=click.Path(exists=True, dir_okay=False),
+    required=True,
+    help="TOML file with the assets folder and the profiles."
+)
+@click.option(
+    "--show",
+    type=click.Choice(["profiles", "assets"]),
+    help=(
+        "Only print every profile and its downloads folder, one per line "
+        "(e.g. to download for each), or the assets folder."
+    )
+)
+@pass_session
+def cli(session, config_file: str, show: t.Optional[str]):
+    """Decrypt the downloads of every profile and write their feeds."""
+    from shelf import Shelf
+    from shelf.profiles import ShelfConfig
+
+    try:
+        config = ShelfConfig.load(config_file)
+    except ShelfError as exc:
+        raise click.BadParameter(str(exc), param_hint="--config") from None
+
+    if show == "profiles":
+        for profile in config.profiles:
+            echo(f"{profile.name} {profile.downloads}")
+        return
+    if show == "assets":
+        echo(config.assets)
+        return
+
+    for tool in ("ffmpeg", "ffprobe"):
+        if not which(tool):
+            click.get_current_context().fail(f"{tool} not found")
+
+    for profile in config.profiles:
+        if not session.config.has_profile(profile.name):
+            raise click.BadParameter(
+                f"no audible-cli profile {profile.name}",
+                param_hint="--config"
+            )
+    activation_bytes = {
+        profile.name: session.get_auth_for_profile(
+            profile.name, session.params.get("password")
+        ).activation_bytes
+        for profile in config.profiles
+    }
+
+    async def sync_libraries():
+        async def sync(profile):
+            client = session.get_client_for_profile(
+                profile.name, session.params.get("password")
+            )
+            async with client.session:
+                profile.books = await profile.library.sync(client)
+            echo(f"{profile.name}: {len(profile.books)} books in library")
+
+        await asyncio.gather(*(sync(p) for p in config.profiles))
+
+    assets = config.assets.resolve()
+    assets.mkdir(parents=True, exist_ok=True)
+    layout = Layout(config.layout)
+    store = None
+    if config.dedup:
+        from shelf.store import STORE_DIR, ContentStore
+
+        store = ContentStore(assets / STORE_DIR)
+    with Shelf(
+        jobs=config.jobs,
+        io_per_device=config.io_per_device,
+        priority=Priority(nice=config.nice, ionice_class=config.ionice),
+        layout=layout,
+        store=store,
+        drop_cache=config.drop_cache
+    ) as shelf:
+        try:
+            results = shelf.decrypt_profiles(
+                config.profiles,
+                assets,
+                activation_bytes=activation_bytes,
+                **config.decrypt
+            )
+        except ShelfError as exc:
+            raise click.ClickException(str(exc)) from None
+        failed = [(job, error) for job, error in results if error]
+        for job, error in failed:
+            secho(f"{job.name} failed: {error}", fg="red")
+
+        asyncio.run(sync_libraries())
+        files = shelf.find_media(
+            [str(assets / p)
+             for p in layout.patterns(MediaFiles.get_all_patterns())]
+        )
+        for feed in shelf.render_profile_feeds(config.profiles, files, assets):
+            secho(f"feed saved to {feed}", fg="green")
+
+    if failed:
+        raise click.ClickException(
+            f"{len(failed)} of {len(results)} jobs failed"
+        )
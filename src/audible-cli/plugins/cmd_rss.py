@@ -8,21 +8,12 @@ Need further work. Some options do not work or options are missing.
 Needs at least ffmpeg 4.4
 """
 
-import json
 import pathlib
-import re
-import subprocess  # noqa: S404
-import typing as t
-from enum import Enum
-from glob import glob
 from shutil import which
-from datetime import timedelta
-import dateutil
-import podgen
-from rfc3986 import normalize_uri, is_valid_uri
 
 import click
-from click import echo, secho
+from click import echo
+from click.core import ParameterSource
 
 from audible_cli.decorators import (
     pass_client,
@@ -32,270 +23,16 @@ from audible_cli.decorators import (
     start_date_option,
 )
 
-from audible_cli.exceptions import AudibleCliException
-from audible_cli.models import Library
-
-
-class ChapterError(AudibleCliException):
-    """Base class for all chapter errors."""
-
-
-class SupportedFiles(Enum):
-    M4B = ".m4a"
-    MP3 = ".mp3"
-    MP4 = ".mp4"
-
-    @classmethod
-    def get_supported_list(cls):
-        return list(set(item.value for item in cls))
-
-    @classmethod
-    def is_supported_suffix(cls, value):
-        return value in cls.get_supported_list()
-
-    @classmethod
-    def is_supported_file(cls, value):
-        return pathlib.PurePath(value).suffix in cls.get_supported_list()
-
-
-def _get_feed_url(
-    feed_url,
-    url_prefix: str,
-    outfile: str
-) -> str:
-    if feed_url:
-        return feed_url
-    outfile_base = pathlib.Path(outfile).name
-    return f"{url_prefix}{outfile_base}"
-
-
-def _get_website(
-    website,
-    url_prefix: str
-) -> str:
-    website = website if website else url_prefix
-    if not is_valid_uri(
-            website,
-            require_scheme=True,
-            require_authority=True,
-            require_path=True
-            ):
-        raise click.BadOptionUsage(
-                website,
-                f"homepage {website} is invalid - needs to be an URL"
-        )
-    return website
-
-
-def _get_image(
-    image: str,
-    url_prefix: str
-) -> str:
-    if is_valid_uri(
-            image,
-            require_scheme=True,
-            require_authority=True,
-            require_path=True
-            ):
-        return image
-
-    return f"{url_prefix}{image}"
-
-
-def _get_url_prefix(
-    prefix: str
-) -> str:
-    if not is_valid_uri(prefix, require_path=True) \
-            and is_valid_uri(prefix):
-        prefix += "/"
-
-    if not is_valid_uri(
-            prefix,
-            require_scheme=True,
-            require_authority=True,
-            require_path=True
-            ):
-        raise click.BadOptionUsage(
-                prefix,
-                f"url prefix {prefix} is invalid - needs to be an URL"
-        )
-
-    return normalize_uri(prefix)
-
-
-def _get_input_files(
-    files: t.Union[t.Tuple[str], t.List[str]],
-    recursive: bool = True
-) -> t.List[pathlib.Path]:
-    filenames = []
-    for filename in files:
-        # if the shell does not do filename globbing
-        expanded = list(glob(filename, recursive=recursive))
-
-        if (
-            len(expanded) == 0
-            and '*' not in filename
-            and not SupportedFiles.is_supported_file(filename)
-        ):
-            raise (click.BadParameter(
-                "{filename}: file not found or supported."))
-
-        expanded_filter = filter(
-            lambda x: SupportedFiles.is_supported_file(x), expanded
-        )
-        expanded = list(
-            map(lambda x: pathlib.Path(x).resolve(), expanded_filter)
-        )
-        filenames.extend(expanded)
-
-    return filenames
-
-
-async def _get_library_info(session, client):
-    bunch_size = session.params.get("bunch_size")
-    start_date = session.params.get("start_date")
-    end_date = session.params.get("end_date")
-
-    library = await Library.from_api_full_sync(
-        client,
-        response_groups=",".join([
-            "contributors",
-            "product_attrs",
-            "product_desc",
-        ]),
-        bunch_size=bunch_size,
-        start_date=start_date,
-        end_date=end_date
-    )
-    await library.resolve_podcats(start_date=start_date, end_date=end_date)
-
-    books = {}
-    for book in library:
-        books[book.asin] = {
-            'asin': book.asin,
-            'title': book.full_title,
-            'authors':
-                ", ".join([i["name"] for i in (book.authors or [])]),
-            'narrators':
-                ", ".join([i["name"] for i in (book.narrators or [])]),
-            'date_added': book.purchase_date,
-        }
-
-    return books
-
-
-class EpisodeCreator:
-    def __init__(
-        self,
-        file: pathlib.Path,
-        url_prefix: str,
-        overwrite: bool,
-        make_public: bool
-    ):
-        self._source = file
-        self._ctime = None
-        self._img_file = None
-        self._url_prefix = url_prefix
-        self._overwrite = overwrite
-        self._make_public = make_public
-        self._asin = None
-        self._do_probe()
-        self._create_podgen_episode()
-
-    @property
-    def asin(self) -> str:
-        if (not self._asin):
-            try:
-                self._asin = self._tags['episode_id']
-            except KeyError:
-                file_name = pathlib.Path(self._source).name
-                match = re.search(r'\A([A-Z0-9]{10})_', file_name)
-                if (not match):
-                    raise RuntimeError("Unable to determine ASIN")
-                try:
-                    self._asin = match(1)
-                except IndexError:
-                    raise RuntimeError("Unable to determine ASIN")
-
-        return self._asin
-
-    @property
-    def title(self) -> str:
-        return self._tags['title']
-
-    @property
-    def source(self) -> str:
-        return self._source
-
-    @property
-    def podgen_episode(self) -> podgen.Episode:
-        return self._podgen_episode
-
-    @property
-    def ctime(self):
-        if (not self._ctime):
-            stat = pathlib.Path(self._source).stat()
-            try:
-                self._ctime = stat.st_birthtime
-            except AttributeError:
-                self._ctime = stat.st_ctime
-        return self._ctime
-
-    @property
-    def library_info(self):
-        return self._library_info
-
-    @library_info.setter
-    def library_info(self, var):
-        self._library_info = var
-
-    @property
-    def img_file(self):
-        if (not self._img_file):
-            self._img_file = f"{pathlib.Path(self.source).stem}.jpg"
-        return self._img_file
-
-    def _do_probe(self):
-        base_cmd = [
-            "ffprobe",
-            "-show_format",
-            "-output_format",
-            "json",
-            "-i",
-            str(self._source)
-        ]
-        child_result = subprocess.run(base_cmd, capture_output=True)
-        if child_result.returncode != 0:
-            raise RuntimeError(f"ffprobe failed, corrupt? {str(self._source)}")
-
-        try:
-            probe_dict = json.loads(child_result.stdout)
-        except json.JSONDecodeError:
-            secho("f skip {outfile} json parse error from ffprobe")
-
-        self._probe = probe_dict["format"]
-        self._tags = self._probe["tags"]
-
-        return
-
-    def _create_podgen_episode(self) -> None:
-        pubdate = dateutil.parser.isoparse(self._tags["creation_time"])
-        file_name = pathlib.Path(self._source).name
-        self._podgen_episode = podgen.Episode(
-            id=self.asin,
-            title=self._tags["title"],
-            summary=self._tags["comment"],
-            publication_date=pubdate,
-            authors=[podgen.Person(self._tags["artist"])],
-            image=f"{self._url_prefix}{self.img_file}",
-            withhold_from_itunes=(not self._make_public)
-        )
+from shelf import (
+    FileNotSupported,
+    InvalidUrl,
+    Layout,
+    MediaFiles,
+    ShelfError,
+)
+from shelf.layout import LAYOUTS
+from shelf.library import CONCURRENCY, PAGE_SIZE
 
-        self._podgen_episode.media = podgen.Media(
-            url=f"{self._url_prefix}{file_name}",
-            size=self._probe["size"],
-            duration=timedelta(seconds=float(self._probe["duration"]))
-        )
 
 @click.command("rss")  # noqa: E302
 @click.argument("files", nargs=-1)
@@ -438,10 +175,107 @@ class EpisodeCreator:
     is_flag=True,
     default=False,
     help="RSS-ify all eligible media files in current dir ({0})".format(
-        ",".join(SupportedFiles.get_supported_list())
+        ",".join(MediaFiles.get_supported_list())
     )
 )
-@bunch_size_option
+@click.option(
+    "--variant",
+    type=str,
+    help="""
+    Publish a variant written by `audible decrypt --variant`, e.g. opus-32k:
+    media files are read from that subfolder, enclosures point at
+    `--url-prefix` plus the variant, and `--outfile` defaults to
+    rss-<variant>
+    """
+)
+@click.option(
+    "--layout",
+    type=click.Choice(LAYOUTS),
+    default="flat",
+    show_default=True,
+    help="""
+    How `audible decrypt --layout` laid out the media files: with `hash`,
+    `--all` looks in the subfolders and enclosure, image and chapters URLs
+    include them
+    """
+)
+@click.option(
+    "--hls",
+    is_flag=True,
+    default=False,
+    help="""
+    Point enclosures at the HLS playlists written by `audible decrypt --hls`
+    (<book>.hls/index.m3u8) instead of the files. Books without a package
+    keep the file
+    """
+)
+@click.option(
+    "--library-page",
+    is_flag=True,
+    default=False,
+    help="""
+    Also write a static, searchable page of the library (index.html) and
+    its search index (search/) next to `--outfile`, from the same episodes
+    and, with `--use-library-api`, library data
+    """
+)
+@click.option(
+    "--hub",
+    "hub_url",
+    type=str,
+    help="""
+    WebSub hub to advertise in the feed, so subscribed clients get changes
+    pushed instead of polling. The hub is pinged whenever the feed's
+    content changed since the last ping
+    """
+)
+@click.option(
+    "--hub-ping/--no-hub-ping",
+    default=True,
+    show_default=True,
+    help="""
+    Ping `--hub` about a changed feed. Turn off when the feed is uploaded
+    elsewhere afterwards, then ping with `audible websub ping`
+    """
+)
+@click.option(
+    "--plan",
+    "plan_only",
+    is_flag=True,
+    default=False,
+    help="""
+    Only list the files that would be probed and the feed that would be
+    rendered, with estimated cost from past runs, then exit
+    """
+)
+@click.option(
+    "--watch",
+    is_flag=True,
+    default=False,
+    help="""
+    After writing the feed, keep running and update it whenever media files
+    in the current dir are added, replaced or removed. Linux only (inotify).
+    Needs `--overwrite`
+    """
+)
+@click.option(
+    "--debounce",
+    type=float,
+    default=2.0,
+    show_default=True,
+    help="Seconds a file must be quiet before `--watch` picks it up"
+)
+@click.option(
+    "--library-jobs",
+    type=click.IntRange(1),
+    default=CONCURRENCY,
+    show_default=True,
+    help=(
+        "Library pages to request at once at most, fewer while the API "
+        "throttles."
+    )
+)
+@bunch_size_option(default=PAGE_SIZE)
 @start_date_option
 @end_date_option
 @pass_session
@@ -465,6 +299,16 @@ async def cli(
     use_library_api: bool,
     all_: bool,
     overwrite: bool,
+    variant: str,
+    layout: str,
+    hls: bool,
+    library_page: bool,
+    hub_url: str,
+    hub_ping: bool,
+    plan_only: bool,
+    watch: bool,
+    debounce: float,
+    library_jobs: int,
 ):
     """Generate RSS File"""
 
@@ -478,80 +322,119 @@ async def cli(
                 "all",
                 "If using `--all`, no FILES arguments can be used."
             )
-        files = [
-            f"*{suffix}" for suffix in SupportedFiles.get_supported_list()
-        ]
+        files = Layout(layout).patterns(MediaFiles.get_all_patterns())
+        if variant:
+            files = [f"{variant}/{pattern}" for pattern in files]
+
+    ctx = click.get_current_context()
+    if variant and ctx.get_parameter_source("outfile") \
+            == ParameterSource.DEFAULT:
+        outfile = pathlib.Path.cwd() / f"rss-{variant}"
+
+    if watch and not overwrite:
+        raise click.BadOptionUsage(
+            "watch",
+            "`--watch` rewrites the feed, it needs `--overwrite`"
+        )
 
-    if pathlib.Path(outfile).exists() and not (overwrite):
+    if pathlib.Path(outfile).exists() and not (overwrite or plan_only):
         raise click.BadOptionUsage(
             "outfile",
             f"sorry --outfile {outfile} already exists"
         )
 
-    url_prefix = _get_url_prefix(prefix=url_prefix)
-    website = _get_website(website=website, url_prefix=url_prefix)
-    image = _get_image(image=image, url_prefix=url_prefix)
-    feed_url = _get_feed_url(
-        feed_url=feed_url,
-        url_prefix=url_prefix,
-        outfile=outfile
-    )
+    from shelf import FeedOptions, Shelf
 
-    print(f"creating podcast site {website}...")
+    try:
+        options = FeedOptions(
+            name=name,
+            desc=desc,
+            url_prefix=url_prefix,
+            image=image,
+            outfile=outfile,
+            website=website,
+            feed_url=feed_url,
+            explicit=explicit,
+            make_public=make_public,
+            category=category,
+            subcategory=subcategory,
+            library_page=library_page,
+            hub_url=hub_url
+        )
+    except InvalidUrl as exc:
+        raise click.BadOptionUsage(exc.url, str(exc)) from None
+
+    media_prefix = f"{options.url_prefix}{variant}/" if variant else None
+
+    print(f"creating podcast site {options.website}...")
     print(f"sort by purchase date => {sort_by_purchase_date}")
 
-    cast = podgen.Podcast(
-        name=name,
-        description=desc,
-        website=website,
-        explicit=explicit,
-        withhold_from_itunes=(not make_public),
-        image=image,
-        feed_url=feed_url,
-        generator=None,
-        category=podgen.Category(category, subcategory)
-    )
+    shelf = Shelf(layout=Layout(layout))
+    try:
+        files = shelf.find_media(files, recursive=True)
+    except FileNotSupported as exc:
+        raise click.BadParameter(str(exc)) from None
 
-    episode_array = []
-    for file in _get_input_files(files, recursive=True):
-        ep = EpisodeCreator(
-            file=file,
-            url_prefix=url_prefix,
-            overwrite=overwrite,
-            make_public=make_public
-        )
-        echo(f"adding {ep.asin} => {ep.title}")
-        episode_array.append(ep)
+    if plan_only:
+        shelf.plan_feed(files, outfile).echo()
+        return
 
-    if use_library_api or sort_by_purchase_date:
-        books = await _get_library_info(
-            session,
-            client
-        )
-        for ep in episode_array:
-            ep.library_info = books[ep.asin]
-            if sort_by_purchase_date:
-                ep.podgen_episode.publication_date = \
-                    ep.library_info['date_added']
-            if use_library_api:
-                ep.podgen_episode.title = ep.library_info['title']
-                ep.podgen_episode.authors = [
-                    podgen.Person(
-                        f"Written by {ep.library_info['authors']}"
-                    ),
-                    podgen.Person(
-                        f"Narrated by {ep.library_info['narrators']}"
-                    ),
-                ]
+    if watch:
+        from shelf.watch import IncrementalFeed
 
-    if sort_by_purchase_date:
-        episode_array.sort(key=(lambda x: x.library_info['date_added']))
+        feed = IncrementalFeed(
+            shelf,
+            url_prefix=options.url_prefix,
+            make_public=make_public,
+            media_prefix=media_prefix,
+            hls=hls
+        )
+        episode_array = feed.update(changed=files)
     else:
-        episode_array.sort(key=(lambda x: x.ctime))
+        episode_array = shelf.episodes(
+            files,
+            url_prefix=options.url_prefix,
+            make_public=make_public,
+            media_prefix=media_prefix,
+            hls=hls
+        )
 
-    for ep in episode_array:
-        cast.add_episode(ep.podgen_episode)
+    library_options = dict(
+        bunch_size=session.params.get("bunch_size"),
+        start_date=session.params.get("start_date"),
+        end_date=session.params.get("end_date"),
+        concurrency=library_jobs
+    )
+    books = None
+    if use_library_api or sort_by_purchase_date:
+        try:
+            books = await shelf.sync_library(client, **library_options)
+        except ShelfError as exc:
+            raise click.ClickException(str(exc)) from None
 
     echo("creating feed...")
-    cast.rss_file(outfile)
+    shelf.render_feed(
+        options,
+        episode_array,
+        books=books,
+        use_library_api=use_library_api,
+        sort_by_purchase_date=sort_by_purchase_date,
+        ping_hub=hub_ping
+    )
     print(f"feed saved to {outfile}")
+
+    if watch:
+        from shelf.watch import watch_feed
+
+        await watch_feed(
+            shelf,
+            feed,
+            options,
+            media_dir=pathlib.Path.cwd() / (variant or ""),
+            client=client,
+            use_library_api=use_library_api,
+            sort_by_purchase_date=sort_by_purchase_date,
+            debounce=debounce,
+            ping_hub=hub_ping,
+            **library_options
+        )
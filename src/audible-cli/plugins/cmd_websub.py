@@ -0,0 +1,111 @@
+"""WebSub for the feeds: a small hub, and pinging a hub about a feed.
+
+`audible rss --hub URL` advertises the hub and pings it itself; `ping` is
+for feeds that are uploaded elsewhere (`audible publish`) after rendering.
+"""
+
+import pathlib
+import typing as t
+
+import click
+from click import echo, secho
+
+from shelf import ShelfError
+
+
+@click.group("websub")  # noqa: E302
+def cli():
+    """WebSub hub and hub pings for the feeds."""
+
+
+@cli.command("hub")
+@click.option(
+    "--host",
+    default="127.0.0.1",
+    show_default=True,
+    help="Address to listen on."
+)
+@click.option(
+    "--port",
+    type=click.IntRange(1, 65535),
+    default=8080,
+    show_default=True,
+    help="Port to listen on."
+)
+@click.option(
+    "--url",
+    help=(
+        "Public URL of the hub, as advertised in the feeds. "
+        "Default: http://HOST:PORT/"
+    )
+)
+@click.option(
+    "--topic-prefix",
+    "topic_prefixes",
+    multiple=True,
+    help=(
+        "Only serve feeds whose URL starts with this, e.g. the "
+        "`--url-prefix` of `audible rss`. Repeat for more."
+    )
+)
+@click.option(
+    "--state",
+    type=click.Path(dir_okay=False),
+    help="File to keep the subscriptions in across restarts."
+)
+def hub(
+    host: str,
+    port: int,
+    url: t.Optional[str],
+    topic_prefixes: t.Tuple[str, ...],
+    state: t.Optional[str],
+):
+    """Run a WebSub hub until interrupted."""
+    # httpx and http.server are only needed here
+    from shelf.websub import Hub, serve
+
+    if not topic_prefixes:
+        secho("No --topic-prefix, serving any feed URL", fg="yellow")
+    serve(
+        Hub(
+            url or f"http://{host}:{port}/",
+            topic_prefixes=topic_prefixes,
+            state_file=pathlib.Path(state) if state else None
+        ),
+        host,
+        port
+    )
+
+
+@cli.command("ping")
+@click.option(
+    "--feed",
+    type=click.Path(exists=True, dir_okay=False),
+    required=True,
+    help="Rendered feed file, e.g. assets/rss."
+)
+@click.option(
+    "--feed-url",
+    required=True,
+    help="URL the feed is served from (its `--feed-url`)."
+)
+@click.option(
+    "--hub",
+    "hub_url",
+    required=True,
+    help="Hub to ping, as given to `audible rss --hub`."
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    help="Ping even if the feed did not change since the last ping."
+)
+def ping(feed: str, feed_url: str, hub_url: str, force: bool):
+    """Tell the hub about the feed, if it changed since the last ping."""
+    from shelf.websub import ping_hub
+
+    try:
+        pinged = ping_hub(hub_url, feed_url, pathlib.Path(feed), force=force)
+    except ShelfError as exc:
+        raise click.ClickException(str(exc)) from None
+    echo(f"Pinged {hub_url}" if pinged else "Feed unchanged, not pinged")
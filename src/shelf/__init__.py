@@ -1,2 +1,152 @@
 # src/shelf/__init__.py
-__version__ = "0.1.0"
\ No newline at end of file
+"""Shelf: decrypt an Audible library and publish it as a podcast feed.
+
+The `audible decrypt` and `audible rss` plugins are thin wrappers around
+this package. Use `Shelf` directly to keep caches and workers warm in a
+long-running process.
+"""
+
+__version__ = "0.1.0"
+
+import importlib
+import typing as t
+
+if t.TYPE_CHECKING:
+    from .artwork import CoverScaler, get_cover_source, get_cover_target
+    from .core import Shelf
+    from .decrypt import (
+        ApiChapterInfo,
+        BatchDecryptError,
+        BatchDecrypter,
+        FFMeta,
+        FfmpegFileDecrypter,
+        get_aaxc_asin,
+        get_aaxc_credentials,
+        run_decrypt_jobs,
+    )
+    from .exceptions import (
+        ChapterError,
+        DownloadError,
+        FileNotSupported,
+        InvalidUrl,
+        LeaseHeld,
+        PublishError,
+        ShelfError,
+    )
+    from .feed import (
+        EpisodeCreator,
+        FeedOptions,
+        apply_library_info,
+        create_episodes,
+        create_podcast,
+        render_feed,
+        sort_episodes,
+    )
+    from .files import EncryptedFiles, MediaFiles, find_files
+    from .layout import Layout
+    from .lease import LeaseDir
+    from .library import LibrarySnapshot, fetch_library
+    from .probe import ProbeCache, ffprobe
+    from .scheduler import Job, NotEnoughSpace, Priority, Scheduler
+
+# name -> submodule, imported on first access: the audible plugins import
+# this package on every command, most of them need none of it
+_EXPORTS = {
+    "CoverScaler": "artwork",
+    "get_cover_source": "artwork",
+    "get_cover_target": "artwork",
+    "Shelf": "core",
+    "ApiChapterInfo": "decrypt",
+    "BatchDecryptError": "decrypt",
+    "BatchDecrypter": "decrypt",
+    "FFMeta": "decrypt",
+    "FfmpegFileDecrypter": "decrypt",
+    "get_aaxc_asin": "decrypt",
+    "get_aaxc_credentials": "decrypt",
+    "run_decrypt_jobs": "decrypt",
+    "ChapterError": "exceptions",
+    "DownloadError": "exceptions",
+    "FileNotSupported": "exceptions",
+    "InvalidUrl": "exceptions",
+    "LeaseHeld": "exceptions",
+    "PublishError": "exceptions",
+    "ShelfError": "exceptions",
+    "EpisodeCreator": "feed",
+    "FeedOptions": "feed",
+    "apply_library_info": "feed",
+    "create_episodes": "feed",
+    "create_podcast": "feed",
+    "render_feed": "feed",
+    "sort_episodes": "feed",
+    "EncryptedFiles": "files",
+    "MediaFiles": "files",
+    "find_files": "files",
+    "Layout": "layout",
+    "LeaseDir": "lease",
+    "LibrarySnapshot": "library",
+    "fetch_library": "library",
+    "ProbeCache": "probe",
+    "ffprobe": "probe",
+    "Job": "scheduler",
+    "NotEnoughSpace": "scheduler",
+    "Priority": "scheduler",
+    "Scheduler": "scheduler",
+}
+
+__all__ = [
+    "ApiChapterInfo",
+    "BatchDecryptError",
+    "BatchDecrypter",
+    "ChapterError",
+    "CoverScaler",
+    "DownloadError",
+    "EncryptedFiles",
+    "EpisodeCreator",
+    "FFMeta",
+    "FeedOptions",
+    "FfmpegFileDecrypter",
+    "FileNotSupported",
+    "InvalidUrl",
+    "Job",
+    "Layout",
+    "LeaseDir",
+    "LeaseHeld",
+    "LibrarySnapshot",
+    "MediaFiles",
+    "NotEnoughSpace",
+    "Priority",
+    "ProbeCache",
+    "PublishError",
+    "Scheduler",
+    "Shelf",
+    "ShelfError",
+    "apply_library_info",
+    "create_episodes",
+    "create_podcast",
+    "fetch_library",
+    "ffprobe",
+    "find_files",
+    "get_aaxc_asin",
+    "get_aaxc_credentials",
+    "get_cover_source",
+    "get_cover_target",
+    "render_feed",
+    "run_decrypt_jobs",
+    "sort_episodes",
+]
+
+
+def __getattr__(name: str) -> t.Any:
+    try:
+        module = _EXPORTS[name]
+    except KeyError:
+        raise AttributeError(
+            f"module {__name__!r} has no attribute {name!r}"
+        ) from None
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> t.List[str]:
+    return sorted({*globals(), *__all__})
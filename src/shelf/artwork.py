@@ -0,0 +1,104 @@
+import hashlib
+import pathlib
+import re
+import subprocess  # noqa: S404
+import typing as t
+
+from click import echo, secho
+
+from .scheduler import Priority
+
+# covers are padded to a square of this size, the largest Apple Podcasts
+# accepts
+COVER_SIZE = 3000
+
+# rough upper bound for a 3000x3000 jpeg, reserved before scaling starts
+EXPECTED_COVER_BYTES = 4 * 1024 * 1024
+
+_CODEC_SUFFIX = r"-AAX_[0-9_]+\.aaxc?$"
+
+
+def get_cover_source(file: pathlib.Path, cover_size: int) -> pathlib.Path:
+    """Cover `audible download --cover --cover-size` stored next to FILE
+
+    `B0..._Title-AAX_44_128.aaxc` comes with `B0..._Title_(1215).jpg`.
+    """
+    name = re.sub(_CODEC_SUFFIX, f"_({cover_size})", file.name)
+    return file.with_name(f"{name}.jpg")
+
+
+def get_cover_target(file: pathlib.Path, target_dir: pathlib.Path):
+    return target_dir / file.with_suffix(".jpg").name
+
+
+class CoverScaler:
+    """Scale and pad a downloaded cover to a COVER_SIZE square jpeg"""
+
+    def __init__(
+        self,
+        source: pathlib.Path,
+        target: pathlib.Path,
+        overwrite: bool = False,
+        priority: t.Optional[Priority] = None
+    ) -> None:
+        self._source = source
+        self._target = target
+        self._overwrite = overwrite
+        self._priority = priority or Priority()
+
+    @property
+    def source(self) -> pathlib.Path:
+        return self._source
+
+    @property
+    def target(self) -> pathlib.Path:
+        return self._target
+
+    def is_needed(self) -> bool:
+        return self._overwrite or not self._target.exists()
+
+    def pending_outputs(self) -> t.List[pathlib.Path]:
+        return [self._target] if self.is_needed() else []
+
+    def fingerprint(self) -> t.Optional[str]:
+        """Digest of the source and size, for a `ContentStore`"""
+        if not self._source.exists():
+            return None
+        digest = hashlib.sha256(f"{COVER_SIZE}:".encode())
+        digest.update(self._source.read_bytes())
+        return digest.hexdigest()
+
+    def stored_outputs(self) -> t.Dict[str, pathlib.Path]:
+        return {"cover": self._target}
+
+    def run(self) -> None:
+        if not self.is_needed():
+            return
+        if not self._source.exists():
+            secho(f"Skip cover {self._target}: no {self._source}", fg="blue")
+            return
+
+        scale = (
+            f"scale={COVER_SIZE}:{COVER_SIZE}"
+            ":force_original_aspect_ratio=decrease,"
+            f"pad={COVER_SIZE}:{COVER_SIZE}:(ow-iw)/2:(oh-ih)/2"
+        )
+        base_cmd = [
+            "ffmpeg",
+            "-v",
+            "error",
+            "-y",
+            "-i",
+            str(self._source),
+            "-vf",
+            scale,
+            "-frames:v",
+            "1",
+            "-update",
+            "1",
+            str(self._target),
+        ]
+        subprocess.check_output(  # noqa: S603
+            self._priority.wrap(base_cmd), text=True
+        )
+        echo(f"Cover scaled: {self._target}")
@@ -0,0 +1,231 @@
+import html
+import json
+import os
+import pathlib
+import re
+import typing as t
+import unicodedata
+
+from .plan import format_seconds
+
+if t.TYPE_CHECKING:
+    from .feed import EpisodeCreator, FeedOptions
+
+LIBRARY_PAGE = "index.html"
+SEARCH_DIR = "search"
+# every book's fields, by ASIN, for clients other than the page
+BOOKS_FILE = "books.json"
+
+# a search word selects the shard of its first SHARD_CHARS characters,
+# shorter words are not indexed
+SHARD_CHARS = 2
+
+_COMBINING = re.compile("[\u0300-\u036f]")
+_WORD_SPLIT = re.compile(r"[^a-z0-9]+")
+
+
+def tokenize(text: str) -> t.List[str]:
+    """Search words in TEXT, the same way the page splits a query"""
+    text = _COMBINING.sub("", unicodedata.normalize("NFKD", text)).lower()
+    return [w for w in _WORD_SPLIT.split(text) if len(w) >= SHARD_CHARS]
+
+
+def _date(value) -> str:
+    if value is None:
+        return ""
+    if hasattr(value, "date"):
+        return value.date().isoformat()
+    return str(value)[:10]
+
+
+def book_record(
+    episode: "EpisodeCreator",
+    books: t.Optional[t.Dict[str, t.Dict[str, t.Any]]] = None
+) -> t.Dict[str, t.Any]:
+    """What the library page shows and searches of EPISODE
+
+    Authors, narrators and the purchase date come from the library (BOOKS,
+    see `Shelf.sync_library`) where it is known, else from the file.
+    """
+    info = (books or {}).get(episode.asin) or episode.library_info or {}
+    podgen_episode = episode.podgen_episode
+    return {
+        "asin": episode.asin,
+        "title": info.get("title") or podgen_episode.title,
+        "authors": info.get("authors")
+        or ", ".join(p.name for p in podgen_episode.authors),
+        "narrators": info.get("narrators", ""),
+        "duration": round(podgen_episode.media.duration.total_seconds()),
+        "purchased": _date(info.get("date_added")),
+        "url": podgen_episode.media.url,
+        "image": podgen_episode.image,
+    }
+
+
+def build_search_index(
+    records: t.Iterable[t.Dict[str, t.Any]]
+) -> t.Dict[str, t.Dict[str, t.List[str]]]:
+    """{shard: {word: [ASIN, ...]}} over title, authors, narrators, ASIN"""
+    shards: t.Dict[str, t.Dict[str, t.List[str]]] = {}
+    for record in records:
+        text = " ".join(
+            record[field]
+            for field in ("title", "authors", "narrators", "asin")
+        )
+        for word in sorted(set(tokenize(text))):
+            shards.setdefault(word[:SHARD_CHARS], {}) \
+                .setdefault(word, []).append(record["asin"])
+    return shards
+
+
+_PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>{name}</title>
+<style>
+body {{ font-family: sans-serif; margin: 0 auto; max-width: 60em; \
+padding: 1em; }}
+input {{ font-size: 1.2em; width: 100%; box-sizing: border-box; }}
+ul {{ list-style: none; padding: 0; }}
+li {{ display: flex; gap: 1em; margin: 1em 0; }}
+li[hidden] {{ display: none; }}
+li img {{ width: 80px; height: 80px; }}
+.meta {{ color: #666; font-size: 0.9em; }}
+</style>
+</head>
+<body>
+<h1><a href="{feed_url}">{name}</a></h1>
+<p>{desc}</p>
+<input id="q" type="search" placeholder="Search {count} books" autofocus>
+<ul id="books">
+{rows}
+</ul>
+<script>
+const input = document.getElementById("q");
+const rows = new Map(
+  [...document.querySelectorAll("#books li")].map(r => [r.dataset.asin, r])
+);
+const shards = new Map();
+function words(text) {{
+  return text.normalize("NFKD").replace(/[\\u0300-\\u036f]/g, "")
+    .toLowerCase().split(/[^a-z0-9]+/).filter(w => w.length >= {chars});
+}}
+function shard(key) {{
+  if (!shards.has(key)) {{
+    shards.set(key, fetch("{search_dir}/" + key + ".json")
+      .then(r => r.ok ? r.json() : {{}}).catch(() => ({{}})));
+  }}
+  return shards.get(key);
+}}
+async function search(query) {{
+  let hits = null;
+  for (const word of words(query)) {{
+    const index = await shard(word.slice(0, {chars}));
+    const found = new Set();
+    for (const [token, asins] of Object.entries(index)) {{
+      if (token.startsWith(word)) asins.forEach(a => found.add(a));
+    }}
+    hits = hits === null
+      ? found : new Set([...hits].filter(a => found.has(a)));
+  }}
+  if (query !== input.value) return;
+  rows.forEach((row, asin) => row.hidden = hits !== null && !hits.has(asin));
+}}
+input.addEventListener("input", () => search(input.value));
+</script>
+</body>
+</html>
+"""
+
+_ROW = (
+    '<li data-asin="{asin}"><img src="{image}" alt="" loading="lazy">'
+    '<div><a href="{url}">{title}</a>'
+    '<div class="meta">{authors}{narrators}</div>'
+    '<div class="meta">{duration}{purchased}</div></div></li>'
+)
+
+
+def render_library_page(
+    options: "FeedOptions",
+    records: t.Iterable[t.Dict[str, t.Any]]
+) -> str:
+    records = list(records)
+    rows = "\n".join(
+        _ROW.format(
+            asin=html.escape(r["asin"]),
+            image=html.escape(r["image"] or ""),
+            url=html.escape(r["url"]),
+            title=html.escape(r["title"]),
+            authors=html.escape(r["authors"]),
+            narrators=html.escape(
+                f", narrated by {r['narrators']}" if r["narrators"] else ""
+            ),
+            duration=format_seconds(r["duration"]),
+            purchased=html.escape(
+                f", purchased {r['purchased']}" if r["purchased"] else ""
+            ),
+        )
+        for r in records
+    )
+    return _PAGE.format(
+        name=html.escape(options.name),
+        desc=html.escape(options.desc),
+        feed_url=html.escape(options.feed_url),
+        count=len(records),
+        rows=rows,
+        chars=SHARD_CHARS,
+        search_dir=SEARCH_DIR,
+    )
+
+
+def _write(file: pathlib.Path, text: str) -> None:
+    tmpfile = file.with_name(f".{file.name}.tmp")
+    tmpfile.write_text(text, encoding="utf-8")
+    os.replace(tmpfile, file)
+
+
+def write_library(
+    options: "FeedOptions",
+    episodes: t.Iterable["EpisodeCreator"],
+    books: t.Optional[t.Dict[str, t.Dict[str, t.Any]]] = None
+) -> pathlib.Path:
+    """Write the library page and its search index next to the feed
+
+    EPISODES are listed newest first, as sorted for the feed. The index is
+    written before the page; every file is replaced atomically and shards
+    no book uses any more are removed. Returns the page.
+    """
+    records = [book_record(ep, books) for ep in reversed(list(episodes))]
+    directory = pathlib.Path(options.outfile).parent
+    search_dir = directory / SEARCH_DIR
+    search_dir.mkdir(exist_ok=True)
+
+    shards = build_search_index(records)
+    for key, words in shards.items():
+        _write(
+            search_dir / f"{key}.json",
+            json.dumps(words, separators=(",", ":"), sort_keys=True)
+        )
+    _write(search_dir / BOOKS_FILE, json.dumps(
+        {
+            r["asin"]: [
+                r["title"],
+                r["authors"],
+                r["narrators"],
+                r["duration"],
+                r["purchased"],
+            ]
+            for r in records
+        },
+        separators=(",", ":"),
+        ensure_ascii=False
+    ))
+    for stale in search_dir.glob("*.json"):
+        if stale.name != BOOKS_FILE and stale.stem not in shards:
+            stale.unlink()
+
+    page = directory / LIBRARY_PAGE
+    _write(page, render_library_page(options, records))
+    return page
@@ -0,0 +1,44 @@
+import json
+import os
+import pathlib
+import typing as t
+
+# https://github.com/Podcastindex-org/podcast-namespace/blob/main/chapters/jsonChapters.md
+CHAPTERS_VERSION = "1.2.0"
+CHAPTERS_MIME_TYPE = "application/json+chapters"
+CHAPTERS_SUFFIX = ".chapters.json"
+
+
+def get_chapters_file(
+    file: pathlib.Path,
+    target_dir: pathlib.Path
+) -> pathlib.Path:
+    """`podcast:chapters` sidecar of FILE, e.g. `B0..._Title.chapters.json`"""
+    return target_dir / file.with_suffix(CHAPTERS_SUFFIX).name
+
+
+def write_chapters_json(
+    chapters: t.Iterable[t.Dict[str, t.Any]],
+    file: pathlib.Path
+) -> None:
+    """Write CHAPTERS (as from `FFMeta.get_chapters`) to FILE
+
+    Written compact and replaced atomically, it is served as is.
+    """
+    doc = {
+        "version": CHAPTERS_VERSION,
+        "chapters": [
+            {
+                "startTime": chapter["start_ms"] / 1000,
+                "endTime": chapter["end_ms"] / 1000,
+                "title": chapter["title"] or f"Chapter {num}",
+            }
+            for num, chapter in enumerate(chapters, start=1)
+        ],
+    }
+    tmpfile = file.with_name(f".{file.name}.tmp")
+    tmpfile.write_text(
+        json.dumps(doc, ensure_ascii=False, separators=(",", ":")),
+        encoding="utf-8"
+    )
+    os.replace(tmpfile, file)
@@ -0,0 +1,945 @@
+import functools
+import os
+import pathlib
+import tempfile
+import time
+import typing as t
+
+from click import echo, secho
+
+from .artwork import (
+    EXPECTED_COVER_BYTES,
+    CoverScaler,
+    get_cover_source,
+    get_cover_target,
+)
+from .decrypt import (
+    BatchDecrypter,
+    FfmpegFileDecrypter,
+    load_api_chapter_info,
+)
+from .exceptions import ChapterError, LeaseHeld, ShelfError
+from .feed import (
+    EpisodeCreator,
+    FeedOptions,
+    apply_library_info,
+    create_episodes,
+    render_feed,
+    sort_episodes,
+)
+from .files import EncryptedFiles, MediaFiles, find_files
+from .layout import Layout, asset_key
+from .lease import LeaseDir
+from .library import CONCURRENCY, LibrarySnapshot
+from .probe import ProbeCache
+from .scheduler import Job, Priority, Scheduler
+
+if t.TYPE_CHECKING:
+    from concurrent.futures import ThreadPoolExecutor
+
+    from .plan import Plan
+    from .profiles import Profile
+    from .store import ContentStore
+    from .telemetry import Telemetry
+    from .variants import Variant, VariantEncoder
+    from .verify import VerifyResult
+
+# about what ffprobe reads of a file: its header and index
+PROBE_READ_BYTES = 1024 * 1024
+# about what one episode adds to the rss file
+FEED_BYTES_PER_EPISODE = 2048
+
+
+class Shelf:
+    """Everything worth keeping warm between two restocks
+
+    The `audible decrypt` and `audible rss` commands create one of these
+    per invocation. A long-running process should create one and keep
+    calling it, so the probe cache, the library snapshot and the worker
+    pool survive between refreshes.
+
+    `jobs` is the number of decrypt/artwork workers; 1 runs them in the
+    calling thread. `io_per_device` and `priority` are handed to the
+    `Scheduler` and the spawned ffmpeg processes. `telemetry` (by default
+    stored in `telemetry.default_path()`) learns how fast jobs run here, for
+    `plan_decrypt`, `plan_feed` and the `decrypt` budgets. `layout` says
+    where below the assets folder every book's files go, see `Layout`.
+    With `leases`, several nodes sharing the folders split the jobs between
+    them, see `run_jobs`. With `store`, decrypted files and covers are kept
+    once per content and not made again from an input seen before, see
+    `ContentStore`. With `drop_cache`, the files a decrypt or variant job
+    read and wrote are dropped from the page cache after it, so they don't
+    push out what a web server on the box serves, see `pagecache`.
+    """
+
+    def __init__(
+        self,
+        jobs: int = 1,
+        probe_cache: t.Optional[ProbeCache] = None,
+        library: t.Optional[LibrarySnapshot] = None,
+        io_per_device: int = 2,
+        priority: t.Optional[Priority] = None,
+        telemetry: t.Optional["Telemetry"] = None,
+        layout: t.Optional[Layout] = None,
+        leases: t.Optional[LeaseDir] = None,
+        store: t.Optional["ContentStore"] = None,
+        drop_cache: bool = False
+    ) -> None:
+        from .telemetry import Telemetry, default_path
+
+        self._jobs = jobs
+        self._io_per_device = io_per_device
+        self.priority = priority or Priority()
+        self._executor: t.Optional["ThreadPoolExecutor"] = None
+        self.probe_cache = probe_cache if probe_cache is not None \
+            else ProbeCache()
+        self.library = library if library is not None \
+            else LibrarySnapshot()
+        self.telemetry = telemetry if telemetry is not None \
+            else Telemetry(default_path())
+        self.layout = layout or Layout()
+        self.leases = leases
+        self.store = store
+        self.drop_cache = drop_cache
+
+    @property
+    def executor(self) -> t.Optional["ThreadPoolExecutor"]:
+        if self._jobs <= 1:
+            return None
+        if self._executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+
+            self._executor = ThreadPoolExecutor(
+                max_workers=self._jobs,
+                thread_name_prefix="shelf-worker"
+            )
+        return self._executor
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self.leases is not None:
+            self.leases.close()
+
+    def __enter__(self) -> "Shelf":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @staticmethod
+    def find_encrypted(
+        files: t.Iterable[str],
+        recursive: bool = True
+    ) -> t.List[pathlib.Path]:
+        """Expand names/globs to `.aax`/`.aaxc` files, see `find_files`"""
+        return find_files(files, EncryptedFiles, recursive=recursive)
+
+    @staticmethod
+    def find_media(
+        files: t.Iterable[str],
+        recursive: bool = True
+    ) -> t.List[pathlib.Path]:
+        """Expand names/globs to decrypted media, see `find_files`"""
+        return find_files(files, MediaFiles, recursive=recursive)
+
+    def probe(self, file: t.Union[pathlib.Path, str]) -> t.Dict[str, t.Any]:
+        return self.probe_cache.probe(file)
+
+    async def sync_library(
+        self,
+        client,
+        bunch_size=None,
+        start_date=None,
+        end_date=None,
+        concurrency: int = CONCURRENCY
+    ) -> t.Dict[str, t.Dict[str, t.Any]]:
+        """The library, see `fetch_library`, or the snapshot of it"""
+        return await self.library.sync(
+            client,
+            bunch_size=bunch_size,
+            start_date=start_date,
+            end_date=end_date,
+            concurrency=concurrency
+        )
+
+    def scheduler(self) -> Scheduler:
+        return Scheduler(
+            executor=self.executor,
+            jobs=self._jobs,
+            io_per_device=self._io_per_device,
+            telemetry=self.telemetry
+        )
+
+    def run_jobs(
+        self,
+        jobs: t.Iterable[Job]
+    ) -> t.List[t.Tuple[Job, t.Optional[BaseException]]]:
+        """Run JOBS on a fresh `scheduler`
+
+        With `leases`, every job runs holding the lease on its category and
+        name, so each is done by one node. Jobs another node holds are
+        tried again every quarter lease TTL until that node is done with
+        them (then they find nothing left to do) or its lease expired.
+        """
+        if self.leases is None:
+            return self.scheduler().run(jobs)
+
+        jobs = list(jobs)
+        for job in jobs:
+            job.run = functools.partial(
+                self.leases.run, f"{job.category}-{job.name}", job.run
+            )
+        results: t.Dict[int, t.Optional[BaseException]] = {}
+        pending = jobs
+        while pending:
+            for job, error in self.scheduler().run(pending):
+                results[id(job)] = error
+            pending = [
+                j for j in pending if isinstance(results[id(j)], LeaseHeld)
+            ]
+            if pending:
+                secho(
+                    f"Waiting on {len(pending)} jobs other nodes are running",
+                    fg="blue"
+                )
+                time.sleep(self.leases.ttl / 4)
+                for job in pending:
+                    # most will only find the other node's output
+                    job.expected_output_size = 0
+        return [(job, results[id(job)]) for job in jobs]
+
+    def _restore(self, work: t.Union[FfmpegFileDecrypter, CoverScaler]):
+        """Link WORK's outputs from `store` if its input was seen before"""
+        if self.store is None or not work.is_needed():
+            return
+        fingerprint = work.fingerprint()
+        outputs = work.stored_outputs()
+        if fingerprint is not None and outputs \
+                and self.store.restore(fingerprint, outputs):
+            names = ", ".join(str(o) for o in outputs.values())
+            echo(f"Linked {names}: same input as stored")
+
+    def _dedup(
+        self,
+        works: t.List[t.Union[FfmpegFileDecrypter, CoverScaler]]
+    ) -> t.List[t.Union[FfmpegFileDecrypter, CoverScaler]]:
+        """Link what `store` has of WORKS; those to link once another is done
+
+        Of works with the same input only the first is run, the others are
+        returned.
+        """
+        seen = set()
+        duplicates = []
+        for work in works:
+            self._restore(work)
+            if not work.is_needed():
+                continue
+            fingerprint = work.fingerprint()
+            if fingerprint in seen:
+                duplicates.append(work)
+            elif fingerprint is not None:
+                seen.add(fingerprint)
+        return duplicates
+
+    def _stored(
+        self,
+        works: t.List[t.Union[FfmpegFileDecrypter, CoverScaler]],
+        run: t.Callable[[], t.Any]
+    ) -> t.Callable[[], t.Any]:
+        """RUN, then put what WORKS wrote into `store`"""
+        works = [w for w in works if w.is_needed()]
+        if self.store is None or not works:
+            return run
+
+        def stored_run():
+            for work in works:
+                pending = work.pending_outputs()
+                for output in work.stored_outputs().values():
+                    # ffmpeg writes into an existing output, and so into
+                    # every link of it; outputs that are kept stay linked
+                    if output in pending and output.exists() \
+                            and output.stat().st_nlink > 1:
+                        output.unlink()
+            run()
+            for work in works:
+                outputs = work.stored_outputs()
+                if not all(o.exists() for o in outputs.values()):
+                    continue
+                fingerprint = work.fingerprint()
+                if fingerprint is None:
+                    for output in outputs.values():
+                        self.store.put(output)
+                else:
+                    self.store.record(fingerprint, outputs)
+
+        return stored_run
+
+    def _evicting(
+        self,
+        run: t.Callable[[], t.Any],
+        read: t.List[pathlib.Path],
+        written: t.Callable[[], t.List[pathlib.Path]],
+        needed: bool
+    ) -> t.Callable[[], t.Any]:
+        """RUN, then drop the files it READ and WRITTEN from the page cache
+
+        Unless the job is not NEEDED: then its outputs exist already and
+        may well be what is being served.
+        """
+        if not self.drop_cache or not needed:
+            return run
+
+        from .pagecache import evict
+
+        def evicting_run():
+            try:
+                return run()
+            finally:
+                evict(read)
+                evict(written(), written=True)
+
+        return evicting_run
+
+    def decrypt_job(self, decrypter: FfmpegFileDecrypter) -> Job:
+        return Job(
+            self._evicting(
+                self._stored([decrypter], decrypter.run),
+                [decrypter.source],
+                decrypter.outputs,
+                decrypter.is_needed()
+            ),
+            kind="io",
+            inputs=[decrypter.source],
+            output_dir=decrypter.outfile.parent,
+            expected_output_size=decrypter.expected_output_size(),
+            name=decrypter.source.name,
+            category="decrypt"
+        )
+
+    def batch_job(self, batch: BatchDecrypter) -> Job:
+        sources = [d.source for d in batch.decrypters]
+        return Job(
+            self._evicting(
+                self._stored(batch.decrypters, batch.run),
+                sources,
+                lambda: [o for d in batch.decrypters for o in d.outputs()],
+                any(d.is_needed() for d in batch.decrypters)
+            ),
+            kind="io",
+            inputs=sources,
+            output_dir=batch.decrypters[0].outfile.parent,
+            expected_output_size=sum(
+                d.expected_output_size() for d in batch.decrypters
+            ),
+            name=f"batch of {len(sources)} ({sources[0].name}, ...)",
+            category="batch"
+        )
+
+    def cover_job(self, scaler: CoverScaler) -> Job:
+        return Job(
+            self._stored([scaler], scaler.run),
+            kind="cpu",
+            inputs=[scaler.source],
+            output_dir=scaler.target.parent,
+            expected_output_size=(
+                EXPECTED_COVER_BYTES if scaler.is_needed() else 0
+            ),
+            name=scaler.target.name,
+            category="cover"
+        )
+
+    def variant_job(self, encoder: "VariantEncoder") -> Job:
+        expected = 0
+        pending = [outfile for _, outfile in encoder.pending()]
+        if encoder.is_needed():
+            duration = float(self.probe(encoder.source).get("duration", 0))
+            expected = encoder.expected_output_size(duration)
+        return Job(
+            self._evicting(
+                encoder.run,
+                [encoder.source],
+                lambda: pending,
+                bool(pending)
+            ),
+            kind="cpu",
+            inputs=[encoder.source],
+            output_dir=encoder.target_dir,
+            expected_output_size=expected,
+            name=f"variants of {encoder.source.name}",
+            category="variant"
+        )
+
+    def encode_variants(
+        self,
+        files: t.Iterable[pathlib.Path],
+        variants: t.Iterable[t.Union["Variant", str]],
+        target_dir: t.Optional[t.Union[pathlib.Path, str]] = None,
+        overwrite: bool = False,
+        faststart: bool = False
+    ) -> t.List[t.Tuple[Job, t.Optional[BaseException]]]:
+        """Encode every decrypted FILE into VARIANTS, one decode per file
+
+        Outputs go to `<TARGET_DIR>/<variant>/`, TARGET_DIR defaults to
+        each file's assets folder.
+        """
+        from .variants import VariantEncoder
+
+        variants = self._parse_variants(variants)
+        target_dir = pathlib.Path(target_dir).resolve() if target_dir \
+            else None
+        jobs = [
+            self.variant_job(VariantEncoder(
+                pathlib.Path(file),
+                variants,
+                target_dir=target_dir,
+                overwrite=overwrite,
+                faststart=faststart,
+                priority=self.priority,
+                layout=self.layout
+            ))
+            for file in files
+        ]
+        results = self.run_jobs(jobs)
+        self.telemetry.save()
+        return results
+
+    @staticmethod
+    def _parse_variants(
+        variants: t.Iterable[t.Union["Variant", str]]
+    ) -> t.List["Variant"]:
+        from .variants import Variant
+
+        return [
+            v if isinstance(v, Variant) else Variant.parse(v)
+            for v in variants
+        ]
+
+    def _decrypter_defaults(self, decrypter_options) -> None:
+        decrypter_options.setdefault("overwrite", False)
+        decrypter_options.setdefault("rebuild_chapters", False)
+        decrypter_options.setdefault("force_rebuild_chapters", False)
+        decrypter_options.setdefault("skip_rebuild_chapters", False)
+        decrypter_options.setdefault("separate_intro_outro", False)
+        decrypter_options.setdefault("copy_asin_to_metadata", False)
+        decrypter_options.setdefault("split_chapters", False)
+        decrypter_options.setdefault("keep_full", False)
+        decrypter_options.setdefault("faststart", False)
+        decrypter_options.setdefault("hls", False)
+        decrypter_options.setdefault("chapters_json", False)
+        decrypter_options.setdefault("priority", self.priority)
+
+    def _runtime(self, decrypter: FfmpegFileDecrypter) -> float:
+        """Seconds of audio in DECRYPTER's book, 0 if unknown"""
+        try:
+            chapter_info, _ = load_api_chapter_info(decrypter.source)
+            return chapter_info.get_runtime_length_ms() / 1000
+        except (ChapterError, OSError, ValueError, KeyError):
+            pass
+        if decrypter.outfile.exists():
+            return float(self.probe(decrypter.outfile).get("duration", 0))
+        return 0
+
+    def plan_decrypt(
+        self,
+        files: t.Iterable[pathlib.Path],
+        target_dir: t.Union[pathlib.Path, str],
+        activation_bytes: t.Optional[str] = None,
+        cover_size: t.Optional[int] = None,
+        variants: t.Iterable[t.Union["Variant", str]] = (),
+        **decrypter_options
+    ) -> "Plan":
+        """What `decrypt` would do with the same arguments, and its cost
+
+        Nothing is run. Files are prioritized newest download first, the
+        closest thing to the purchase date found on disk.
+        """
+        from .plan import Plan, PlanItem
+        from .variants import VariantEncoder
+
+        self._decrypter_defaults(decrypter_options)
+        target_dir = pathlib.Path(target_dir).resolve()
+        variants = self._parse_variants(variants)
+        estimate = self.telemetry.estimate
+        plan = Plan()
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            for file in files:
+                stat = file.stat()
+                priority = stat.st_mtime
+                book_dir = self.layout.directory(target_dir, file)
+                decrypter = FfmpegFileDecrypter(
+                    file=file,
+                    target_dir=book_dir,
+                    tempdir=pathlib.Path(tempdir),
+                    activation_bytes=activation_bytes,
+                    **decrypter_options
+                )
+                if decrypter.is_needed():
+                    plan.add(PlanItem(
+                        "decrypt",
+                        file,
+                        stat.st_size,
+                        decrypter.expected_output_size(),
+                        estimate("decrypt", stat.st_size)
+                    ), priority)
+
+                if cover_size is not None:
+                    scaler = CoverScaler(
+                        get_cover_source(file, cover_size),
+                        get_cover_target(file, book_dir),
+                        overwrite=decrypter_options["overwrite"]
+                    )
+                    if scaler.is_needed() and scaler.source.exists():
+                        size = scaler.source.stat().st_size
+                        plan.add(PlanItem(
+                            "cover",
+                            file,
+                            size,
+                            EXPECTED_COVER_BYTES,
+                            estimate("cover", size)
+                        ), priority)
+
+                full_file = decrypter_options["keep_full"] \
+                    or not decrypter_options["split_chapters"]
+                if variants and full_file:
+                    encoder = VariantEncoder(
+                        decrypter.outfile,
+                        variants,
+                        target_dir=target_dir,
+                        overwrite=decrypter_options["overwrite"],
+                        layout=self.layout
+                    )
+                    if encoder.is_needed():
+                        # the decrypted file is about as big as the download
+                        size = decrypter.outfile.stat().st_size \
+                            if decrypter.outfile.exists() else stat.st_size
+                        plan.add(PlanItem(
+                            "variant",
+                            file,
+                            size,
+                            encoder.expected_output_size(
+                                self._runtime(decrypter)
+                            ),
+                            estimate("variant", size)
+                        ), priority)
+        return plan
+
+    def decrypt(
+        self,
+        files: t.Iterable[pathlib.Path],
+        target_dir: t.Union[pathlib.Path, str],
+        activation_bytes: t.Optional[str] = None,
+        cover_size: t.Optional[int] = None,
+        batch_under: t.Optional[int] = None,
+        batch_max: int = 32,
+        variants: t.Iterable[t.Union["Variant", str]] = (),
+        max_bytes: t.Optional[int] = None,
+        max_seconds: t.Optional[float] = None,
+        **decrypter_options
+    ) -> t.List[t.Tuple[Job, t.Optional[BaseException]]]:
+        """Decrypt FILES into TARGET_DIR, laid out as `self.layout` says
+
+        With COVER_SIZE, the covers downloaded in that size are scaled into
+        TARGET_DIR as well, in the same scheduler run.
+        With BATCH_UNDER, files smaller than that many bytes are decrypted
+        BATCH_MAX at a time by a `BatchDecrypter`, unless chapters are split,
+        HLS packages written or the work is shared through `leases`.
+        With VARIANTS, every full file is encoded into those afterwards, see
+        `encode_variants`.
+        With MAX_BYTES (read plus written) or MAX_SECONDS, only the files
+        whose estimated work fits are processed, newest first (see
+        `plan_decrypt`); the rest is left for the next run.
+        With `store`, outputs of an input decrypted before are linked from
+        it instead; objects no asset links to anymore are dropped first.
+        `decrypter_options` are passed on to `FfmpegFileDecrypter`.
+        """
+        self._decrypter_defaults(decrypter_options)
+        target_dir = pathlib.Path(target_dir).resolve()
+        files = list(files)
+        variants = self._parse_variants(variants)
+        if self.store is not None:
+            removed = self.store.prune()
+            if removed:
+                echo(f"Dropped {removed} stored files no asset uses")
+
+        if max_bytes is not None or max_seconds is not None:
+            plan = self.plan_decrypt(
+                files,
+                target_dir,
+                activation_bytes=activation_bytes,
+                cover_size=cover_size,
+                variants=variants,
+                **decrypter_options
+            )
+            _, deferred = plan.within(max_bytes, max_seconds)
+            if deferred:
+                secho(
+                    f"Deferring {len(deferred)} of {len(plan.files())} "
+                    "files to the next run, over budget",
+                    fg="yellow"
+                )
+                files = [f for f in files if f not in deferred]
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            decrypters = [
+                FfmpegFileDecrypter(
+                    file=file,
+                    target_dir=self.layout.directory(
+                        target_dir, file, create=True
+                    ),
+                    tempdir=pathlib.Path(tempdir).resolve(),
+                    activation_bytes=activation_bytes,
+                    **decrypter_options
+                )
+                for file in files
+            ]
+            scalers = []
+            if cover_size is not None:
+                scalers = [
+                    CoverScaler(
+                        get_cover_source(file, cover_size),
+                        get_cover_target(
+                            file, self.layout.directory(target_dir, file)
+                        ),
+                        overwrite=decrypter_options["overwrite"],
+                        priority=decrypter_options["priority"]
+                    )
+                    for file in files
+                ]
+            duplicates = []
+            if self.store is not None and not decrypter_options["overwrite"]:
+                duplicates = self._dedup(decrypters + scalers)
+            todo = [d for d in decrypters if d not in duplicates]
+            small = []
+            if batch_under is not None and self.leases is None \
+                    and not decrypter_options["split_chapters"] \
+                    and not decrypter_options["hls"]:
+                small = [
+                    d for d in todo
+                    if d.is_needed() and d.source.stat().st_size < batch_under
+                ]
+            jobs = [self.decrypt_job(d) for d in todo if d not in small]
+            for start in range(0, len(small), batch_max):
+                batch = small[start:start + batch_max]
+                if len(batch) == 1:
+                    jobs.append(self.decrypt_job(batch[0]))
+                else:
+                    jobs.append(self.batch_job(BatchDecrypter(
+                        batch, priority=decrypter_options["priority"]
+                    )))
+            jobs.extend(
+                self.cover_job(scaler) for scaler in scalers
+                if scaler not in duplicates
+            )
+            results = self.run_jobs(jobs)
+            for work in duplicates:
+                self._restore(work)
+            self.telemetry.save()
+
+        if variants:
+            decrypted = [
+                d.outfile for d in decrypters
+                if decrypter_options["keep_full"]
+                or not decrypter_options["split_chapters"]
+            ]
+            results.extend(self.encode_variants(
+                [f for f in decrypted if f.exists()],
+                variants,
+                target_dir=target_dir,
+                overwrite=decrypter_options["overwrite"],
+                faststart=decrypter_options["faststart"]
+            ))
+        return results
+
+    def decrypt_profiles(
+        self,
+        profiles: t.Iterable["Profile"],
+        target_dir: t.Union[pathlib.Path, str],
+        activation_bytes: t.Dict[str, t.Optional[str]],
+        **options
+    ) -> t.List[t.Tuple[Job, t.Optional[BaseException]]]:
+        """Decrypt the downloads of every profile into one TARGET_DIR
+
+        A book in the downloads of several profiles is decrypted once, from
+        the first profile's. `.aax` files need their account's
+        ACTIVATION_BYTES (by profile name), so they run in one scheduler
+        run per account; everything else shares one. `options` are passed
+        on to `decrypt`.
+        """
+        seen = set()
+        groups: t.Dict[t.Optional[str], t.List[pathlib.Path]] = {}
+        for profile in profiles:
+            files = self.find_encrypted([
+                str(profile.downloads / pattern)
+                for pattern in EncryptedFiles.get_all_patterns()
+            ])
+            for file in files:
+                key = asset_key(file.name)
+                if key in seen:
+                    continue
+                seen.add(key)
+                credentials = activation_bytes.get(profile.name) \
+                    if EncryptedFiles(file.suffix) == EncryptedFiles.AAX \
+                    else None
+                groups.setdefault(credentials, []).append(file)
+
+        results = []
+        for credentials, files in groups.items():
+            results.extend(self.decrypt(
+                files,
+                target_dir,
+                activation_bytes=credentials,
+                **options
+            ))
+        return results
+
+    def verify(
+        self,
+        files: t.Iterable[pathlib.Path],
+        target_dir: t.Union[pathlib.Path, str],
+        rebuild_chapters: bool = False,
+        skip_rebuild_chapters: bool = False,
+        separate_intro_outro: bool = False,
+        copy_asin_to_metadata: bool = False,
+        tolerance_ms: int = 2000,
+        sample: int = 0
+    ) -> t.List["VerifyResult"]:
+        """Check the decrypted outputs of FILES in TARGET_DIR
+
+        Reads only the MP4 index of every output, in parallel processes:
+        the sample tables must cover the mdat, the duration must match the
+        voucher's runtime within TOLERANCE_MS, and, for the options the
+        files were decrypted with, the chapter count and the episode_id
+        tag must match. SAMPLE > 0 also decodes that many random 10s
+        windows per intact file.
+        """
+        # multiprocessing is slow to import, keep it out of plugin startup
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+        from .verify import VerifyResult, sample_decode, verify_file
+
+        target_dir = pathlib.Path(target_dir).resolve()
+        results: t.Dict[pathlib.Path, VerifyResult] = {}
+        outfiles = []
+        tasks = []
+        for file in files:
+            outfile = self.layout.directory(target_dir, file) \
+                / file.with_suffix(".m4a").name
+            outfiles.append(outfile)
+            if not outfile.exists():
+                results[outfile] = VerifyResult(outfile, ["missing"])
+                continue
+            expect = {
+                "tolerance_ms": tolerance_ms,
+                "require_episode_id":
+                    copy_asin_to_metadata and file.suffix == ".aaxc",
+            }
+            try:
+                chapter_info, _ = load_api_chapter_info(file)
+            except (ChapterError, OSError, ValueError):
+                chapter_info = None
+            if chapter_info is not None:
+                expect["runtime_length_ms"] = \
+                    chapter_info.get_runtime_length_ms()
+                if rebuild_chapters and not skip_rebuild_chapters \
+                        and chapter_info.is_accurate():
+                    expect["chapter_count"] = chapter_info.count_chapters() \
+                        + (2 if separate_intro_outro else 0)
+            tasks.append((outfile, expect))
+
+        workers = max(self._jobs, os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                (outfile, expect, pool.submit(verify_file, outfile, **expect))
+                for outfile, expect in tasks
+            ]
+            for outfile, expect, future in futures:
+                results[outfile] = future.result()
+
+        if sample > 0:
+            intact = [
+                (results[outfile], expect.get("runtime_length_ms", 0))
+                for outfile, expect in tasks if results[outfile].ok
+            ]
+            with ThreadPoolExecutor(max_workers=self._jobs) as pool:
+                decodes = [
+                    (result, pool.submit(
+                        sample_decode, result.file, runtime_length_ms,
+                        samples=sample, priority=self.priority
+                    ))
+                    for result, runtime_length_ms in intact
+                ]
+                for result, future in decodes:
+                    result.problems.extend(future.result())
+
+        return [results[outfile] for outfile in outfiles]
+
+    def episodes(
+        self,
+        files: t.Iterable[pathlib.Path],
+        url_prefix: str,
+        make_public: bool = False,
+        media_prefix: t.Optional[str] = None,
+        hls: bool = False
+    ) -> t.List[EpisodeCreator]:
+        """Episodes for FILES
+
+        MEDIA_PREFIX is the enclosure URL prefix, if it is not URL_PREFIX
+        (e.g. for the subfolder of a variant). With HLS, enclosures point at
+        the file's HLS playlist where `decrypt(hls=True)` wrote one.
+        """
+        files = list(files)
+        stale = sum(1 for f in files if not self.probe_cache.is_fresh(f))
+        start = time.monotonic()
+        episodes = create_episodes(
+            files,
+            url_prefix=url_prefix,
+            make_public=make_public,
+            probe_cache=self.probe_cache,
+            media_prefix=media_prefix,
+            hls=hls,
+            layout=self.layout
+        )
+        self.telemetry.record(
+            "probe", stale * PROBE_READ_BYTES, time.monotonic() - start
+        )
+        self.telemetry.save()
+        return episodes
+
+    def plan_feed(
+        self,
+        files: t.Iterable[pathlib.Path],
+        outfile: t.Union[pathlib.Path, str]
+    ) -> "Plan":
+        """What `episodes` and `render_feed` would do for FILES, and its cost
+
+        Every file the probe cache cannot answer is probed again; the feed
+        is costed as written in full, cached item fragments or not.
+        """
+        from .plan import Plan, PlanItem
+
+        estimate = self.telemetry.estimate
+        plan = Plan()
+        files = list(files)
+        for file in files:
+            if not self.probe_cache.is_fresh(file):
+                plan.add(PlanItem(
+                    "probe",
+                    file,
+                    PROBE_READ_BYTES,
+                    0,
+                    estimate("probe", PROBE_READ_BYTES)
+                ), file.stat().st_mtime)
+        size = FEED_BYTES_PER_EPISODE * len(files)
+        plan.add(PlanItem(
+            "render",
+            pathlib.Path(outfile),
+            0,
+            size,
+            estimate("render", size)
+        ))
+        return plan
+
+    def render_feed(
+        self,
+        options: FeedOptions,
+        episodes: t.List[EpisodeCreator],
+        books: t.Optional[t.Dict[str, t.Dict[str, t.Any]]] = None,
+        use_library_api: bool = False,
+        sort_by_purchase_date: bool = False,
+        ping_hub: bool = True
+    ) -> bool:
+        """Sort EPISODES and write the feed to `options.outfile`
+
+        BOOKS (from `sync_library`) is needed for `use_library_api` and
+        `sort_by_purchase_date`, and fills in the library page (see
+        `FeedOptions.library_page`) where given. With PING_HUB, the feed's
+        WebSub hub (`FeedOptions.hub_url`) is told about a changed feed,
+        see `ping_hub`. Returns whether the feed changed.
+        """
+        if use_library_api or sort_by_purchase_date:
+            apply_library_info(
+                episodes,
+                books,
+                use_library_api=use_library_api,
+                sort_by_purchase_date=sort_by_purchase_date
+            )
+        sort_episodes(episodes, sort_by_purchase_date=sort_by_purchase_date)
+        start = time.monotonic()
+        changed = render_feed(options, episodes)
+        self.telemetry.record(
+            "render",
+            pathlib.Path(options.outfile).stat().st_size,
+            time.monotonic() - start
+        )
+        self.telemetry.save()
+        if options.library_page:
+            from .catalog import write_library
+
+            write_library(options, episodes, books=books)
+        if options.hub_url and ping_hub:
+            self.ping_hub(options)
+        return changed
+
+    @staticmethod
+    def ping_hub(options: FeedOptions) -> bool:
+        """Tell `options.hub_url` about the feed, if it changed since
+
+        A hub that cannot be reached is only reported; the ping is
+        repeated by the next call. Returns whether the hub was pinged.
+        """
+        # httpx is only needed here
+        from .websub import ping_hub
+
+        try:
+            pinged = ping_hub(
+                options.hub_url,
+                options.feed_url,
+                pathlib.Path(options.outfile)
+            )
+        except ShelfError as exc:
+            secho(f"{exc}, retrying with the next feed", fg="yellow")
+            return False
+        if pinged:
+            echo(f"WebSub hub {options.hub_url} notified")
+        return pinged
+
+    def render_profile_feeds(
+        self,
+        profiles: t.Iterable["Profile"],
+        files: t.Iterable[pathlib.Path],
+        assets_dir: t.Union[pathlib.Path, str]
+    ) -> t.List[pathlib.Path]:
+        """Write the feed of every profile, of the FILES in its library
+
+        FILES are the media of the shared ASSETS_DIR; each profile's feed
+        lists those whose ASIN is in its synced `books`, with its own
+        options. The probe cache is shared, so a book several profiles own
+        is probed once. Returns the feeds.
+        """
+        assets_dir = pathlib.Path(assets_dir).resolve()
+        files = list(files)
+        feeds = []
+        for profile in profiles:
+            options = profile.feed_options(assets_dir)
+            pathlib.Path(options.outfile).parent.mkdir(
+                parents=True, exist_ok=True
+            )
+            books = profile.books or {}
+            episodes = self.episodes(
+                [f for f in files if asset_key(f.name) in books],
+                url_prefix=options.url_prefix,
+                make_public=options.make_public,
+                hls=profile.hls
+            )
+            self.render_feed(
+                options,
+                episodes,
+                books=books,
+                use_library_api=profile.use_library_api,
+                sort_by_purchase_date=profile.sort_by_purchase_date
+            )
+            feeds.append(pathlib.Path(options.outfile))
+        return feeds
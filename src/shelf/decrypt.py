@@ -0,0 +1,959 @@
+import hashlib
+import json
+import operator
+import pathlib
+import re
+import shutil
+import subprocess  # noqa: S404
+import typing as t
+from concurrent.futures import Executor
+from functools import reduce
+
+from click import echo, secho
+
+from .exceptions import ChapterError, ShelfError
+from .files import EncryptedFiles
+from .scheduler import Priority
+from .chapters import get_chapters_file, write_chapters_json
+from .streaming import FASTSTART_ARGS, get_hls_dir, hls_output_args
+
+# what tells .aax files apart, they come without a voucher
+FINGERPRINT_BYTES = 1024 * 1024
+
+
+def recursive_lookup_dict(key: str, dictionary: t.Dict[str, t.Any]) -> t.Any:
+    if key in dictionary:
+        return dictionary[key]
+    for value in dictionary.values():
+        if isinstance(value, dict):
+            try:
+                item = recursive_lookup_dict(key, value)
+            except KeyError:
+                continue
+            else:
+                return item
+
+    raise KeyError
+
+
+def get_aaxc_credentials(voucher_file: pathlib.Path):
+    if not voucher_file.exists() or not voucher_file.is_file():
+        raise ShelfError(f"Voucher file {voucher_file} not found.")
+
+    voucher_dict = json.loads(voucher_file.read_text())
+    try:
+        key = recursive_lookup_dict("key", voucher_dict)
+        iv = recursive_lookup_dict("iv", voucher_dict)
+    except KeyError:
+        raise ShelfError(
+            f"No key/iv found in file {voucher_file}."
+        ) from None
+
+    return key, iv
+
+
+def get_aaxc_asin(voucher_file: pathlib.Path):
+    if not voucher_file.exists() or not voucher_file.is_file():
+        raise ShelfError(f"Voucher file {voucher_file} not found.")
+
+    voucher_dict = json.loads(voucher_file.read_text())
+    try:
+        asin = recursive_lookup_dict("asin", voucher_dict)
+    except KeyError:
+        raise ShelfError(
+            f"No ASIN found in file {voucher_file}."
+        ) from None
+    return asin
+
+
+class ApiChapterInfo:
+    def __init__(self, content_metadata: t.Dict[str, t.Any]) -> None:
+        chapter_info = self._parse(content_metadata)
+        self._chapter_info = chapter_info
+
+    @classmethod
+    def from_file(cls, file: t.Union[pathlib.Path, str]) -> "ApiChapterInfo":
+        file = pathlib.Path(file)
+        if not file.exists() or not file.is_file():
+            raise ChapterError(f"Chapter file {file} not found.")
+        content_string = pathlib.Path(file).read_text("utf-8")
+        content_json = json.loads(content_string)
+        return cls(content_json)
+
+    @staticmethod
+    def _parse(content_metadata: t.Dict[str, t.Any]) -> t.Dict[str, t.Any]:
+        if "chapters" in content_metadata:
+            return content_metadata
+
+        try:
+            return recursive_lookup_dict("chapter_info", content_metadata)
+        except KeyError:
+            raise ChapterError("No chapter info found.") from None
+
+    def count_chapters(self):
+        return len(self.get_chapters())
+
+    def get_chapters(self, separate_intro_outro=False):
+        def extract_chapters(initial, current):
+            if "chapters" in current:
+                return initial + [current] + current["chapters"]
+            else:
+                return initial + [current]
+
+        chapters = list(
+            reduce(
+                extract_chapters,
+                self._chapter_info["chapters"],
+                [],
+            )
+        )
+
+        if separate_intro_outro:
+            return self._separate_intro_outro(chapters)
+
+        return chapters
+
+    def get_intro_duration_ms(self):
+        return self._chapter_info["brandIntroDurationMs"]
+
+    def get_outro_duration_ms(self):
+        return self._chapter_info["brandOutroDurationMs"]
+
+    def get_runtime_length_ms(self):
+        return self._chapter_info["runtime_length_ms"]
+
+    def is_accurate(self):
+        return self._chapter_info["is_accurate"]
+
+    def _separate_intro_outro(self, chapters):
+        echo("Separate Audible Brand Intro and Outro to own Chapter.")
+        chapters.sort(key=operator.itemgetter("start_offset_ms"))
+
+        first = chapters[0]
+        intro_dur_ms = self.get_intro_duration_ms()
+        first["start_offset_ms"] = intro_dur_ms
+        first["start_offset_sec"] = round(first["start_offset_ms"] / 1000)
+        first["length_ms"] -= intro_dur_ms
+
+        last = chapters[-1]
+        outro_dur_ms = self.get_outro_duration_ms()
+        last["length_ms"] -= outro_dur_ms
+
+        chapters.append(
+            {
+                "length_ms": intro_dur_ms,
+                "start_offset_ms": 0,
+                "start_offset_sec": 0,
+                "title": "Intro",
+            }
+        )
+        chapters.append(
+            {
+                "length_ms": outro_dur_ms,
+                "start_offset_ms": self.get_runtime_length_ms() - outro_dur_ms,
+                "start_offset_sec": round(
+                    (self.get_runtime_length_ms() - outro_dur_ms) / 1000
+                ),
+                "title": "Outro",
+            }
+        )
+        chapters.sort(key=operator.itemgetter("start_offset_ms"))
+
+        return chapters
+
+
+class FFMeta:
+    SECTION = r"\[(?P<header>[^]]+)\]"
+    OPTION = r"(?P<option>.*?)\s*(?:(?P<vi>=)\s*(?P<value>.*))?$"
+
+    def __init__(self, ffmeta_file: t.Union[str, pathlib.Path]) -> None:
+        self._ffmeta_raw = pathlib.Path(ffmeta_file).read_text("utf-8")
+        self._ffmeta_parsed = self._parse_ffmeta()
+
+    def _parse_ffmeta(self):
+        parsed_dict = {}
+        start_section = "_"
+        cursec = parsed_dict[start_section] = {}
+        num_chap = 0
+
+        for line in iter(self._ffmeta_raw.splitlines()):
+            mo = re.match(self.SECTION, line)
+            if mo:
+                sec_name = mo.group("header")
+                if sec_name == "CHAPTER":
+                    num_chap += 1
+                    if sec_name not in parsed_dict:
+                        parsed_dict[sec_name] = {}
+                    cursec = parsed_dict[sec_name][num_chap] = {}
+                else:
+                    cursec = parsed_dict[sec_name] = {}
+            else:
+                match = re.match(self.OPTION, line)
+                cursec.update({match.group("option"): match.group("value")})
+
+        return parsed_dict
+
+    def count_chapters(self):
+        return len(self._ffmeta_parsed["CHAPTER"])
+
+    def get_chapters(self) -> t.List[t.Dict[str, t.Any]]:
+        """Chapters in file order, with start and end in ms and title"""
+        chapters = []
+        for chapter in self._ffmeta_parsed.get("CHAPTER", {}).values():
+            num, den = str(chapter.get("TIMEBASE", "1/1000")).split("/")
+            scale = int(num) * 1000 / int(den)
+            chapters.append({
+                "start_ms": round(int(chapter["START"]) * scale),
+                "end_ms": round(int(chapter["END"]) * scale),
+                "title": chapter.get("title"),
+            })
+        return chapters
+
+    @property
+    def date(self):
+        return self._ffmeta_parsed["_"]['date']
+
+    @property
+    def genre(self):
+        return self._ffmeta_parsed["_"]['genre']
+
+    @property
+    def title(self):
+        return self._ffmeta_parsed["_"]['title']
+
+    @property
+    def artist(self):
+        return self._ffmeta_parsed["_"]['artist']
+
+    @property
+    def album_artist(self):
+        return self._ffmeta_parsed["_"]['album_artist']
+
+    @property
+    def album(self):
+        return self._ffmeta_parsed["_"]['album']
+
+    @property
+    def comment(self):
+        return self._ffmeta_parsed["_"]['comment']
+
+    @property
+    def copyright(self):
+        return self._ffmeta_parsed["_"]['copyright']
+
+    def set_chapter_option(self, num, option, value):
+        chapter = self._ffmeta_parsed["CHAPTER"][num]
+        for chapter_option in chapter:
+            if chapter_option == option:
+                chapter[chapter_option] = value
+
+    def write(self, filename):
+        fp = pathlib.Path(filename).open("w", encoding="utf-8")
+        d = "="
+
+        for section in self._ffmeta_parsed:
+            if section == "_":
+                self._write_section(fp, None, self._ffmeta_parsed[section], d)
+            elif section == "CHAPTER":
+                # TODO: Tue etwas
+                for chapter in self._ffmeta_parsed[section]:
+                    self._write_section(
+                        fp, section, self._ffmeta_parsed[section][chapter], d
+                    )
+            else:
+                self._write_section(
+                    fp, section, self._ffmeta_parsed[section], d
+                )
+
+    @staticmethod
+    def _write_section(fp, section_name, section_items, delimiter):
+        """Write a single section to the specified `fp`."""
+        if section_name is not None:
+            fp.write(f"[{section_name}]\n")
+
+        for key, value in section_items.items():
+            if value is None:
+                fp.write(f"{key}\n")
+            else:
+                fp.write(f"{key}{delimiter}{value}\n")
+
+    def update_chapters_from_chapter_info(
+        self,
+        chapter_info: ApiChapterInfo,
+        force_rebuild_chapters: bool = False,
+        separate_intro_outro: bool = False
+    ) -> None:
+        if not chapter_info.is_accurate():
+            echo("Metadata from API is not accurate. Skip.")
+            return
+
+        if chapter_info.count_chapters() != self.count_chapters():
+            if force_rebuild_chapters:
+                echo("Force rebuild chapters due to chapter mismatch.")
+            else:
+                raise ChapterError("Chapter mismatch")
+
+        echo(f"Found {chapter_info.count_chapters()} chapters to prepare.")
+
+        api_chapters = chapter_info.get_chapters(separate_intro_outro)
+
+        num_chap = 0
+        new_chapters = {}
+        for chapter in api_chapters:
+            chap_start = chapter["start_offset_ms"]
+            chap_end = chap_start + chapter["length_ms"]
+            num_chap += 1
+            new_chapters[num_chap] = {
+                "TIMEBASE": "1/1000",
+                "START": chap_start,
+                "END": chap_end,
+                "title": chapter["title"],
+            }
+        self._ffmeta_parsed["CHAPTER"] = new_chapters
+
+
+def _get_voucher_filename(file: pathlib.Path) -> pathlib.Path:
+    return file.with_suffix(".voucher")
+
+
+def _get_chapter_filename(file: pathlib.Path) -> pathlib.Path:
+    base_filename = file.stem.rsplit("-", 1)[0]
+    return file.with_name(base_filename + "-chapters.json")
+
+
+_UNSAFE_FILENAME = r'[\x00-\x1f/\\:*?"<>|]+'
+
+
+def _chapter_filename(num: int, title: t.Optional[str]) -> str:
+    title = re.sub(_UNSAFE_FILENAME, "_", title or "").strip(" .")[:80]
+    return f"{num:03d} {title}.m4a" if title else f"{num:03d}.m4a"
+
+
+def _get_ffmeta_file(file: pathlib.Path,
+                     tempdir: pathlib.Path
+                     ) -> pathlib.Path:
+    metaname = file.with_suffix(".meta").name
+    metafile = tempdir / metaname
+    return metafile
+
+
+def load_api_chapter_info(
+    file: pathlib.Path
+) -> t.Tuple[ApiChapterInfo, pathlib.Path]:
+    """Chapter info for FILE from its voucher, or its chapter file"""
+    try:
+        chapter_filename = _get_voucher_filename(file)
+        return ApiChapterInfo.from_file(chapter_filename), chapter_filename
+    except ChapterError:
+        chapter_filename = _get_chapter_filename(file)
+        return ApiChapterInfo.from_file(chapter_filename), chapter_filename
+
+
+class FfmpegFileDecrypter:
+    def __init__(
+        self,
+        file: pathlib.Path,
+        target_dir: pathlib.Path,
+        tempdir: pathlib.Path,
+        activation_bytes: t.Optional[str],
+        overwrite: bool,
+        rebuild_chapters: bool,
+        force_rebuild_chapters: bool,
+        skip_rebuild_chapters: bool,
+        separate_intro_outro: bool,
+        copy_asin_to_metadata: bool,
+        split_chapters: bool = False,
+        keep_full: bool = False,
+        faststart: bool = False,
+        hls: bool = False,
+        chapters_json: bool = False,
+        priority: t.Optional[Priority] = None
+    ) -> None:
+        file_type = EncryptedFiles(file.suffix)
+
+        credentials = None
+        asin = None
+        if file_type == EncryptedFiles.AAX:
+            if activation_bytes is None:
+                raise ShelfError(
+                    "No activation bytes found. Do you ever run "
+                    "`audible activation-bytes`?"
+                )
+            credentials = activation_bytes
+        elif file_type == EncryptedFiles.AAXC:
+            voucher_filename = _get_voucher_filename(file)
+            credentials = get_aaxc_credentials(voucher_filename)
+            if copy_asin_to_metadata:
+                asin = get_aaxc_asin(voucher_filename)
+
+        self._source = file
+        self._credentials: t.Optional[t.Union[str, t.Tuple[str]]] = credentials
+        self._target_dir = target_dir
+        self._tempdir = tempdir
+        self._overwrite = overwrite
+        self._rebuild_chapters = rebuild_chapters
+        self._force_rebuild_chapters = force_rebuild_chapters
+        self._skip_rebuild_chapters = skip_rebuild_chapters
+        self._separate_intro_outro = separate_intro_outro
+        self._api_chapter: t.Optional[ApiChapterInfo] = None
+        self._ffmeta: t.Optional[FFMeta] = None
+        self._is_rebuilded: bool = False
+        self._asin = asin
+        self._copy_asin_to_metadata = copy_asin_to_metadata
+        self._split_chapters = split_chapters
+        self._keep_full = keep_full or not split_chapters
+        self._faststart = faststart
+        self._hls = hls
+        self._chapters_json = chapters_json
+        self._priority = priority or Priority()
+
+    @property
+    def source(self) -> pathlib.Path:
+        return self._source
+
+    @property
+    def outfile(self) -> pathlib.Path:
+        return self._target_dir / self._source.with_suffix(".m4a").name
+
+    @property
+    def chapter_dir(self) -> pathlib.Path:
+        """Folder for the per-chapter files of `--split-chapters`"""
+        return self._target_dir / self._source.stem
+
+    @property
+    def hls_dir(self) -> pathlib.Path:
+        return get_hls_dir(self._source, self._target_dir)
+
+    @property
+    def chapters_file(self) -> pathlib.Path:
+        return get_chapters_file(self._source, self._target_dir)
+
+    def outputs(self) -> t.List[pathlib.Path]:
+        """Files and folders a run writes"""
+        outputs = [self.chapter_dir] if self._split_chapters else []
+        if self._keep_full:
+            outputs.append(self.outfile)
+        if self._hls:
+            outputs.append(self.hls_dir)
+        return outputs
+
+    def is_needed(self) -> bool:
+        return self._overwrite or not all(o.exists() for o in self.outputs())
+
+    def expected_output_size(self) -> int:
+        """Bytes this will write, a stream copy is about the input size"""
+        return self._source.stat().st_size * len(self.pending_outputs())
+
+    def fingerprint(self) -> t.Optional[str]:
+        """Digest of what the outputs are made of, for a `ContentStore`
+
+        Inputs of the same size and voucher key/iv (`.aax`: first MiB)
+        decrypted with the same options and chapters give the same outputs.
+        None with split chapters or HLS, whose folders are not stored.
+        """
+        if self._split_chapters or self._hls:
+            return None
+        if isinstance(self._credentials, tuple):
+            source = list(self._credentials)
+        else:
+            with self._source.open("rb") as f:
+                source = hashlib.sha256(f.read(FINGERPRINT_BYTES)).hexdigest()
+        chapters = None
+        if self._rebuild_chapters or self._chapters_json:
+            try:
+                chapter_info, _ = load_api_chapter_info(self._source)
+                chapters = chapter_info.get_chapters()
+            except (ChapterError, ValueError, KeyError):
+                pass
+        data = json.dumps([
+            source,
+            self._source.stat().st_size,
+            self._asin,
+            self._rebuild_chapters,
+            self._force_rebuild_chapters,
+            self._skip_rebuild_chapters,
+            self._separate_intro_outro,
+            self._faststart,
+            self._chapters_json,
+            chapters,
+        ])
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def stored_outputs(self) -> t.Dict[str, pathlib.Path]:
+        """Files a `ContentStore` keeps, by role"""
+        outputs = {"media": self.outfile} if self._keep_full else {}
+        if self._chapters_json:
+            outputs["chapters"] = self.chapters_file
+        return outputs
+
+    @property
+    def api_chapter(self) -> ApiChapterInfo:
+        if self._api_chapter is None:
+            self._api_chapter, chapter_filename = \
+                load_api_chapter_info(self._source)
+            echo(f"Using chapters from {chapter_filename}")
+        return self._api_chapter
+
+    def credentials_cmd(self) -> t.List[str]:
+        if isinstance(self._credentials, tuple):
+            key, iv = self._credentials
+            return [
+                "-audible_key",
+                str(key),
+                "-audible_iv",
+                str(iv),
+            ]
+        return [
+            "-activation_bytes",
+            str(self._credentials),
+        ]
+
+    @property
+    def metafile(self) -> pathlib.Path:
+        return _get_ffmeta_file(self._source, self._tempdir)
+
+    def needs_ffmeta(self) -> bool:
+        return self._ffmeta is None and bool(
+            self._rebuild_chapters
+            or self._chapters_json
+            or (self._copy_asin_to_metadata and self._asin)
+        )
+
+    def ffmeta_output_args(self, input_index: int) -> t.List[str]:
+        """Output options extracting input INPUT_INDEX's ffmetadata"""
+        return [
+            "-map_metadata",
+            str(input_index),
+            "-map_chapters",
+            str(input_index),
+            "-f",
+            "ffmetadata",
+            str(self.metafile),
+        ]
+
+    def load_ffmeta(self) -> None:
+        self._ffmeta = FFMeta(self.metafile)
+
+    @property
+    def ffmeta(self) -> FFMeta:
+        if self._ffmeta is None:
+            base_cmd = [
+                "ffmpeg",
+                "-v",
+                "info",
+                "-stats",
+            ]
+            base_cmd.extend(self.credentials_cmd())
+
+            extract_cmd = [
+                "-i",
+                str(self._source),
+                "-f",
+                "ffmetadata",
+                str(self.metafile),
+            ]
+            base_cmd.extend(extract_cmd)
+
+            subprocess.check_output(  # noqa: S603
+                self._priority.wrap(base_cmd), text=True
+            )
+            self.load_ffmeta()
+
+        return self._ffmeta
+
+    def rebuild_chapters(self) -> None:
+        if not self._is_rebuilded:
+            self.ffmeta.update_chapters_from_chapter_info(
+                self.api_chapter,
+                self._force_rebuild_chapters,
+                self._separate_intro_outro
+            )
+            self._is_rebuilded = True
+
+    def check_outfile(self) -> bool:
+        """Report existing outputs, return whether to (re)write them"""
+        existing = [o for o in self.outputs() if o.exists()]
+        if not existing:
+            return True
+        names = ", ".join(str(o) for o in existing)
+        if self._overwrite:
+            secho(f"Overwrite {names}: already exists", fg="blue")
+            return True
+        if len(existing) == len(self.outputs()):
+            secho(f"Skip {names}: already exists", fg="blue")
+            return False
+        secho(f"Keep {names}: already exists", fg="blue")
+        return True
+
+    def pending_outputs(self) -> t.List[pathlib.Path]:
+        """Outputs a run writes: the missing ones, all with `overwrite`"""
+        return [o for o in self.outputs() if self._overwrite or not o.exists()]
+
+    def write_chapters_json(self) -> None:
+        """Write the final chapters as a `podcast:chapters` sidecar"""
+        write_chapters_json(self.ffmeta.get_chapters(), self.chapters_file)
+
+    def prepare_metadata(self) -> t.Optional[pathlib.Path]:
+        """Write the ffmetadata file with rebuilt chapters, if any
+
+        Also writes the chapters sidecar, before the output exists, so a
+        feed never lists the output without it.
+        Returns the file to add as an extra input, or None.
+        """
+        metafile = self._prepare_metafile()
+        if self._chapters_json:
+            self.write_chapters_json()
+        return metafile
+
+    def _prepare_metafile(self) -> t.Optional[pathlib.Path]:
+        if not self._rebuild_chapters:
+            return None
+
+        metafile = self.metafile
+        try:
+            self.rebuild_chapters()
+            self.ffmeta.write(metafile)
+        except ChapterError:
+            if self._skip_rebuild_chapters:
+                echo("Skip rebuild chapters due to chapter mismatch.")
+                return None
+            raise
+        return metafile
+
+    def output_args(
+        self,
+        input_index: int = 0,
+        meta_index: t.Optional[int] = None,
+        explicit_map: bool = False
+    ) -> t.List[str]:
+        """Output options writing input INPUT_INDEX to `outfile`
+
+        With several inputs in one process, EXPLICIT_MAP keeps ffmpeg from
+        picking streams of other inputs.
+        """
+        args = []
+        if explicit_map:
+            args.extend(
+                [
+                    "-map",
+                    f"{input_index}:a:0",
+                    "-map",
+                    f"{input_index}:v:0?",
+                ]
+            )
+        args.extend(["-map_metadata", str(input_index)])
+        if meta_index is not None:
+            args.extend(["-map_chapters", str(meta_index)])
+
+        if self._copy_asin_to_metadata and self._asin:
+            args.extend(
+                [
+                    "-metadata:g",
+                    f"description=DescrpTION {self.ffmeta.comment}",
+                    "-metadata:g",
+                    f"synopsis=SynopSIS {self.ffmeta.comment}",
+                    "-metadata:g",
+                    f"episode_id={self._asin}",
+                ]
+            )
+
+        if self._faststart:
+            args.extend(FASTSTART_ARGS)
+        args.extend(
+            [
+                "-c",
+                "copy",
+                str(self.outfile),
+            ]
+        )
+        return args
+
+    def chapter_output_args(
+        self,
+        workdir: pathlib.Path,
+        input_index: int = 0
+    ) -> t.List[str]:
+        """One output per chapter of input INPUT_INDEX, written to WORKDIR
+
+        Every output cuts its span out of the same input by stream copy,
+        so ffmpeg reads the input once however many chapters there are.
+        """
+        chapters = self.ffmeta.get_chapters()
+        if not chapters:
+            raise ChapterError(f"{self._source} has no chapters to split")
+        try:
+            album = self.ffmeta.title
+        except KeyError:
+            album = self._source.stem
+
+        args = []
+        for num, chapter in enumerate(chapters, start=1):
+            title = chapter["title"] or f"Chapter {num}"
+            args.extend(
+                [
+                    "-map",
+                    f"{input_index}:a:0",
+                    "-ss",
+                    f"{chapter['start_ms'] / 1000:.3f}",
+                    "-t",
+                    f"{(chapter['end_ms'] - chapter['start_ms']) / 1000:.3f}",
+                    "-map_metadata",
+                    str(input_index),
+                    "-map_chapters",
+                    "-1",
+                    "-metadata:g",
+                    f"title={title}",
+                    "-metadata:g",
+                    f"album={album}",
+                    "-metadata:g",
+                    f"track={num}/{len(chapters)}",
+                ]
+            )
+            if self._copy_asin_to_metadata and self._asin:
+                args.extend(
+                    ["-metadata:g", f"episode_id={self._asin}-{num:03d}"]
+                )
+            if self._faststart:
+                args.extend(FASTSTART_ARGS)
+            args.extend(
+                [
+                    "-c",
+                    "copy",
+                    str(workdir / _chapter_filename(num, chapter["title"])),
+                ]
+            )
+        return args
+
+    @staticmethod
+    def _stage_dir(final: pathlib.Path) -> pathlib.Path:
+        # folders are written under a hidden name and renamed when done, so
+        # an interrupted run leaves nothing half-written behind
+        workdir = final.with_name(f".{final.name}.tmp")
+        shutil.rmtree(workdir, ignore_errors=True)
+        workdir.mkdir(parents=True)
+        return workdir
+
+    def run(self):
+        if not self.check_outfile():
+            if self._chapters_json and not self.chapters_file.exists():
+                # outputs from before `--chapters-json`
+                self.prepare_metadata()
+            return
+
+        base_cmd = [
+            "ffmpeg",
+            "-v",
+            "info",
+            "-stats",
+        ]
+        if self._overwrite:
+            base_cmd.append("-y")
+        base_cmd.extend(self.credentials_cmd())
+        base_cmd.extend(
+            [
+                "-i",
+                str(self._source),
+            ]
+        )
+
+        # existing outputs are kept, ffmpeg would refuse them without -y
+        pending = self.pending_outputs()
+        write_full = self.outfile in pending
+
+        # also rebuilds the chapters `--split-chapters` cuts at
+        metafile = self.prepare_metadata()
+        if not write_full:
+            metafile = None
+        if metafile is not None:
+            base_cmd.extend(["-i", str(metafile)])
+
+        # every output reads the same input, so it is read only once
+        staged: t.List[t.Tuple[pathlib.Path, pathlib.Path]] = []
+        try:
+            if self.chapter_dir in pending:
+                workdir = self._stage_dir(self.chapter_dir)
+                staged.append((workdir, self.chapter_dir))
+                base_cmd.extend(self.chapter_output_args(workdir))
+            if write_full:
+                base_cmd.extend(self.output_args(
+                    0,
+                    1 if metafile is not None else None,
+                    explicit_map=len(pending) > 1
+                ))
+            if self.hls_dir in pending:
+                workdir = self._stage_dir(self.hls_dir)
+                staged.append((workdir, self.hls_dir))
+                base_cmd.extend(hls_output_args(workdir))
+
+            subprocess.check_output(  # noqa: S603
+                self._priority.wrap(base_cmd), text=True
+            )
+            for workdir, final in staged:
+                if final.exists():
+                    shutil.rmtree(final)
+                workdir.rename(final)
+        finally:
+            for workdir, _ in staged:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+        outputs = ", ".join(str(o) for o in pending)
+        echo(f"File decryption successful: {outputs}")
+
+
+class BatchDecryptError(ShelfError):
+    """Raised if files of a batch failed, even when retried one by one"""
+
+    def __init__(self, errors: t.Dict[pathlib.Path, BaseException]) -> None:
+        self.errors = errors
+        failed = ", ".join(
+            f"{file.name} ({error})" for file, error in errors.items()
+        )
+        super().__init__(f"{len(errors)} files failed: {failed}")
+
+
+class BatchDecrypter:
+    """Decrypt several (small) files with two ffmpeg processes in total
+
+    One process extracts the ffmetadata of every input that needs it, a
+    second one remuxes all inputs, each with its own credentials, metadata
+    and output. For short titles that is most of the work saved.
+
+    Files failing their own preparation (e.g. chapter mismatch) are left
+    out of the batch. If the batch process fails, its outputs are removed
+    and every file is retried on its own, so errors end up with the file
+    that caused them.
+    """
+
+    def __init__(
+        self,
+        decrypters: t.List[FfmpegFileDecrypter],
+        priority: t.Optional[Priority] = None
+    ) -> None:
+        self._decrypters = decrypters
+        self._priority = priority or Priority()
+
+    @property
+    def decrypters(self) -> t.List[FfmpegFileDecrypter]:
+        return self._decrypters
+
+    def _base_cmd(self, overwrite: bool = False) -> t.List[str]:
+        base_cmd = [
+            "ffmpeg",
+            "-v",
+            "info",
+            "-stats",
+        ]
+        if overwrite:
+            base_cmd.append("-y")
+        return base_cmd
+
+    def _extract_ffmeta(self, decrypters: t.List[FfmpegFileDecrypter]):
+        if not decrypters:
+            return
+        base_cmd = self._base_cmd()
+        for decrypter in decrypters:
+            base_cmd.extend(decrypter.credentials_cmd())
+            base_cmd.extend(["-i", str(decrypter.source)])
+        for index, decrypter in enumerate(decrypters):
+            base_cmd.extend(decrypter.ffmeta_output_args(index))
+
+        subprocess.check_output(  # noqa: S603
+            self._priority.wrap(base_cmd), text=True
+        )
+        for decrypter in decrypters:
+            decrypter.load_ffmeta()
+
+    def _remux(
+        self,
+        decrypters: t.List[t.Tuple[FfmpegFileDecrypter, t.Optional[str]]]
+    ):
+        base_cmd = self._base_cmd(overwrite=True)
+        for decrypter, _ in decrypters:
+            base_cmd.extend(decrypter.credentials_cmd())
+            base_cmd.extend(["-i", str(decrypter.source)])
+
+        # rebuilt chapter files are extra inputs after all the sources
+        meta_indexes = []
+        next_index = len(decrypters)
+        for decrypter, metafile in decrypters:
+            if metafile is None:
+                meta_indexes.append(None)
+            else:
+                meta_indexes.append(next_index)
+                next_index += 1
+                base_cmd.extend(["-i", str(metafile)])
+
+        for index, (decrypter, _) in enumerate(decrypters):
+            base_cmd.extend(decrypter.output_args(
+                index, meta_indexes[index], explicit_map=True
+            ))
+
+        subprocess.check_output(  # noqa: S603
+            self._priority.wrap(base_cmd), text=True
+        )
+
+    def run(self) -> None:
+        todo = [d for d in self._decrypters if d.check_outfile()]
+        if not todo:
+            return
+        existed = {d.source for d in todo if d.outfile.exists()}
+
+        errors: t.Dict[pathlib.Path, BaseException] = {}
+        try:
+            self._extract_ffmeta([d for d in todo if d.needs_ffmeta()])
+            prepared = []
+            for decrypter in todo:
+                try:
+                    prepared.append((decrypter, decrypter.prepare_metadata()))
+                except (ChapterError, ShelfError) as exc:
+                    errors[decrypter.source] = exc
+            if prepared:
+                self._remux(prepared)
+        except subprocess.CalledProcessError as exc:
+            secho(
+                f"Batch of {len(todo)} files failed ({exc}), "
+                "retrying one by one",
+                fg="yellow"
+            )
+            errors = {}
+            for decrypter in todo:
+                # partial outputs of the batch, not the ones we overwrite
+                if decrypter.source not in existed:
+                    decrypter.outfile.unlink(missing_ok=True)
+            for decrypter in todo:
+                try:
+                    decrypter.run()
+                except Exception as exc:  # noqa: B902
+                    errors[decrypter.source] = exc
+        else:
+            for decrypter, _ in prepared:
+                echo(f"File decryption successful: {decrypter.outfile}")
+
+        for file, error in errors.items():
+            secho(f"Decrypt of {file} failed: {error}", fg="red")
+        if errors:
+            raise BatchDecryptError(errors)
+
+
+def run_decrypt_jobs(
+    decrypters: t.Iterable[FfmpegFileDecrypter],
+    executor: t.Optional[Executor] = None
+) -> t.List[t.Tuple[FfmpegFileDecrypter, t.Optional[BaseException]]]:
+    """Run decrypt jobs, serially or on EXECUTOR
+
+    Jobs on an executor don't stop each other on failure; the result
+    pairs every decrypter with the exception it raised, if any. Serial
+    runs raise the first error, same as the `decrypt` command always did.
+    """
+    if executor is None:
+        results = []
+        for decrypter in decrypters:
+            decrypter.run()
+            results.append((decrypter, None))
+        return results
+
+    futures = [
+        (decrypter, executor.submit(decrypter.run))
+        for decrypter in decrypters
+    ]
+    return [(decrypter, future.exception()) for decrypter, future in futures]
@@ -0,0 +1,319 @@
+import concurrent.futures
+import json
+import os
+import pathlib
+import re
+import string
+import threading
+import time
+import typing as t
+import unicodedata
+
+import httpx
+from click import echo, secho
+
+from .exceptions import DownloadError
+from .files import EncryptedFiles, MediaFiles
+
+if t.TYPE_CHECKING:
+    from .layout import Layout
+
+# best first, as in old/getlib.py
+PREFERRED_CODECS = (
+    "LC_128_44100_stereo",
+    "LC_64_44100_stereo",
+    "LC_64_22050_stereo",
+    "LC_32_22050_stereo",
+)
+
+SEGMENTS = 4
+# files smaller than two of these are fetched in one piece
+MIN_SEGMENT = 16 * 1024 ** 2
+CHUNK_SIZE = 256 * 1024
+# progress is saved at least this often per segment
+SAVE_EVERY = 8 * 1024 ** 2
+RETRIES = 3
+
+_ASIN = re.compile(r"\A([A-Z0-9]{10})_")
+_CONTENT_RANGE = re.compile(r"\Abytes 0-0/([0-9]+)\Z")
+_TITLE_CHARS = frozenset("-_.() " + string.ascii_letters + string.digits)
+
+
+def codec_kbps(codec: str) -> int:
+    """Bit rate of an enhanced codec name, 64 for `LC_64_22050_stereo`"""
+    return int(codec.split("_")[1])
+
+
+def choose_codec(
+    available: t.Iterable[str],
+    max_kbps: t.Optional[int] = None
+) -> t.Optional[str]:
+    """First codec of PREFERRED_CODECS in AVAILABLE and within MAX_KBPS"""
+    available = set(available)
+    for codec in PREFERRED_CODECS:
+        if codec in available and (
+            max_kbps is None or codec_kbps(codec) <= max_kbps
+        ):
+            return codec
+    return None
+
+
+def aax_filename(asin: str, title: str, codec_name: str) -> str:
+    """What `audible download --filename-mode asin_ascii` names the AAX
+
+    CODEC_NAME is the library's name for the codec, e.g. `aax_44_128`.
+    Covers and chapter files downloaded by audible-cli match this name.
+    """
+    slug = unicodedata.normalize("NFKD", title or "") \
+        .encode("ascii", "ignore").decode().replace(" ", "_")
+    slug = "".join(c for c in slug if c in _TITLE_CHARS)
+    if len(slug) < 2:
+        slug = asin
+    return f"{asin}_{slug}-{codec_name.upper()}.aax"
+
+
+def local_asins(
+    assets_dir: pathlib.Path,
+    layout: "Layout",
+    dl_dir: t.Optional[pathlib.Path] = None
+) -> t.Set[str]:
+    """ASINs decrypted below ASSETS_DIR or completely downloaded to DL_DIR
+
+    Only lists folders, no file is opened or stat'ed.
+    """
+    asins = set()
+
+    def add(folder: pathlib.Path, is_wanted) -> None:
+        try:
+            entries = os.scandir(folder)
+        except FileNotFoundError:
+            return
+        with entries:
+            for entry in entries:
+                match = _ASIN.match(entry.name)
+                if match and is_wanted(entry.name):
+                    asins.add(match.group(1))
+
+    media = tuple(MediaFiles.get_supported_list())
+    for folder in layout.directories(assets_dir):
+        add(folder, lambda name: name.endswith(media))
+    if dl_dir is not None:
+        # partial downloads are hidden, see `SegmentedDownload`
+        encrypted = tuple(EncryptedFiles.get_supported_list())
+        add(dl_dir, lambda name: name.endswith(encrypted))
+    return asins
+
+
+class RateLimiter:
+    """Caps the bytes per second of all downloads sharing it"""
+
+    def __init__(self, rate: float) -> None:
+        self._rate = rate
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def take(self, size: int) -> None:
+        """Wait until SIZE more bytes fit into the rate"""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + size / self._rate
+        if start > now:
+            time.sleep(start - now)
+
+
+class _Changed(Exception):
+    """The file behind the URL is not the one the partial download has"""
+
+
+class SegmentedDownload:
+    """Download URL to TARGET, in parallel byte ranges and resumable
+
+    Bytes go into `.<name>.part` next to TARGET, progress into
+    `.<name>.part.json`; a later run, even with a fresh signed URL for the
+    same file, only fetches the missing ranges. A changed size or ETag
+    starts over. Servers without range support get one plain stream.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        target: pathlib.Path,
+        client: httpx.Client,
+        segments: int = SEGMENTS,
+        min_segment: int = MIN_SEGMENT,
+        limiter: t.Optional[RateLimiter] = None
+    ) -> None:
+        self.url = url
+        self.target = target
+        self._client = client
+        self._segments = segments
+        self._min_segment = min_segment
+        self._limiter = limiter
+        self.part = target.with_name(f".{target.name}.part")
+        self.state_file = target.with_name(f".{target.name}.part.json")
+        self._lock = threading.Lock()
+        self._state: t.Dict[str, t.Any] = {}
+
+    def run(self) -> pathlib.Path:
+        size, validator = self._probe()
+        if size is None:
+            self._stream()
+        else:
+            try:
+                self._fetch_ranges(size, validator)
+            except _Changed:
+                secho(f"{self.target.name} changed, starting over",
+                      fg="yellow")
+                self.state_file.unlink(missing_ok=True)
+                self._fetch_ranges(size, validator)
+        os.replace(self.part, self.target)
+        self.state_file.unlink(missing_ok=True)
+        return self.target
+
+    def _probe(self) -> t.Tuple[t.Optional[int], t.Optional[str]]:
+        """Size and validator of the file, size None without ranges"""
+        headers = {"Range": "bytes=0-0"}
+        with self._client.stream("GET", self.url, headers=headers) as r:
+            _raise_for_status(r, self.target)
+            match = _CONTENT_RANGE.match(r.headers.get("Content-Range", ""))
+            if r.status_code != 206 or not match:
+                return None, None
+            validator = r.headers.get("ETag")
+            if validator is None or validator.startswith("W/"):
+                validator = r.headers.get("Last-Modified")
+            return int(match.group(1)), validator
+
+    def _load_state(self, size: int, validator: t.Optional[str]) -> bool:
+        try:
+            state = json.loads(self.state_file.read_text())
+        except (FileNotFoundError, ValueError):
+            return False
+        if state.get("size") != size \
+                or state.get("validator") != validator \
+                or not self.part.exists():
+            return False
+        self._state = state
+        return True
+
+    def _save_state(self) -> None:
+        with self._lock:
+            data = json.dumps(self._state)
+        tmpfile = self.state_file.with_name(f"{self.state_file.name}.tmp")
+        tmpfile.write_text(data)
+        os.replace(tmpfile, self.state_file)
+
+    def _fetch_ranges(self, size: int, validator: t.Optional[str]) -> None:
+        if self._load_state(size, validator):
+            done = sum(s[2] for s in self._state["segments"])
+            echo(f"Resume {self.target.name} at {done}/{size} bytes")
+        else:
+            count = max(1, min(self._segments, size // self._min_segment))
+            bounds = [size * i // count for i in range(count + 1)]
+            self._state = {
+                "size": size,
+                "validator": validator,
+                # [start, end (exclusive), bytes done]
+                "segments": [
+                    [bounds[i], bounds[i + 1], 0] for i in range(count)
+                ],
+            }
+            with open(self.part, "wb") as f:
+                f.truncate(size)
+            self._save_state()
+
+        todo = [s for s in self._state["segments"] if s[0] + s[2] < s[1]]
+        fd = os.open(self.part, os.O_WRONLY)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(1, len(todo)),
+                thread_name_prefix="segment"
+            ) as executor:
+                futures = [
+                    executor.submit(self._fetch_segment, fd, segment)
+                    for segment in todo
+                ]
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+        finally:
+            os.close(fd)
+            self._save_state()
+
+    def _fetch_segment(self, fd: int, segment: t.List[int]) -> None:
+        for attempt in range(RETRIES):
+            try:
+                self._fetch_range(fd, segment)
+                return
+            except httpx.TransportError as exc:
+                if attempt == RETRIES - 1:
+                    raise DownloadError(
+                        f"{self.target.name}: {exc}"
+                    ) from exc
+                secho(f"{self.target.name}: {exc}, retrying", fg="yellow")
+
+    def _fetch_range(self, fd: int, segment: t.List[int]) -> None:
+        start, end, _ = segment
+        headers = {"Range": f"bytes={start + segment[2]}-{end - 1}"}
+        validator = self._state["validator"]
+        if validator is not None:
+            headers["If-Range"] = validator
+        with self._client.stream("GET", self.url, headers=headers) as r:
+            if r.status_code == 200:
+                raise _Changed()
+            _raise_for_status(r, self.target)
+            unsaved = 0
+            for chunk in r.iter_bytes(CHUNK_SIZE):
+                chunk = chunk[:end - start - segment[2]]
+                if self._limiter is not None:
+                    self._limiter.take(len(chunk))
+                os.pwrite(fd, chunk, start + segment[2])
+                with self._lock:
+                    segment[2] += len(chunk)
+                unsaved += len(chunk)
+                if unsaved >= SAVE_EVERY:
+                    self._save_state()
+                    unsaved = 0
+        if start + segment[2] < end:
+            raise httpx.ReadError(
+                f"range ended at byte {start + segment[2]} of {end}"
+            )
+
+    def _stream(self) -> None:
+        self.state_file.unlink(missing_ok=True)
+        with self._client.stream("GET", self.url) as r, \
+                open(self.part, "wb") as f:
+            _raise_for_status(r, self.target)
+            for chunk in r.iter_bytes(CHUNK_SIZE):
+                if self._limiter is not None:
+                    self._limiter.take(len(chunk))
+                f.write(chunk)
+
+
+def _raise_for_status(response: httpx.Response, target: pathlib.Path):
+    if response.status_code >= 400:
+        raise DownloadError(
+            f"{target.name}: HTTP {response.status_code} from "
+            f"{response.url.host}"
+        )
+
+
+async def get_aax_url(client, asin: str, codec: str) -> str:
+    """Signed download link for ASIN's AAX in the enhanced CODEC"""
+    url = (
+        "https://cde-ta-g7g.amazon.com/FionaCDEServiceEngine/"
+        "FSDownloadContent"
+    )
+    params = {
+        "type": "AUDI",
+        "currentTransportMethod": "WIFI",
+        "key": asin,
+        "codec": codec,
+    }
+    r = await client.session.head(
+        url, auth=client.auth, params=params, follow_redirects=False
+    )
+    link = r.headers.get("Location")
+    if link is None:
+        raise DownloadError(f"{asin}: no download link for {codec}")
+    domain = client.auth.locale.domain
+    return link.replace("cds.audible.com", f"cds.audible.{domain}")
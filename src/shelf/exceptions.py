@@ -0,0 +1,31 @@
+class ShelfError(Exception):
+    """Base class for all shelf errors."""
+
+
+class ChapterError(ShelfError):
+    """Base class for all chapter errors."""
+
+
+class FileNotSupported(ShelfError):
+    """Raised if an input file does not exist or has an unsupported type"""
+
+
+class InvalidUrl(ShelfError):
+    """Raised if a feed, website, image or prefix URL is not usable"""
+
+    def __init__(self, name, url, message):
+        self.name = name
+        self.url = url
+        super().__init__(message)
+
+
+class PublishError(ShelfError):
+    """Raised if the object storage rejects a publish request"""
+
+
+class DownloadError(ShelfError):
+    """Raised if a book cannot be downloaded"""
+
+
+class LeaseHeld(ShelfError):
+    """Raised if another node holds the lease on a piece of work"""
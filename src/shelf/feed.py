@@ -0,0 +1,519 @@
+import hashlib
+import json
+import os
+import pathlib
+import re
+import typing as t
+import warnings
+from datetime import timedelta
+
+from click import echo
+
+from .chapters import get_chapters_file
+from .exceptions import InvalidUrl
+from .layout import Layout
+from .probe import ProbeCache, ffprobe
+from .streaming import HLS_MIME_TYPE, HLS_PLAYLIST, get_hls_dir, hls_size
+
+if t.TYPE_CHECKING:
+    import podgen
+
+    from .fragments import FragmentCache
+
+# podgen (and lxml through it), dateutil and rfc3986 are imported inside
+# the functions that need them. Every `audible` invocation imports the
+# plugins and through them this module, so keeping them out of module scope
+# keeps `audible --help`, `audible decrypt` etc. from paying for them.
+
+# podgen writes the render time into every feed, it is not a change
+_BUILD_DATE = rb"<lastBuildDate>[^<]*</lastBuildDate>"
+
+# part of every episode fingerprint, bump when items render differently
+FRAGMENT_VERSION = 1
+# stale items from which on they are rendered in a process pool; an item
+# takes ~0.15ms, starting the pool ~20ms
+PARALLEL_FRAGMENTS = 256
+
+
+def get_feed_url(
+    feed_url,
+    url_prefix: str,
+    outfile: str
+) -> str:
+    if feed_url:
+        return feed_url
+    outfile_base = pathlib.Path(outfile).name
+    return f"{url_prefix}{outfile_base}"
+
+
+def get_website(
+    website,
+    url_prefix: str
+) -> str:
+    from rfc3986 import is_valid_uri
+
+    website = website if website else url_prefix
+    if not is_valid_uri(
+            website,
+            require_scheme=True,
+            require_authority=True,
+            require_path=True
+            ):
+        raise InvalidUrl(
+                "website",
+                website,
+                f"homepage {website} is invalid - needs to be an URL"
+        )
+    return website
+
+
+def get_image(
+    image: str,
+    url_prefix: str
+) -> str:
+    from rfc3986 import is_valid_uri
+
+    if is_valid_uri(
+            image,
+            require_scheme=True,
+            require_authority=True,
+            require_path=True
+            ):
+        return image
+
+    return f"{url_prefix}{image}"
+
+
+def get_url_prefix(
+    prefix: str
+) -> str:
+    from rfc3986 import is_valid_uri, normalize_uri
+
+    if not is_valid_uri(prefix, require_path=True) \
+            and is_valid_uri(prefix):
+        prefix += "/"
+
+    if not is_valid_uri(
+            prefix,
+            require_scheme=True,
+            require_authority=True,
+            require_path=True
+            ):
+        raise InvalidUrl(
+                "url_prefix",
+                prefix,
+                f"url prefix {prefix} is invalid - needs to be an URL"
+        )
+
+    return normalize_uri(prefix)
+
+
+class EpisodeCreator:
+    def __init__(
+        self,
+        file: pathlib.Path,
+        url_prefix: str,
+        overwrite: bool = False,
+        make_public: bool = False,
+        probe_cache: t.Optional[ProbeCache] = None,
+        media_prefix: t.Optional[str] = None,
+        hls: bool = False,
+        layout: t.Optional[Layout] = None
+    ):
+        self._source = file
+        self._ctime = None
+        self._img_file = None
+        self._url_prefix = url_prefix
+        # variants live in subfolders, their covers do not
+        self._media_prefix = media_prefix or url_prefix
+        self._hls = hls
+        self._layout = layout or Layout()
+        self._overwrite = overwrite
+        self._make_public = make_public
+        self._probe_cache = probe_cache
+        self._asin = None
+        self._library_info = None
+        self._podgen_episode = None
+        self._do_probe()
+        self._create_item()
+
+    @property
+    def asin(self) -> str:
+        if (not self._asin):
+            try:
+                self._asin = self._tags['episode_id']
+            except KeyError:
+                file_name = pathlib.Path(self._source).name
+                match = re.search(r'\A([A-Z0-9]{10})_', file_name)
+                if (not match):
+                    raise RuntimeError("Unable to determine ASIN")
+                self._asin = match.group(1)
+
+        return self._asin
+
+    @property
+    def title(self) -> str:
+        return self._tags['title']
+
+    @property
+    def source(self) -> str:
+        return self._source
+
+    @property
+    def item(self) -> t.Dict[str, t.Any]:
+        """What the episode's feed item is made of, see `build_episode`"""
+        return self._item
+
+    @property
+    def publication_date(self):
+        return self._item["publication_date"]
+
+    @property
+    def podgen_episode(self) -> "podgen.Episode":
+        if self._podgen_episode is None:
+            self._podgen_episode = build_episode(self._item)
+        return self._podgen_episode
+
+    def fingerprint(self) -> str:
+        """SHA-256 of the item, the key of its rendered feed fragment"""
+        data = json.dumps(
+            [FRAGMENT_VERSION, self._item], sort_keys=True, default=str
+        )
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    @property
+    def ctime(self):
+        if (not self._ctime):
+            stat = pathlib.Path(self._source).stat()
+            try:
+                self._ctime = stat.st_birthtime
+            except AttributeError:
+                self._ctime = stat.st_ctime
+        return self._ctime
+
+    @property
+    def library_info(self):
+        return self._library_info
+
+    @library_info.setter
+    def library_info(self, var):
+        self._library_info = var
+
+    @property
+    def img_file(self):
+        if (not self._img_file):
+            self._img_file = f"{pathlib.Path(self.source).stem}.jpg"
+        return self._img_file
+
+    def _do_probe(self):
+        if self._probe_cache is not None:
+            self._probe = self._probe_cache.probe(self._source)
+        else:
+            self._probe = ffprobe(self._source)
+        self._tags = self._probe["tags"]
+
+    def chapters_url(self) -> t.Optional[str]:
+        """URL of the chapters sidecar `decrypt` wrote, if there is one
+
+        Variants share the sidecar of the full file in the folder above.
+        """
+        source = pathlib.Path(self._source)
+        media_dir = self._layout.root(source)
+        candidates = [(media_dir, self._media_prefix)]
+        if self._media_prefix != self._url_prefix:
+            candidates.append((media_dir.parent, self._url_prefix))
+        for root, prefix in candidates:
+            directory = self._layout.directory(root, source)
+            sidecar = get_chapters_file(source, directory)
+            if sidecar.exists():
+                return f"{prefix}{self._layout.url_path(sidecar)}"
+        return None
+
+    def _create_item(self) -> None:
+        from dateutil.parser import isoparse
+
+        layout = self._layout
+        file_name = pathlib.Path(self._source).name
+        url = f"{self._media_prefix}{layout.url_path(file_name)}"
+        size = self._probe["size"]
+        media_type = None
+        if self._hls:
+            source = pathlib.Path(self._source)
+            hls_dir = get_hls_dir(source, source.parent)
+            if hls_dir.is_dir():
+                url = f"{self._media_prefix}{layout.url_path(hls_dir)}/" \
+                    f"{HLS_PLAYLIST}"
+                size = hls_size(hls_dir)
+                media_type = HLS_MIME_TYPE
+            else:
+                echo(f"no HLS package for {file_name}, using the file")
+
+        self._item = {
+            "id": self.asin,
+            "title": self._tags["title"],
+            "summary": self._tags["comment"],
+            "publication_date": isoparse(self._tags["creation_time"]),
+            "authors": [self._tags["artist"]],
+            "image": f"{self._url_prefix}{layout.url_path(self.img_file)}",
+            "withhold_from_itunes": not self._make_public,
+            "chapters_url": self.chapters_url(),
+            "media": {
+                "url": url,
+                "size": size,
+                "type": media_type,
+                "duration": float(self._probe["duration"]),
+            },
+        }
+
+    def apply_library_info(
+        self,
+        library_info: t.Dict[str, t.Any],
+        use_library_api: bool,
+        sort_by_purchase_date: bool
+    ) -> None:
+        self.library_info = library_info
+        if sort_by_purchase_date:
+            self._item["publication_date"] = library_info['date_added']
+        if use_library_api:
+            self._item["title"] = library_info['title']
+            self._item["authors"] = [
+                f"Written by {library_info['authors']}",
+                f"Narrated by {library_info['narrators']}",
+            ]
+        self._podgen_episode = None
+
+
+def build_episode(item: t.Dict[str, t.Any]) -> "podgen.Episode":
+    """The podgen episode of ITEM, an `EpisodeCreator.item`"""
+    import podgen
+
+    from .podgen_ext import Episode
+
+    episode = Episode(
+        id=item["id"],
+        title=item["title"],
+        summary=item["summary"],
+        publication_date=item["publication_date"],
+        authors=[podgen.Person(name) for name in item["authors"]],
+        image=item["image"],
+        withhold_from_itunes=item["withhold_from_itunes"]
+    )
+    episode.chapters_url = item["chapters_url"]
+
+    media = item["media"]
+    with warnings.catch_warnings():
+        # iTunes does not list HLS playlists as an enclosure type
+        warnings.simplefilter("ignore", podgen.NotSupportedByItunesWarning)
+        episode.media = podgen.Media(
+            url=media["url"],
+            size=media["size"],
+            type=media["type"],
+            duration=timedelta(seconds=media["duration"])
+        )
+    return episode
+
+
+def render_item(item: t.Dict[str, t.Any], nsmap: dict) -> bytes:
+    """The `<item>` fragment of ITEM in a feed with the namespaces NSMAP"""
+    from .podgen_ext import item_fragment
+
+    return item_fragment(build_episode(item), nsmap)
+
+
+def create_episodes(
+    files: t.Iterable[pathlib.Path],
+    url_prefix: str,
+    make_public: bool,
+    probe_cache: t.Optional[ProbeCache] = None,
+    media_prefix: t.Optional[str] = None,
+    hls: bool = False,
+    layout: t.Optional[Layout] = None
+) -> t.List[EpisodeCreator]:
+    episodes = []
+    for file in files:
+        ep = EpisodeCreator(
+            file=file,
+            url_prefix=url_prefix,
+            make_public=make_public,
+            probe_cache=probe_cache,
+            media_prefix=media_prefix,
+            hls=hls,
+            layout=layout
+        )
+        echo(f"adding {ep.asin} => {ep.title}")
+        episodes.append(ep)
+    return episodes
+
+
+def apply_library_info(
+    episodes: t.Iterable[EpisodeCreator],
+    books: t.Dict[str, t.Dict[str, t.Any]],
+    use_library_api: bool,
+    sort_by_purchase_date: bool
+) -> None:
+    for ep in episodes:
+        ep.apply_library_info(
+            books[ep.asin],
+            use_library_api=use_library_api,
+            sort_by_purchase_date=sort_by_purchase_date
+        )
+
+
+def sort_episodes(
+    episodes: t.List[EpisodeCreator],
+    sort_by_purchase_date: bool
+) -> None:
+    if sort_by_purchase_date:
+        episodes.sort(key=(lambda x: x.library_info['date_added']))
+    else:
+        episodes.sort(key=(lambda x: x.ctime))
+
+
+class FeedOptions:
+    """Channel-level settings of a feed, as given to `audible rss`
+
+    `url_prefix`, `website`, `image` and `feed_url` are resolved the same
+    way the command line options are. With `library_page`, a static HTML
+    page of the library and its search index are written next to the feed,
+    see `catalog.write_library`. `hub_url` is the WebSub hub the feed
+    advertises, see `websub.ping_hub`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        desc: str,
+        url_prefix: str,
+        image: str,
+        outfile: t.Union[pathlib.Path, str],
+        website: t.Optional[str] = None,
+        feed_url: t.Optional[str] = None,
+        explicit: bool = True,
+        make_public: bool = False,
+        category: str = "Arts",
+        subcategory: str = "Books",
+        library_page: bool = False,
+        hub_url: t.Optional[str] = None
+    ) -> None:
+        self.name = name
+        self.desc = desc
+        self.url_prefix = get_url_prefix(prefix=url_prefix)
+        self.website = get_website(website=website, url_prefix=self.url_prefix)
+        self.image = get_image(image=image, url_prefix=self.url_prefix)
+        self.outfile = outfile
+        self.feed_url = get_feed_url(
+            feed_url=feed_url,
+            url_prefix=self.url_prefix,
+            outfile=outfile
+        )
+        self.explicit = explicit
+        self.make_public = make_public
+        self.category = category
+        self.subcategory = subcategory
+        self.library_page = library_page
+        self.hub_url = hub_url
+
+
+def create_podcast(options: FeedOptions) -> "podgen.Podcast":
+    import podgen
+
+    from .podgen_ext import Podcast
+
+    return Podcast(
+        name=options.name,
+        description=options.desc,
+        website=options.website,
+        explicit=options.explicit,
+        withhold_from_itunes=(not options.make_public),
+        image=options.image,
+        feed_url=options.feed_url,
+        generator=None,
+        category=podgen.Category(options.category, options.subcategory),
+        pubsubhubbub=options.hub_url
+    )
+
+
+def feed_digest(data: bytes) -> str:
+    """SHA-256 of a rendered feed, without its lastBuildDate"""
+    return hashlib.sha256(re.sub(_BUILD_DATE, b"", data)).hexdigest()
+
+
+def _render_fragments(
+    episodes: t.List[EpisodeCreator],
+    cache: "FragmentCache",
+    nsmap: dict
+) -> t.List[bytes]:
+    fingerprints = [ep.fingerprint() for ep in episodes]
+    fragments = {fp: cache.get(fp) for fp in fingerprints}
+    stale = {
+        fp: ep.item
+        for fp, ep in zip(fingerprints, episodes)
+        if fragments[fp] is None
+    }
+    workers = os.cpu_count() or 1
+    if workers > 1 and len(stale) >= PARALLEL_FRAGMENTS:
+        # multiprocessing is slow to import, keep it out of plugin startup
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rendered = list(pool.map(
+                render_item,
+                stale.values(),
+                [nsmap] * len(stale),
+                chunksize=max(1, len(stale) // (4 * workers))
+            ))
+    else:
+        rendered = [render_item(item, nsmap) for item in stale.values()]
+    for fp, data in zip(stale, rendered):
+        cache.put(fp, data)
+        fragments[fp] = data
+    cache.prune(fragments)
+    if stale:
+        echo(f"rendered {len(stale)} of {len(fingerprints)} feed items")
+    return [fragments[fp] for fp in fingerprints]
+
+
+def render_feed(
+    options: FeedOptions,
+    episodes: t.Iterable[EpisodeCreator]
+) -> bool:
+    """Write the feed for (already sorted) EPISODES to `options.outfile`
+
+    Every `<item>` is rendered on its own and kept in a `FragmentCache`
+    next to the feed, keyed by `EpisodeCreator.fingerprint`; only new or
+    changed episodes are rendered, in a process pool when there are many.
+    The feed is the channel with those fragments pasted in, byte for byte
+    what podgen writes for the whole feed.
+
+    The feed is replaced atomically, clients never see a partial file. A
+    feed whose content (see `feed_digest`) did not change is left alone,
+    mtime included, so conditional requests and `publish` skip it.
+    Returns whether the feed changed.
+    """
+    from .fragments import FragmentCache, get_fragment_dir
+
+    episodes = list(episodes)
+    cast = create_podcast(options)
+    if episodes:
+        # what podgen takes for the channel's pubDate from its episodes
+        cast.publication_date = max(ep.publication_date for ep in episodes)
+    channel = cast.rss_str().encode("UTF-8")
+    split = channel.rindex(b"  </channel>")
+
+    outfile = pathlib.Path(options.outfile)
+    fragments = _render_fragments(
+        episodes,
+        FragmentCache(get_fragment_dir(outfile)),
+        cast._nsmap
+    )
+    data = b"".join([channel[:split], *fragments, channel[split:]])
+    try:
+        unchanged = feed_digest(outfile.read_bytes()) == feed_digest(data)
+    except FileNotFoundError:
+        unchanged = False
+    if unchanged:
+        return False
+    tmpfile = outfile.with_name(f".{outfile.name}.tmp")
+    tmpfile.write_bytes(data)
+    os.replace(tmpfile, outfile)
+    return True
@@ -0,0 +1,72 @@
+import pathlib
+import typing as t
+from enum import Enum
+
+from .exceptions import FileNotSupported
+
+
+class _SupportedFiles(Enum):
+    @classmethod
+    def get_supported_list(cls):
+        return list(set(item.value for item in cls))
+
+    @classmethod
+    def is_supported_suffix(cls, value):
+        return value in cls.get_supported_list()
+
+    @classmethod
+    def is_supported_file(cls, value):
+        return pathlib.PurePath(value).suffix in cls.get_supported_list()
+
+    @classmethod
+    def get_all_patterns(cls):
+        return [f"*{suffix}" for suffix in cls.get_supported_list()]
+
+
+class EncryptedFiles(_SupportedFiles):
+    """Downloads `audible decrypt` knows how to handle"""
+    AAX = ".aax"
+    AAXC = ".aaxc"
+
+
+class MediaFiles(_SupportedFiles):
+    """Decrypted media `audible rss` turns into episodes"""
+    M4B = ".m4a"
+    MP3 = ".mp3"
+    MP4 = ".mp4"
+
+
+def find_files(
+    files: t.Union[t.Tuple[str], t.List[str]],
+    supported: t.Type[_SupportedFiles],
+    recursive: bool = True
+) -> t.List[pathlib.Path]:
+    """Expand FILES (names or globs) to resolved paths of `supported` type
+
+    Unsupported files matched by a glob are skipped silently.
+    """
+    from glob import glob
+
+    filenames = []
+    for filename in files:
+        # if the shell does not do filename globbing
+        expanded = list(glob(filename, recursive=recursive))
+
+        if (
+            len(expanded) == 0
+            and '*' not in filename
+            and not supported.is_supported_file(filename)
+        ):
+            raise FileNotSupported(
+                f"{filename}: file not found or supported."
+            )
+
+        expanded_filter = filter(
+            lambda x: supported.is_supported_file(x), expanded
+        )
+        expanded = list(
+            map(lambda x: pathlib.Path(x).resolve(), expanded_filter)
+        )
+        filenames.extend(expanded)
+
+    return filenames
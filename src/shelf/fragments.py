@@ -0,0 +1,56 @@
+import os
+import pathlib
+import typing as t
+import uuid
+
+
+def get_fragment_dir(outfile: t.Union[pathlib.Path, str]) -> pathlib.Path:
+    """Folder of the item fragments of the feed OUTFILE
+
+    Hidden, next to the feed, so `publish` skips it.
+    """
+    outfile = pathlib.Path(outfile)
+    return outfile.with_name(f".{outfile.name}.items")
+
+
+class FragmentCache:
+    """Rendered feed `<item>`s, one file per episode fingerprint
+
+    An episode whose fingerprint (see `EpisodeCreator.fingerprint`) has a
+    fragment here is not rendered again; the feed is its channel with the
+    fragments of its episodes pasted in. Fragments no feed item uses
+    anymore are removed with `prune`.
+    """
+
+    def __init__(self, directory: t.Union[pathlib.Path, str]) -> None:
+        self.directory = pathlib.Path(directory)
+
+    def path(self, fingerprint: str) -> pathlib.Path:
+        return self.directory / f"{fingerprint}.xml"
+
+    def get(self, fingerprint: str) -> t.Optional[bytes]:
+        try:
+            return self.path(fingerprint).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def put(self, fingerprint: str, data: bytes) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.path(fingerprint)
+        tmpfile = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        tmpfile.write_bytes(data)
+        os.replace(tmpfile, path)
+
+    def prune(self, keep: t.Collection[str]) -> int:
+        """Remove the fragments not in KEEP, return how many"""
+        removed = 0
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return 0
+        for entry in entries:
+            name, _, suffix = entry.name.partition(".")
+            if suffix == "xml" and name not in keep:
+                os.unlink(entry.path)
+                removed += 1
+        return removed
@@ -0,0 +1,197 @@
+import os
+import pathlib
+import re
+import typing as t
+import zlib
+
+from click import echo, secho
+
+from .chapters import CHAPTERS_SUFFIX
+from .exceptions import ShelfError
+from .files import EncryptedFiles, MediaFiles
+
+LAYOUTS = ("flat", "hash")
+
+# patterns, not compiled: `re` compiles and caches them on first use, and
+# this module is imported on every audible command
+_ASIN = r"\A([A-Z0-9]{10})_"
+_SHARD = r"\A[0-9a-f]{2}\Z"
+SHARD_PATTERN = "[0-9a-f][0-9a-f]"
+
+# what decrypt writes for a book, next to the media file
+_ASSET_SUFFIXES = (
+    CHAPTERS_SUFFIX,
+    ".hls",
+    ".jpg",
+    ".meta",
+    *MediaFiles.get_supported_list(),
+)
+_KEY_SUFFIXES = _ASSET_SUFFIXES + tuple(EncryptedFiles.get_supported_list())
+
+
+def asset_key(name: str) -> str:
+    """What all files of one book have in common: the ASIN in their name,
+    or the name without its suffix"""
+    match = re.match(_ASIN, name)
+    if match:
+        return match.group(1)
+    for suffix in _KEY_SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+class Layout:
+    """Where the files of a book go below an assets folder
+
+    `flat` puts everything into the folder itself. `hash` adds one level of
+    256 folders named after the low byte of the CRC-32 of the book's ASIN,
+    e.g. `assets/3f/B0..._Title-AAX_44_128.m4a`, so every folder stays a
+    few hundred entries long at tens of thousands of assets. (The first
+    ASIN characters are `B0` for nearly every title, no use as a shard.)
+    The shard depends on the file name only: URLs stay stable.
+    """
+
+    def __init__(self, scheme: str = "flat") -> None:
+        if scheme not in LAYOUTS:
+            raise ShelfError(
+                f"unknown layout {scheme}, use one of {', '.join(LAYOUTS)}"
+            )
+        self.scheme = scheme
+
+    @property
+    def sharded(self) -> bool:
+        return self.scheme != "flat"
+
+    def shard(self, file: t.Union[pathlib.PurePath, str]) -> str:
+        """Folder name for FILE below the assets folder, "" if flat"""
+        if not self.sharded:
+            return ""
+        key = asset_key(pathlib.PurePath(file).name)
+        return f"{zlib.crc32(key.encode()) & 0xff:02x}"
+
+    def directory(
+        self,
+        root: pathlib.Path,
+        file: t.Union[pathlib.PurePath, str],
+        create: bool = False
+    ) -> pathlib.Path:
+        """Folder below ROOT that holds FILE and the rest of its book"""
+        directory = root / self.shard(file)
+        if create:
+            directory.mkdir(parents=True, exist_ok=True)
+        return directory
+
+    def url_path(self, file: t.Union[pathlib.PurePath, str]) -> str:
+        """FILE's URL relative to the URL of the assets folder"""
+        name = pathlib.PurePath(file).name
+        shard = self.shard(name)
+        return f"{shard}/{name}" if shard else name
+
+    def root(self, file: pathlib.Path) -> pathlib.Path:
+        """The assets (or variant) folder FILE, already laid out, is in"""
+        if self.sharded and re.match(_SHARD, file.parent.name):
+            return file.parent.parent
+        return file.parent
+
+    def patterns(self, patterns: t.Iterable[str]) -> t.List[str]:
+        """Globs relative to the assets folder for the flat PATTERNS"""
+        if not self.sharded:
+            return list(patterns)
+        return [f"{SHARD_PATTERN}/{pattern}" for pattern in patterns]
+
+    def directories(
+        self,
+        root: pathlib.Path,
+        create: bool = False
+    ) -> t.List[pathlib.Path]:
+        """Every folder below ROOT assets can be in"""
+        if not self.sharded:
+            return [root]
+        directories = [root / f"{i:02x}" for i in range(256)]
+        if create:
+            for directory in directories:
+                directory.mkdir(exist_ok=True)
+        return directories
+
+    def migrate(self, root: pathlib.Path, dry_run: bool = False) -> int:
+        """Move the assets below ROOT, and its variant folders, here
+
+        Works from any layout: every file or folder of a book (one with a
+        media file or chapters folder) found at the top or in a shard folder
+        is moved to where this layout wants it, with one rename each. Other
+        files, like the feed or the podcast image, stay. Empty shard folders
+        are removed. Returns the number of entries moved.
+        """
+        moved = 0
+        folders = [root] + [
+            entry for entry in _scandir(root)
+            if entry.is_dir() and _is_variant(entry.name)
+        ]
+        for folder in folders:
+            entries = []
+            for entry in _scandir(folder):
+                if entry.is_dir() and re.match(_SHARD, entry.name):
+                    entries.extend(_scandir(entry))
+                else:
+                    entries.append(entry)
+
+            books = {
+                asset_key(entry.name) for entry in entries
+                if MediaFiles.is_supported_file(entry)
+                or _is_chapter_dir(entry)
+            }
+            for entry in entries:
+                if entry.name.startswith(".") \
+                        or asset_key(entry.name) not in books:
+                    continue
+                if not entry.name.endswith(_ASSET_SUFFIXES) \
+                        and not _is_chapter_dir(entry):
+                    continue
+                target = self.directory(folder, entry.name) / entry.name
+                if target == entry:
+                    continue
+                if target.exists():
+                    secho(f"Skip {entry}: {target} exists", fg="yellow")
+                    continue
+                echo(f"{entry} -> {target}")
+                if not dry_run:
+                    target.parent.mkdir(exist_ok=True)
+                    os.rename(entry, target)
+                moved += 1
+
+            if not dry_run:
+                for entry in _scandir(folder):
+                    if entry.is_dir() and re.match(_SHARD, entry.name):
+                        try:
+                            entry.rmdir()
+                        except OSError:
+                            pass
+        return moved
+
+    def __repr__(self) -> str:
+        return f"<Layout {self.scheme}>"
+
+
+def _scandir(folder: pathlib.Path) -> t.List[pathlib.Path]:
+    # scandir does not stat every entry, listing stays cheap when it is big
+    with os.scandir(folder) as entries:
+        return [pathlib.Path(entry.path) for entry in entries]
+
+
+def _is_variant(name: str) -> bool:
+    from .variants import Variant
+
+    try:
+        Variant.parse(name)
+    except ShelfError:
+        return False
+    return True
+
+
+def _is_chapter_dir(entry: pathlib.Path) -> bool:
+    """A book's chapters, written by `decrypt --split-chapters`"""
+    if not entry.is_dir() or entry.name.endswith(".hls") \
+            or _is_variant(entry.name):
+        return False
+    return any(MediaFiles.is_supported_file(c) for c in _scandir(entry))
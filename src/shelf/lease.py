@@ -0,0 +1,169 @@
+import os
+import pathlib
+import re
+import socket
+import threading
+import typing as t
+import uuid
+
+from click import secho
+
+from .exceptions import LeaseHeld
+
+# below the assets folder, which every node writes to anyway
+LEASE_DIR = ".shelf-leases"
+LEASE_TTL = 120.0
+
+_UNSAFE = r"[^A-Za-z0-9._()-]+"
+
+
+class LeaseDir:
+    """Claims on shared work, as files in a folder all nodes mount
+
+    A lease is a file created with O_EXCL, so exactly one node gets it. Its
+    holder touches it every TTL/4 seconds; a lease not touched for TTL
+    seconds belongs to a crashed node and is taken over. Age is measured
+    against the folder's own clock (the mtime of a file just written
+    there), so clock skew between nodes does not matter.
+    """
+
+    def __init__(
+        self,
+        directory: t.Union[pathlib.Path, str],
+        ttl: float = LEASE_TTL,
+        node: t.Optional[str] = None
+    ) -> None:
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.node = node or f"{socket.gethostname()}:{os.getpid()}"
+        self._held: t.Dict[str, t.Tuple[pathlib.Path, str]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat: t.Optional[threading.Thread] = None
+        node = re.sub(_UNSAFE, "_", self.node)
+        self._clock = self.directory / f".clock-{node}"
+
+    def path(self, key: str) -> pathlib.Path:
+        return self.directory / f"{re.sub(_UNSAFE, '_', key)}.lease"
+
+    def acquire(self, key: str) -> bool:
+        """Claim KEY, False if a live lease of another node has it"""
+        path = self.path(key)
+        token = f"{self.node} {uuid.uuid4().hex}"
+        for _ in range(3):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._reclaim(path):
+                    return False
+                continue
+            with os.fdopen(fd, "w") as f:
+                f.write(token)
+            with self._lock:
+                self._held[key] = (path, token)
+                if self._heartbeat is None:
+                    self._heartbeat = threading.Thread(
+                        target=self._beat,
+                        name="lease-heartbeat",
+                        daemon=True
+                    )
+                    self._heartbeat.start()
+            return True
+        return False
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            path, token = self._held.pop(key, (None, None))
+        if path is not None and _read(path) == token:
+            path.unlink(missing_ok=True)
+
+    def holder(self, key: str) -> t.Optional[str]:
+        """Node holding KEY, None if nobody does"""
+        token = _read(self.path(key))
+        return token.split(" ")[0] if token else None
+
+    def run(self, key: str, func: t.Callable[[], t.Any]) -> t.Any:
+        """Call FUNC holding KEY, raise `LeaseHeld` if another node has it"""
+        if not self.acquire(key):
+            raise LeaseHeld(f"{key}: held by {self.holder(key)}")
+        try:
+            return func()
+        finally:
+            self.release(key)
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+        for key in list(self._held):
+            self.release(key)
+        self._clock.unlink(missing_ok=True)
+        self._stop.clear()
+
+    def _now(self) -> float:
+        self._clock.write_bytes(b"")
+        return self._clock.stat().st_mtime
+
+    def _is_stale(self, path: pathlib.Path) -> bool:
+        return path.stat().st_mtime + self.ttl < self._now()
+
+    def _reclaim(self, path: pathlib.Path) -> bool:
+        """Remove PATH if its holder stopped renewing it, True if it is gone
+
+        The stale lease is renamed away first, which only one node can do.
+        If it was renewed in between, it is put back.
+        """
+        try:
+            if not self._is_stale(path):
+                return False
+        except FileNotFoundError:
+            return True
+        tomb = path.with_name(f"{path.name}.{uuid.uuid4().hex}.stale")
+        try:
+            os.rename(path, tomb)
+        except FileNotFoundError:
+            return True
+        if not self._is_stale(tomb):
+            try:
+                os.link(tomb, path)
+            except FileExistsError:
+                pass
+            tomb.unlink()
+            return False
+        secho(
+            f"Lease {path.name} of {(_read(tomb) or '?').split(' ')[0]} "
+            "expired, taking over",
+            fg="yellow"
+        )
+        tomb.unlink()
+        return True
+
+    def _beat(self) -> None:
+        while not self._stop.wait(self.ttl / 4):
+            with self._lock:
+                held = list(self._held.items())
+            for key, (path, token) in held:
+                if _read(path) != token:
+                    secho(f"Lost lease {path.name}", fg="red")
+                    with self._lock:
+                        self._held.pop(key, None)
+                    continue
+                try:
+                    os.utime(path)
+                except FileNotFoundError:
+                    pass
+
+    def __enter__(self) -> "LeaseDir":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def _read(path: pathlib.Path) -> t.Optional[str]:
+    try:
+        return path.read_text()
+    except (FileNotFoundError, UnicodeDecodeError):
+        return None
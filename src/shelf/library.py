@@ -0,0 +1,225 @@
+import asyncio
+import math
+import random
+import time
+import typing as t
+
+from .exceptions import ShelfError
+
+
+RESPONSE_GROUPS = ",".join([
+    "contributors",
+    "product_attrs",
+    "product_desc",
+])
+
+
+def book_info(book) -> t.Dict[str, t.Any]:
+    """Reduce an audible_cli `LibraryItem` to what shelf needs"""
+    return {
+        'asin': book.asin,
+        'title': book.full_title,
+        'authors':
+            ", ".join([i["name"] for i in (book.authors or [])]),
+        'narrators':
+            ", ".join([i["name"] for i in (book.narrators or [])]),
+        'date_added': book.purchase_date,
+        # enhanced codec: name, for `audible fetch`
+        'codecs': {
+            i["enhanced_codec"]: i["name"]
+            for i in (book.available_codecs or [])
+            if i["name"].startswith("aax_")
+        },
+    }
+
+
+# library items per request, and how many requests run at once at most
+PAGE_SIZE = 200
+CONCURRENCY = 8
+RETRIES = 5
+# first wait after a throttled or failed request, doubled for every retry
+BACKOFF = 1.0
+
+
+class AdaptiveLimiter:
+    """How many requests may run at once, adapted to what the API takes
+
+    Starts at LIMIT. A throttled request (429/503) halves the allowance
+    and holds back new requests for a while; every successful one grows it
+    back by about one per round of requests, up to LIMIT again.
+    """
+
+    def __init__(self, limit: int = CONCURRENCY) -> None:
+        self.limit = limit
+        self.allowed = float(limit)
+        self._active = 0
+        self._resume_at = 0.0
+        self._changed = asyncio.Condition()
+
+    async def __aenter__(self) -> None:
+        async with self._changed:
+            await self._changed.wait_for(
+                lambda: self._active < int(self.allowed)
+            )
+            self._active += 1
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def __aexit__(self, *exc_info) -> None:
+        async with self._changed:
+            self._active -= 1
+            self._changed.notify_all()
+
+    def succeeded(self) -> None:
+        self.allowed = min(self.limit, self.allowed + 1 / self.allowed)
+
+    def throttled(self, delay: float) -> None:
+        self.allowed = max(1.0, self.allowed / 2)
+        self._resume_at = max(self._resume_at, time.monotonic() + delay)
+
+
+def _retry_after(exc: Exception) -> t.Optional[float]:
+    response = getattr(exc, "response", None)
+    try:
+        return float(response.headers["retry-after"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+async def _request(
+    limiter: AdaptiveLimiter,
+    request: t.Callable[[], t.Awaitable[t.Any]],
+    what: str
+) -> t.Any:
+    """Await REQUEST within LIMITER, retried while throttled or failing
+
+    Library reads change nothing, so they can be repeated safely.
+    """
+    from audible.exceptions import (
+        NetworkError,
+        NotResponding,
+        RatelimitError,
+        ServerError,
+    )
+
+    for attempt in range(RETRIES):
+        async with limiter:
+            try:
+                result = await request()
+            except (
+                RatelimitError, ServerError, NetworkError, NotResponding
+            ) as exc:
+                error = exc
+                jitter = random.uniform(1, 1.5)  # noqa: S311
+                delay = _retry_after(exc) or BACKOFF * 2 ** attempt * jitter
+                limiter.throttled(delay)
+                continue
+        limiter.succeeded()
+        return result
+    raise ShelfError(f"{what}: {error}, gave up after {RETRIES} tries")
+
+
+async def fetch_library(
+    client,
+    bunch_size=None,
+    start_date=None,
+    end_date=None,
+    concurrency: int = CONCURRENCY
+) -> t.Dict[str, t.Dict[str, t.Any]]:
+    """Fetch the whole library, return book info by ASIN
+
+    The first page tells how many there are; the others, BUNCH_SIZE items
+    each, are fetched up to CONCURRENCY at a time, fewer while the API
+    throttles (see `AdaptiveLimiter`).
+    """
+    from audible_cli.models import Library
+
+    limiter = AdaptiveLimiter(concurrency)
+    params = dict(
+        response_groups=RESPONSE_GROUPS,
+        num_results=bunch_size or PAGE_SIZE,
+        start_date=start_date,
+        end_date=end_date
+    )
+
+    def page(number: int, count: bool = False):
+        return _request(
+            limiter,
+            lambda: Library.from_api(
+                client,
+                page=number,
+                include_total_count_header=count,
+                **params
+            ),
+            f"library page {number}"
+        )
+
+    library, total_count = await page(1, count=True)
+    pages = math.ceil(int(total_count or 0) / params["num_results"])
+    for other in await asyncio.gather(
+        *(page(number) for number in range(2, pages + 1))
+    ):
+        library.data.extend(other.data)
+    await library.resolve_podcats(start_date=start_date, end_date=end_date)
+
+    books = {}
+    for book in library:
+        books[book.asin] = book_info(book)
+
+    return books
+
+
+class LibrarySnapshot:
+    """Last fetched library, reused until it is older than `max_age`
+
+    `max_age` is in seconds, `None` means a snapshot never expires on its
+    own (call `invalidate()` after a purchase/download).
+    """
+
+    def __init__(self, max_age: t.Optional[float] = None) -> None:
+        self._max_age = max_age
+        self._books: t.Optional[t.Dict[str, t.Dict[str, t.Any]]] = None
+        self._params: t.Optional[tuple] = None
+        self._fetched_at: t.Optional[float] = None
+
+    @property
+    def books(self) -> t.Optional[t.Dict[str, t.Dict[str, t.Any]]]:
+        return self._books
+
+    @property
+    def fetched_at(self) -> t.Optional[float]:
+        return self._fetched_at
+
+    def is_fresh(self, params: tuple) -> bool:
+        if self._books is None or self._params != params:
+            return False
+        if self._max_age is None:
+            return True
+        return time.monotonic() - self._fetched_at < self._max_age
+
+    def invalidate(self) -> None:
+        self._books = None
+        self._params = None
+        self._fetched_at = None
+
+    async def sync(
+        self,
+        client,
+        bunch_size=None,
+        start_date=None,
+        end_date=None,
+        concurrency: int = CONCURRENCY
+    ) -> t.Dict[str, t.Dict[str, t.Any]]:
+        params = (bunch_size, start_date, end_date)
+        if not self.is_fresh(params):
+            self._books = await fetch_library(
+                client,
+                bunch_size=bunch_size,
+                start_date=start_date,
+                end_date=end_date,
+                concurrency=concurrency
+            )
+            self._params = params
+            self._fetched_at = time.monotonic()
+        return self._books
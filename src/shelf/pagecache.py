@@ -0,0 +1,77 @@
+"""Keeping bulk file I/O from pushing out what the box serves
+
+Decrypting a batch of books streams tens of GB through the page cache and
+evicts the feeds, covers and recently played books a web server on the
+same box serves. Files passed through once are dropped from the cache when
+done with instead. Without `posix_fadvise` (macOS) all of this is a no-op.
+"""
+
+import hashlib
+import os
+import pathlib
+import typing as t
+
+# bytes hashed per read, dropped from the cache behind the reader
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def _advise(fd: int, offset: int, length: int, advice: str) -> None:
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        os.posix_fadvise(fd, offset, length, getattr(os, advice))
+    except OSError:
+        pass
+
+
+def evict(paths: t.Iterable[pathlib.Path], written: bool = False) -> None:
+    """Drop PATHS (files, or folders of them) from the page cache
+
+    WRITTEN files are flushed to disk first, only clean pages are dropped.
+    """
+    for path in paths:
+        if path.is_dir():
+            evict(path.iterdir(), written)
+            continue
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            if written:
+                os.fdatasync(fd)
+            _advise(fd, 0, 0, "POSIX_FADV_DONTNEED")
+        finally:
+            os.close(fd)
+
+
+def advise_sequential(fd: int) -> None:
+    """Tell the kernel FD is read front to back, it reads further ahead"""
+    _advise(fd, 0, 0, "POSIX_FADV_SEQUENTIAL")
+
+
+def drop_range(fd: int, offset: int, length: int) -> None:
+    """Drop LENGTH bytes from OFFSET of FD, once read, from the page cache"""
+    _advise(fd, offset, length, "POSIX_FADV_DONTNEED")
+
+
+def file_digest(
+    path: pathlib.Path,
+    algorithm: str = "sha256",
+    drop: bool = True
+) -> str:
+    """Hex digest of PATH, read sequentially; DROP what was read"""
+    digest = hashlib.new(algorithm)
+    with open(path, "rb", buffering=0) as f:
+        fd = f.fileno()
+        advise_sequential(fd)
+        offset = 0
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            if drop:
+                drop_range(fd, offset, len(chunk))
+            offset += len(chunk)
+    return digest.hexdigest()
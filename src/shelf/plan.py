@@ -0,0 +1,133 @@
+import pathlib
+import re
+import typing as t
+
+from click import echo
+
+from .exceptions import ShelfError
+
+_SIZE = re.compile(r"\A\s*([0-9]+(?:\.[0-9]+)?)\s*([KMGT]?)i?B?\s*\Z", re.I)
+_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(value: str) -> int:
+    """Bytes in VALUE, e.g. `500M` or `20GiB`"""
+    match = _SIZE.match(value)
+    if not match:
+        raise ShelfError(f"invalid size {value}, expected e.g. 500M or 20G")
+    return int(float(match.group(1)) * _UNITS[match.group(2).upper()])
+
+
+def format_size(size: float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else \
+                f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+def format_seconds(seconds: float) -> str:
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+class PlanItem:
+    def __init__(
+        self,
+        action: str,
+        file: pathlib.Path,
+        bytes_read: int,
+        bytes_written: int,
+        seconds: float
+    ) -> None:
+        self.action = action
+        self.file = file
+        self.bytes_read = bytes_read
+        self.bytes_written = bytes_written
+        self.seconds = seconds
+
+    def __repr__(self) -> str:
+        return f"<PlanItem {self.action} {self.file.name}>"
+
+
+class Plan:
+    """The work a run would do, per file, with estimated cost
+
+    Items are grouped by the file they belong to (e.g. an `.aaxc` with its
+    decrypt, cover and variant work). `within()` picks files to fit a
+    budget, highest priority first.
+    """
+
+    def __init__(self) -> None:
+        self.items: t.List[PlanItem] = []
+        self._priority: t.Dict[pathlib.Path, float] = {}
+
+    def add(self, item: PlanItem, priority: float = 0) -> None:
+        self.items.append(item)
+        self._priority.setdefault(item.file, priority)
+
+    def files(self) -> t.List[pathlib.Path]:
+        """Files with work, highest priority first"""
+        return sorted(
+            self._priority, key=lambda f: self._priority[f], reverse=True
+        )
+
+    def cost(self, file: pathlib.Path) -> t.Tuple[int, float]:
+        items = [i for i in self.items if i.file == file]
+        return (
+            sum(i.bytes_read + i.bytes_written for i in items),
+            sum(i.seconds for i in items),
+        )
+
+    def totals(self) -> t.Tuple[int, int, float]:
+        return (
+            sum(i.bytes_read for i in self.items),
+            sum(i.bytes_written for i in self.items),
+            sum(i.seconds for i in self.items),
+        )
+
+    def within(
+        self,
+        max_bytes: t.Optional[int] = None,
+        max_seconds: t.Optional[float] = None
+    ) -> t.Tuple[t.List[pathlib.Path], t.List[pathlib.Path]]:
+        """Split the files into those to run now and those to defer
+
+        Files are taken highest priority first, as long as the bytes read
+        plus written and the seconds still fit; a file that does not fit
+        is deferred and smaller ones after it may still run.
+        """
+        used_bytes, used_seconds = 0, 0.0
+        selected, deferred = [], []
+        for file in self.files():
+            size, seconds = self.cost(file)
+            if (max_bytes is not None and used_bytes + size > max_bytes) \
+                    or (max_seconds is not None
+                        and used_seconds + seconds > max_seconds):
+                deferred.append(file)
+                continue
+            used_bytes += size
+            used_seconds += seconds
+            selected.append(file)
+        return selected, deferred
+
+    def echo(self) -> None:
+        for item in sorted(
+            self.items,
+            key=lambda i: self._priority[i.file],
+            reverse=True
+        ):
+            echo(
+                f"{item.action:<8} {item.file.name:<60} "
+                f"read {format_size(item.bytes_read):>10}  "
+                f"write {format_size(item.bytes_written):>10}  "
+                f"~{format_seconds(item.seconds)}"
+            )
+        read, written, seconds = self.totals()
+        echo(
+            f"{len(self.items)} actions on {len(self._priority)} files: "
+            f"read {format_size(read)}, write {format_size(written)}, "
+            f"~{format_seconds(seconds)} (serial estimate)"
+        )
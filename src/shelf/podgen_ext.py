@@ -0,0 +1,48 @@
+"""podgen classes with the Podcasting 2.0 tags shelf publishes
+
+Imports podgen and lxml, so only import this where podgen is imported.
+"""
+
+import podgen
+from lxml import etree
+
+from .chapters import CHAPTERS_MIME_TYPE
+
+PODCAST_NS = "https://podcastindex.org/namespace/1.0"
+
+
+class Episode(podgen.Episode):
+    def __init__(self, *args, **kwargs):
+        self.chapters_url = None
+        """URL of the episode's JSON chapters, for `<podcast:chapters>`"""
+        super().__init__(*args, **kwargs)
+
+    def rss_entry(self):
+        entry = super().rss_entry()
+        if self.chapters_url:
+            chapters = etree.SubElement(entry, f"{{{PODCAST_NS}}}chapters")
+            chapters.attrib["url"] = self.chapters_url
+            chapters.attrib["type"] = CHAPTERS_MIME_TYPE
+        return entry
+
+
+class Podcast(podgen.Podcast):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._nsmap["podcast"] = PODCAST_NS
+
+
+def item_fragment(episode: Episode, nsmap: dict) -> bytes:
+    """EPISODE's `<item>` as `Podcast.rss_str` writes it, in UTF-8
+
+    It is serialized in a channel of its own under the feed's namespaces
+    (NSMAP), so its indentation and prefixes match the full feed's.
+    """
+    feed = etree.Element("rss", nsmap=nsmap)
+    channel = etree.SubElement(feed, "channel")
+    channel.append(episode.rss_entry())
+    data = etree.tostring(
+        feed, pretty_print=True, encoding="UTF-8", xml_declaration=False
+    )
+    start = data.index(b"<channel>\n") + len(b"<channel>\n")
+    return data[start:data.rindex(b"  </channel>")]
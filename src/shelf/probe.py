@@ -0,0 +1,84 @@
+import json
+import pathlib
+import subprocess  # noqa: S404
+import threading
+import typing as t
+
+# size, mtime, device and inode
+_StatKey = t.Tuple[int, int, int, int]
+
+
+def ffprobe(file: t.Union[pathlib.Path, str]) -> t.Dict[str, t.Any]:
+    """Return the `format` section of `ffprobe -show_format` for FILE"""
+    base_cmd = [
+        "ffprobe",
+        "-show_format",
+        "-output_format",
+        "json",
+        "-i",
+        str(file)
+    ]
+    child_result = subprocess.run(base_cmd, capture_output=True)  # noqa: S603
+    if child_result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed, corrupt? {str(file)}")
+
+    try:
+        probe_dict = json.loads(child_result.stdout)
+    except json.JSONDecodeError:
+        raise RuntimeError(
+            f"json parse error from ffprobe for {str(file)}"
+        ) from None
+
+    return probe_dict["format"]
+
+
+class ProbeCache:
+    """In-memory ffprobe results, keyed by path, size and mtime
+
+    A file that is rewritten (new size or mtime) is probed again, everything
+    else is answered from memory. Keep one instance around in a long-lived
+    process to skip ffprobe for unchanged files between refreshes. Links of
+    a file probed before (see `ContentStore`) are answered from memory too.
+    """
+
+    def __init__(self) -> None:
+        self._entries: t.Dict[str, t.Tuple[_StatKey, dict]] = {}
+        self._inodes: t.Dict[_StatKey, dict] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stat_key(file: pathlib.Path) -> "_StatKey":
+        stat = file.stat()
+        return stat.st_size, stat.st_mtime_ns, stat.st_dev, stat.st_ino
+
+    def _lookup(self, file: pathlib.Path, stat_key: "_StatKey"):
+        with self._lock:
+            entry = self._entries.get(str(file))
+            if entry is not None and entry[0] == stat_key:
+                return entry[1]
+            return self._inodes.get(stat_key)
+
+    def probe(self, file: t.Union[pathlib.Path, str]) -> t.Dict[str, t.Any]:
+        file = pathlib.Path(file)
+        stat_key = self._stat_key(file)
+        result = self._lookup(file, stat_key)
+        if result is None:
+            result = ffprobe(file)
+        with self._lock:
+            self._entries[str(file)] = (stat_key, result)
+            self._inodes[stat_key] = result
+        return result
+
+    def is_fresh(self, file: t.Union[pathlib.Path, str]) -> bool:
+        """Whether `probe(FILE)` would be answered without ffprobe"""
+        file = pathlib.Path(file)
+        return self._lookup(file, self._stat_key(file)) is not None
+
+    def forget(self, file: t.Union[pathlib.Path, str]) -> None:
+        with self._lock:
+            entry = self._entries.pop(str(pathlib.Path(file)), None)
+            if entry is not None:
+                self._inodes.pop(entry[0], None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,206 @@
+import pathlib
+import typing as t
+
+from .exceptions import ShelfError
+from .feed import FeedOptions
+from .layout import LAYOUTS
+from .library import LibrarySnapshot
+
+# `Shelf.decrypt` options a config's [decrypt] table may set
+DECRYPT_OPTIONS = (
+    "overwrite",
+    "rebuild_chapters",
+    "force_rebuild_chapters",
+    "skip_rebuild_chapters",
+    "separate_intro_outro",
+    "copy_asin_to_metadata",
+    "split_chapters",
+    "keep_full",
+    "faststart",
+    "hls",
+    "chapters_json",
+    "cover_size",
+    "batch_under",
+    "batch_max",
+    "variants",
+)
+# `FeedOptions` arguments, in [feed] or a profile
+FEED_OPTIONS = (
+    "name",
+    "desc",
+    "url_prefix",
+    "image",
+    "outfile",
+    "website",
+    "feed_url",
+    "explicit",
+    "make_public",
+    "category",
+    "subcategory",
+    "library_page",
+    "hub_url",
+)
+# how `Shelf.render_profile_feeds` builds a feed, in [feed] or a profile
+FEED_FLAGS = ("sort_by_purchase_date", "use_library_api", "hls")
+_SETTINGS = (
+    "assets",
+    "layout",
+    "jobs",
+    "io_per_device",
+    "nice",
+    "ionice",
+    "dedup",
+    "drop_cache",
+)
+
+
+class Profile:
+    """One Audible account (an audible-cli profile) and the feed of its books
+
+    Every profile keeps its own library snapshot, `books` once synced.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        downloads: t.Union[pathlib.Path, str],
+        feed: t.Dict[str, t.Any],
+        sort_by_purchase_date: bool = False,
+        use_library_api: bool = False,
+        hls: bool = False
+    ) -> None:
+        self.name = name
+        self.downloads = pathlib.Path(downloads)
+        self.feed = feed
+        self.sort_by_purchase_date = sort_by_purchase_date
+        self.use_library_api = use_library_api
+        self.hls = hls
+        self.library = LibrarySnapshot()
+        self.books: t.Optional[t.Dict[str, t.Dict[str, t.Any]]] = None
+
+    def feed_options(self, assets_dir: pathlib.Path) -> FeedOptions:
+        """The feed, written to `rss-<profile>` in ASSETS_DIR by default"""
+        feed = dict(self.feed)
+        feed["outfile"] = assets_dir / feed.get("outfile", f"rss-{self.name}")
+        return FeedOptions(**feed)
+
+    def __repr__(self) -> str:
+        return f"<Profile {self.name}>"
+
+
+class ShelfConfig:
+    """Settings of `audible restock`: one assets folder, several profiles
+
+    Read from TOML:
+
+        assets = "/shelf/assets"
+        layout = "hash"
+        jobs = 2
+        dedup = true  # see `ContentStore`
+        drop_cache = true  # see `Shelf`
+
+        [decrypt]
+        rebuild_chapters = true
+        cover_size = 1215
+
+        [feed]  # defaults for every profile
+        url_prefix = "https://example.org/shelf/"
+        desc = "Audiobooks"
+        image = "cover.jpg"
+        sort_by_purchase_date = true
+
+        [profiles.alice]  # an audible-cli profile
+        downloads = "/shelf/alice/dl"
+        name = "Alice's books"
+
+    Relative paths are relative to the config file, a feed's `outfile`
+    to the assets folder.
+    """
+
+    def __init__(
+        self,
+        assets: t.Union[pathlib.Path, str],
+        profiles: t.List[Profile],
+        layout: str = "flat",
+        jobs: int = 1,
+        io_per_device: int = 2,
+        nice: t.Optional[int] = None,
+        ionice: t.Optional[str] = None,
+        decrypt: t.Optional[t.Dict[str, t.Any]] = None,
+        dedup: bool = False,
+        drop_cache: bool = False
+    ) -> None:
+        if layout not in LAYOUTS:
+            raise ShelfError(
+                f"unknown layout {layout}, use one of {', '.join(LAYOUTS)}"
+            )
+        self.assets = pathlib.Path(assets)
+        self.profiles = profiles
+        self.layout = layout
+        self.jobs = jobs
+        self.io_per_device = io_per_device
+        self.nice = nice
+        self.ionice = ionice
+        self.decrypt = decrypt or {}
+        self.dedup = dedup
+        self.drop_cache = drop_cache
+
+    @classmethod
+    def load(cls, path: t.Union[pathlib.Path, str]) -> "ShelfConfig":
+        import tomllib
+
+        path = pathlib.Path(path)
+        try:
+            with path.open("rb") as f:
+                data = tomllib.load(f)
+        except (OSError, tomllib.TOMLDecodeError) as exc:
+            raise ShelfError(f"{path}: {exc}") from None
+
+        base = path.resolve().parent
+        decrypt = data.pop("decrypt", {})
+        defaults = data.pop("feed", {})
+        profiles = data.pop("profiles", {})
+        _check_keys(path, "[decrypt]", decrypt, DECRYPT_OPTIONS)
+        _check_keys(path, "[feed]", defaults, FEED_OPTIONS + FEED_FLAGS)
+        _check_keys(path, "the top level", data, _SETTINGS)
+        if "assets" not in data:
+            raise ShelfError(f"{path}: no assets folder")
+        if not profiles:
+            raise ShelfError(f"{path}: no [profiles.<name>]")
+
+        parsed = []
+        for name, profile in profiles.items():
+            _check_keys(
+                path,
+                f"[profiles.{name}]",
+                profile,
+                ("downloads",) + FEED_OPTIONS + FEED_FLAGS
+            )
+            settings = {**defaults, **profile}
+            missing = sorted(
+                {"downloads", "name", "desc", "url_prefix", "image"}
+                - set(settings)
+            )
+            if missing:
+                raise ShelfError(
+                    f"{path}: profile {name} has no {', '.join(missing)}"
+                )
+            parsed.append(Profile(
+                name,
+                base / settings.pop("downloads"),
+                feed={k: v for k, v in settings.items() if k in FEED_OPTIONS},
+                **{k: v for k, v in settings.items() if k in FEED_FLAGS}
+            ))
+        data["assets"] = base / data["assets"]
+        return cls(profiles=parsed, decrypt=decrypt, **data)
+
+
+def _check_keys(
+    path: pathlib.Path,
+    where: str,
+    table: t.Dict[str, t.Any],
+    allowed: t.Tuple[str, ...]
+) -> None:
+    unknown = sorted(set(table) - set(allowed))
+    if unknown:
+        raise ShelfError(f"{path}: unknown {', '.join(unknown)} in {where}")
@@ -0,0 +1,499 @@
+import base64
+import datetime
+import hashlib
+import hmac
+import json
+import os
+import pathlib
+import threading
+import typing as t
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+
+import httpx
+from click import echo, secho
+
+from .chapters import CHAPTERS_MIME_TYPE, CHAPTERS_SUFFIX
+from .exceptions import PublishError
+from .pagecache import advise_sequential, drop_range, evict
+from .streaming import HLS_MIME_TYPE
+
+# this module is imported by `audible publish` only, httpx and the rest are
+# not worth keeping out of module scope
+
+MANIFEST = ".shelf-publish.json"
+
+# upload in parts from this size on, parts of PART_SIZE each (S3 allows
+# 10000 parts, so up to ~160 GiB)
+MULTIPART_THRESHOLD = 64 * 1024 * 1024
+PART_SIZE = 16 * 1024 * 1024
+
+# suffix: (Content-Type, Cache-Control); feeds are files without suffix
+# (`rss`, `rss-opus-32k`) or `.xml`
+CONTENT_TYPES = {
+    ".m4a": ("audio/mp4", "public, max-age=86400"),
+    ".mp3": ("audio/mpeg", "public, max-age=86400"),
+    ".mp4": ("audio/mp4", "public, max-age=86400"),
+    ".m4s": ("audio/mp4", "public, max-age=86400"),
+    ".jpg": ("image/jpeg", "public, max-age=86400"),
+    ".m3u8": (HLS_MIME_TYPE, "public, max-age=3600"),
+    CHAPTERS_SUFFIX: (CHAPTERS_MIME_TYPE, "public, max-age=3600"),
+    # the library page's search index changes with every book
+    ".json": ("application/json", "public, max-age=300"),
+    ".html": ("text/html; charset=utf-8", "public, max-age=300"),
+}
+FEED_TYPE = ("application/rss+xml; charset=utf-8", "public, max-age=300")
+DEFAULT_TYPE = ("application/octet-stream", "public, max-age=3600")
+
+# uploaded in this order, each stage done before the next starts: media
+# before the playlists and sidecars pointing into it, feeds last
+STAGE_MEDIA, STAGE_INDEX, STAGE_FEED = range(3)
+_INDEX_SUFFIXES = (".m3u8", ".json", ".html")
+
+_EMPTY_SHA256 = hashlib.sha256(b"").hexdigest()
+
+
+def is_feed(key: str) -> bool:
+    return "/" not in key and ("." not in key or key.endswith(".xml"))
+
+
+def object_headers(key: str) -> t.Dict[str, str]:
+    """Content-Type and Cache-Control for the object KEY"""
+    if is_feed(key):
+        content_type, cache_control = FEED_TYPE
+    else:
+        content_type, cache_control = next(
+            (v for suffix, v in CONTENT_TYPES.items() if key.endswith(suffix)),
+            DEFAULT_TYPE
+        )
+    return {"Content-Type": content_type, "Cache-Control": cache_control}
+
+
+def stage(key: str) -> int:
+    if is_feed(key):
+        return STAGE_FEED
+    if key.endswith(_INDEX_SUFFIXES):
+        return STAGE_INDEX
+    return STAGE_MEDIA
+
+
+def _content_md5(data: bytes) -> str:
+    digest = hashlib.md5(data).digest()  # noqa: S324
+    return base64.b64encode(digest).decode()
+
+
+def _hmac(key: bytes, msg: str) -> bytes:
+    return hmac.new(key, msg.encode(), hashlib.sha256).digest()
+
+
+class S3Bucket:
+    """Just the part of the S3 API publishing needs, signed with SigV4
+
+    Uses path-style URLs (`<endpoint>/<bucket>/<key>`), which AWS, MinIO
+    and most S3-compatible stores accept. Payloads are not hashed for the
+    signature (`UNSIGNED-PAYLOAD`), every body carries a Content-MD5 the
+    store checks instead. Credentials default to the usual `AWS_*`
+    variables.
+    """
+
+    def __init__(
+        self,
+        endpoint_url: str,
+        bucket: str,
+        region: t.Optional[str] = None,
+        access_key: t.Optional[str] = None,
+        secret_key: t.Optional[str] = None,
+        session_token: t.Optional[str] = None,
+        timeout: float = 300
+    ) -> None:
+        self.endpoint_url = endpoint_url.rstrip("/")
+        self.bucket = bucket
+        self.region = region or os.environ.get("AWS_REGION") \
+            or os.environ.get("AWS_DEFAULT_REGION") or "us-east-1"
+        self._access_key = access_key or os.environ.get("AWS_ACCESS_KEY_ID")
+        self._secret_key = secret_key \
+            or os.environ.get("AWS_SECRET_ACCESS_KEY")
+        self._session_token = session_token \
+            or os.environ.get("AWS_SESSION_TOKEN")
+        if not self._access_key or not self._secret_key:
+            raise PublishError(
+                "no credentials, set AWS_ACCESS_KEY_ID and "
+                "AWS_SECRET_ACCESS_KEY"
+            )
+        self._host = urllib.parse.urlsplit(self.endpoint_url).netloc
+        self._client = httpx.Client(timeout=timeout)
+
+    def close(self) -> None:
+        self._client.close()
+
+    def __enter__(self) -> "S3Bucket":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _path(self, key: str) -> str:
+        return urllib.parse.quote(f"/{self.bucket}/{key}", safe="/~")
+
+    def sign(
+        self,
+        method: str,
+        path: str,
+        query: t.Dict[str, str],
+        headers: t.Dict[str, str],
+        payload_hash: str,
+        now: t.Optional[datetime.datetime] = None
+    ) -> t.Dict[str, str]:
+        """HEADERS plus the date, payload hash and Authorization headers"""
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        scope = f"{now:%Y%m%d}/{self.region}/s3/aws4_request"
+        headers = {
+            **headers,
+            "Host": self._host,
+            "x-amz-date": amz_date,
+            "x-amz-content-sha256": payload_hash,
+        }
+        if self._session_token:
+            headers["x-amz-security-token"] = self._session_token
+
+        canonical_headers = sorted(
+            (name.lower(), " ".join(str(value).split()))
+            for name, value in headers.items()
+        )
+        signed_headers = ";".join(name for name, _ in canonical_headers)
+        canonical_query = "&".join(
+            f"{urllib.parse.quote(k, safe='~')}="
+            f"{urllib.parse.quote(v, safe='~')}"
+            for k, v in sorted(query.items())
+        )
+        canonical_request = "\n".join([
+            method,
+            path,
+            canonical_query,
+            "".join(f"{name}:{value}\n" for name, value in canonical_headers),
+            signed_headers,
+            payload_hash,
+        ])
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256",
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ])
+        key = _hmac(f"AWS4{self._secret_key}".encode(), f"{now:%Y%m%d}")
+        for part in (self.region, "s3", "aws4_request"):
+            key = _hmac(key, part)
+        signature = hmac.new(
+            key, string_to_sign.encode(), hashlib.sha256
+        ).hexdigest()
+        headers["Authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self._access_key}/{scope}, "
+            f"SignedHeaders={signed_headers}, Signature={signature}"
+        )
+        return headers
+
+    def _request(
+        self,
+        method: str,
+        key: str,
+        query: t.Optional[t.Dict[str, str]] = None,
+        headers: t.Optional[t.Dict[str, str]] = None,
+        body: bytes = b""
+    ) -> httpx.Response:
+        query = query or {}
+        headers = dict(headers or {})
+        if body:
+            headers["Content-MD5"] = _content_md5(body)
+        payload_hash = "UNSIGNED-PAYLOAD" if body else _EMPTY_SHA256
+        path = self._path(key)
+        headers = self.sign(method, path, query, headers, payload_hash)
+        url = self.endpoint_url + path
+        if query:
+            url += "?" + "&".join(
+                f"{k}={urllib.parse.quote(v, safe='~')}"
+                for k, v in sorted(query.items())
+            )
+        try:
+            response = self._client.request(
+                method, url, headers=headers, content=body
+            )
+        except httpx.HTTPError as exc:
+            raise PublishError(f"{method} {key}: {exc}") from None
+        # CompleteMultipartUpload may fail after sending 200
+        if response.status_code >= 300 or b"<Error>" in response.content:
+            raise PublishError(
+                f"{method} {key}: HTTP {response.status_code} "
+                f"{response.text[:500]}"
+            )
+        return response
+
+    @staticmethod
+    def _etag(response: httpx.Response) -> str:
+        return response.headers.get("ETag", "").strip('"')
+
+    def put_object(
+        self,
+        key: str,
+        body: bytes,
+        headers: t.Dict[str, str]
+    ) -> str:
+        """Upload BODY, return its ETag"""
+        return self._etag(
+            self._request("PUT", key, headers=headers, body=body)
+        )
+
+    def create_multipart_upload(
+        self,
+        key: str,
+        headers: t.Dict[str, str]
+    ) -> str:
+        response = self._request(
+            "POST", key, query={"uploads": ""}, headers=headers
+        )
+        return _xml_text(response.content, "UploadId")
+
+    def upload_part(
+        self,
+        key: str,
+        upload_id: str,
+        number: int,
+        body: bytes
+    ) -> str:
+        return self._etag(self._request(
+            "PUT",
+            key,
+            query={"partNumber": str(number), "uploadId": upload_id},
+            body=body
+        ))
+
+    def complete_multipart_upload(
+        self,
+        key: str,
+        upload_id: str,
+        etags: t.List[str]
+    ) -> str:
+        parts = "".join(
+            f"<Part><PartNumber>{number}</PartNumber>"
+            f"<ETag>\"{etag}\"</ETag></Part>"
+            for number, etag in enumerate(etags, 1)
+        )
+        body = (
+            f"<CompleteMultipartUpload>{parts}</CompleteMultipartUpload>"
+        ).encode()
+        response = self._request(
+            "POST", key, query={"uploadId": upload_id}, body=body
+        )
+        return _xml_text(response.content, "ETag").strip('"')
+
+    def abort_multipart_upload(self, key: str, upload_id: str) -> None:
+        self._request("DELETE", key, query={"uploadId": upload_id})
+
+    def delete_object(self, key: str) -> None:
+        self._request("DELETE", key)
+
+
+def _xml_text(content: bytes, tag: str) -> str:
+    for element in ElementTree.fromstring(content).iter():
+        if element.tag.rsplit("}", 1)[-1] == tag:
+            return element.text or ""
+    raise PublishError(f"no {tag} in response")
+
+
+class Publisher:
+    """Upload an assets folder to a bucket, only what changed
+
+    What was uploaded is remembered per bucket and prefix in MANIFEST in
+    ROOT, by size and mtime: nothing is listed remotely or hashed locally
+    to find the changes. Hidden files (temporary outputs, the manifest)
+    are skipped. Uploads go in stages, media first and feeds last, so a
+    feed never points at an object that is not there yet; with DELETE,
+    objects of files removed locally are deleted after the feeds. With
+    DROP_CACHE, media files are dropped from the page cache once uploaded.
+    """
+
+    def __init__(
+        self,
+        root: pathlib.Path,
+        bucket: S3Bucket,
+        prefix: str = "",
+        jobs: int = 4,
+        delete: bool = False,
+        multipart_threshold: int = MULTIPART_THRESHOLD,
+        part_size: int = PART_SIZE,
+        drop_cache: bool = False
+    ) -> None:
+        self._root = root
+        self._bucket = bucket
+        self._prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self._jobs = jobs
+        self._delete = delete
+        self._multipart_threshold = multipart_threshold
+        self._part_size = part_size
+        self._drop_cache = drop_cache
+        self._lock = threading.Lock()
+        self._target = \
+            f"{bucket.endpoint_url}/{bucket.bucket}/{self._prefix}"
+        self._manifest = self._load_manifest()
+        self._published: t.Dict[str, t.List] = \
+            self._manifest.setdefault(self._target, {})
+
+    def _load_manifest(self) -> t.Dict[str, t.Dict[str, t.List]]:
+        try:
+            return json.loads((self._root / MANIFEST).read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self) -> None:
+        manifest = self._root / MANIFEST
+        tmpfile = manifest.with_name(f"{manifest.name}.tmp")
+        with self._lock:
+            tmpfile.write_text(json.dumps(self._manifest))
+        os.replace(tmpfile, manifest)
+
+    def _walk(self) -> t.Dict[str, t.Tuple[pathlib.Path, int, int]]:
+        """{key relative to ROOT: (path, size, mtime_ns)} of every file"""
+        files = {}
+        folders = [self._root]
+        while folders:
+            with os.scandir(folders.pop()) as entries:
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir():
+                        folders.append(pathlib.Path(entry.path))
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        key = pathlib.Path(entry.path) \
+                            .relative_to(self._root).as_posix()
+                        files[key] = (
+                            pathlib.Path(entry.path),
+                            stat.st_size,
+                            stat.st_mtime_ns,
+                        )
+        return files
+
+    def pending(
+        self
+    ) -> t.Tuple[t.List[t.Tuple[str, pathlib.Path]], t.List[str]]:
+        """(key, file) to upload, in upload order, and keys to delete"""
+        files = self._walk()
+        uploads = [
+            (key, path) for key, (path, size, mtime_ns) in files.items()
+            if self._published.get(key, [None, None])[:2] != [size, mtime_ns]
+        ]
+        uploads.sort(key=lambda item: (stage(item[0]), item[0]))
+        deletions = sorted(set(self._published) - set(files)) \
+            if self._delete else []
+        return uploads, deletions
+
+    def run(self, dry_run: bool = False) -> t.Tuple[int, int]:
+        """Publish what changed, return the number of uploads and deletes"""
+        uploads, deletions = self.pending()
+        if dry_run:
+            for key, _ in uploads:
+                echo(f"upload {self._prefix}{key}")
+            for key in deletions:
+                echo(f"delete {self._prefix}{key}")
+            return len(uploads), len(deletions)
+
+        try:
+            with ThreadPoolExecutor(
+                max_workers=self._jobs, thread_name_prefix="shelf-publish"
+            ) as files, ThreadPoolExecutor(
+                max_workers=self._jobs, thread_name_prefix="shelf-part"
+            ) as parts:
+                for current in (STAGE_MEDIA, STAGE_INDEX, STAGE_FEED):
+                    futures = [
+                        files.submit(self._upload, key, path, parts)
+                        for key, path in uploads if stage(key) == current
+                    ]
+                    # a stage has to be complete before the next one starts
+                    for future in futures:
+                        future.result()
+            for key in deletions:
+                self._bucket.delete_object(self._prefix + key)
+                with self._lock:
+                    del self._published[key]
+                echo(f"Deleted {self._prefix}{key}")
+        finally:
+            self._save_manifest()
+        return len(uploads), len(deletions)
+
+    def _upload(
+        self,
+        key: str,
+        path: pathlib.Path,
+        parts: ThreadPoolExecutor
+    ) -> None:
+        stat = path.stat()
+        headers = object_headers(key)
+        name = self._prefix + key
+        drop = self._drop_cache and stage(key) == STAGE_MEDIA
+        if stat.st_size < self._multipart_threshold:
+            etag = self._bucket.put_object(name, path.read_bytes(), headers)
+        else:
+            etag = self._upload_multipart(name, path, stat.st_size, headers,
+                                          parts, drop)
+        if drop:
+            # also what the readahead brought in past the parts
+            evict([path])
+        with self._lock:
+            self._published[key] = [stat.st_size, stat.st_mtime_ns, etag]
+        echo(f"Uploaded {name}")
+
+    def _upload_multipart(
+        self,
+        name: str,
+        path: pathlib.Path,
+        size: int,
+        headers: t.Dict[str, str],
+        parts: ThreadPoolExecutor,
+        drop: bool = False
+    ) -> str:
+        upload_id = self._bucket.create_multipart_upload(name, headers)
+        try:
+            with open(path, "rb") as fp:
+                fd = fp.fileno()
+                advise_sequential(fd)
+                futures = [
+                    parts.submit(
+                        self._upload_part, name, upload_id, number, fd,
+                        offset, min(self._part_size, size - offset), drop
+                    )
+                    for number, offset in enumerate(
+                        range(0, size, self._part_size), 1
+                    )
+                ]
+                try:
+                    etags = [future.result() for future in futures]
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+            return self._bucket.complete_multipart_upload(
+                name, upload_id, etags
+            )
+        except BaseException:
+            try:
+                self._bucket.abort_multipart_upload(name, upload_id)
+            except PublishError as exc:
+                secho(f"Abort of {name} failed: {exc}", fg="red")
+            raise
+
+    def _upload_part(
+        self,
+        name: str,
+        upload_id: str,
+        number: int,
+        fd: int,
+        offset: int,
+        length: int,
+        drop: bool = False
+    ) -> str:
+        # pread: parts of the same file are read from several threads
+        body = os.pread(fd, length, offset)
+        if drop:
+            drop_range(fd, offset, length)
+        return self._bucket.upload_part(name, upload_id, number, body)
@@ -0,0 +1,240 @@
+import os
+import pathlib
+import shutil
+import threading
+import time
+import typing as t
+from concurrent.futures import Executor
+
+from click import secho
+
+from .exceptions import ShelfError
+
+if t.TYPE_CHECKING:
+    from .telemetry import Telemetry
+
+IONICE_CLASSES = {
+    "realtime": 1,
+    "best-effort": 2,
+    "idle": 3,
+}
+
+# headroom kept free on top of a job's expected output, for the moov atom,
+# temp files and everything else that writes to the same disk
+SPACE_MARGIN = 64 * 1024 * 1024
+
+
+class NotEnoughSpace(ShelfError):
+    """Raised if a job's output can never fit on its target device"""
+
+
+class Priority:
+    """CPU (nice) and I/O (ionice) priority for spawned processes
+
+    Applied by prefixing commands with `nice`/`ionice`, so it covers ffmpeg
+    and nothing else. Missing tools are skipped with a warning.
+    """
+
+    def __init__(
+        self,
+        nice: t.Optional[int] = None,
+        ionice_class: t.Optional[str] = None,
+        ionice_level: t.Optional[int] = None
+    ) -> None:
+        if ionice_class is not None and ionice_class not in IONICE_CLASSES:
+            raise ShelfError(
+                f"ionice class must be one of {', '.join(IONICE_CLASSES)}"
+            )
+        self._prefix: t.List[str] = []
+        if ionice_class is not None:
+            if shutil.which("ionice"):
+                self._prefix.extend(
+                    ["ionice", "-c", str(IONICE_CLASSES[ionice_class])]
+                )
+                if ionice_level is not None and ionice_class != "idle":
+                    self._prefix.extend(["-n", str(ionice_level)])
+            else:
+                secho("ionice not found, ignoring I/O priority", fg="yellow")
+        if nice is not None:
+            if shutil.which("nice"):
+                self._prefix.extend(["nice", "-n", str(nice)])
+            else:
+                secho("nice not found, ignoring CPU priority", fg="yellow")
+
+    def wrap(self, cmd: t.List[str]) -> t.List[str]:
+        return self._prefix + list(cmd)
+
+    def __bool__(self) -> bool:
+        return bool(self._prefix)
+
+
+class Job:
+    """One unit of work for the `Scheduler`
+
+    KIND is "io" for jobs bound by disk throughput (stream-copy remux),
+    "cpu" for jobs bound by the CPU (scaling covers). INPUTS and OUTPUT_DIR
+    decide which devices the job occupies; EXPECTED_OUTPUT_SIZE is reserved
+    on OUTPUT_DIR's device before the job starts. CATEGORY ("decrypt",
+    "cover", ...) groups jobs for telemetry.
+    """
+
+    def __init__(
+        self,
+        run: t.Callable[[], t.Any],
+        kind: str,
+        inputs: t.Iterable[pathlib.Path],
+        output_dir: pathlib.Path,
+        expected_output_size: int = 0,
+        name: t.Optional[str] = None,
+        category: t.Optional[str] = None
+    ) -> None:
+        if kind not in ("io", "cpu"):
+            raise ValueError(f"unknown job kind {kind}")
+        self.run = run
+        self.kind = kind
+        self.category = category or kind
+        self.inputs = [pathlib.Path(i) for i in inputs]
+        self.output_dir = pathlib.Path(output_dir)
+        self.expected_output_size = expected_output_size
+        self.name = name or (str(self.inputs[0]) if self.inputs else kind)
+
+        self.input_size = sum(
+            i.stat().st_size for i in self.inputs if i.exists()
+        )
+        self.output_device = self.output_dir.stat().st_dev
+        self.devices = frozenset(
+            {i.stat().st_dev for i in self.inputs if i.exists()}
+            | {self.output_device}
+        )
+
+    def __repr__(self) -> str:
+        return f"<Job {self.kind} {self.name}>"
+
+
+class Scheduler:
+    """Run jobs ordered by size, limited per device, with space checks
+
+    Jobs run largest input first, which keeps one huge book from starting
+    last and stretching the whole run. At most IO_PER_DEVICE "io" jobs touch
+    any one device (`st_dev`) at a time and at most CPU_WORKERS "cpu" jobs
+    run at once; JOBS caps the total. A job only starts if its device has
+    room for its expected output plus what running jobs still reserve.
+
+    Without an executor jobs run one by one in the calling thread, in the
+    same order and with the same space checks. With TELEMETRY, the
+    throughput of every job that had work to do is recorded.
+    """
+
+    def __init__(
+        self,
+        executor: t.Optional[Executor] = None,
+        jobs: int = 1,
+        io_per_device: int = 2,
+        cpu_workers: t.Optional[int] = None,
+        space_margin: int = SPACE_MARGIN,
+        telemetry: t.Optional["Telemetry"] = None
+    ) -> None:
+        self._executor = executor
+        self._jobs = max(1, jobs if executor is not None else 1)
+        self._io_per_device = max(1, io_per_device)
+        self._cpu_workers = max(1, cpu_workers or os.cpu_count() or 1)
+        self._space_margin = space_margin
+        self._telemetry = telemetry
+
+        self._cond = threading.Condition()
+        self._running: t.List[Job] = []
+        self._reserved: t.Dict[int, int] = {}
+
+    def _free_space(self, job: Job) -> int:
+        return shutil.disk_usage(job.output_dir).free \
+            - self._reserved.get(job.output_device, 0)
+
+    def _fits(self, job: Job) -> bool:
+        needed = job.expected_output_size + self._space_margin
+        return job.expected_output_size == 0 or self._free_space(job) >= needed
+
+    def _can_start(self, job: Job) -> bool:
+        if len(self._running) >= self._jobs:
+            return False
+        if job.kind == "cpu":
+            running_cpu = sum(1 for r in self._running if r.kind == "cpu")
+            if running_cpu >= self._cpu_workers:
+                return False
+        else:
+            for device in job.devices:
+                running_io = sum(
+                    1 for r in self._running
+                    if r.kind == "io" and device in r.devices
+                )
+                if running_io >= self._io_per_device:
+                    return False
+        return self._fits(job)
+
+    def _start(self, job: Job) -> None:
+        self._running.append(job)
+        self._reserved[job.output_device] = \
+            self._reserved.get(job.output_device, 0) \
+            + job.expected_output_size
+
+    def _finish(self, job: Job) -> None:
+        with self._cond:
+            self._running.remove(job)
+            self._reserved[job.output_device] -= job.expected_output_size
+            self._cond.notify_all()
+
+    def _run_job(self, job: Job, results: t.Dict[int, t.Any]) -> None:
+        start = time.monotonic()
+        try:
+            job.run()
+        except BaseException as exc:  # noqa: B902
+            results[id(job)] = exc
+        else:
+            results[id(job)] = None
+            # jobs without expected output found nothing to do
+            if self._telemetry is not None and job.expected_output_size:
+                self._telemetry.record(
+                    job.category, job.input_size, time.monotonic() - start
+                )
+        finally:
+            self._finish(job)
+
+    def run(
+        self,
+        jobs: t.Iterable[Job]
+    ) -> t.List[t.Tuple[Job, t.Optional[BaseException]]]:
+        """Run JOBS, return every job with the exception it raised, if any"""
+        jobs = list(jobs)
+        pending = sorted(jobs, key=lambda j: j.input_size, reverse=True)
+        results: t.Dict[int, t.Optional[BaseException]] = {}
+
+        with self._cond:
+            while pending:
+                job = next((j for j in pending if self._can_start(j)), None)
+                if job is None:
+                    if not self._running:
+                        # nothing will free up space, give up on the rest
+                        for j in pending:
+                            results[id(j)] = NotEnoughSpace(
+                                f"{j.name}: needs "
+                                f"{j.expected_output_size} bytes, only "
+                                f"{self._free_space(j)} free"
+                            )
+                        break
+                    self._cond.wait()
+                    continue
+
+                pending.remove(job)
+                self._start(job)
+                if self._executor is None:
+                    self._cond.release()
+                    try:
+                        self._run_job(job, results)
+                    finally:
+                        self._cond.acquire()
+                else:
+                    self._executor.submit(self._run_job, job, results)
+
+            while self._running:
+                self._cond.wait()
+
+        return [(job, results.get(id(job))) for job in jobs]
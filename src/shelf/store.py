@@ -0,0 +1,191 @@
+import errno
+import fcntl
+import json
+import os
+import pathlib
+import shutil
+import threading
+import typing as t
+import uuid
+
+from .pagecache import file_digest
+
+# below the assets folder, so objects and their names share a filesystem
+STORE_DIR = ".shelf-objects"
+
+# ioctl cloning a file's extents (btrfs, xfs), from linux/fs.h
+_FICLONE = 0x40049409
+
+
+class ContentStore:
+    """Decrypted media and covers stored once, by content hash
+
+    Every file put in the store becomes a hardlink of its object,
+    `objects/<ab>/<sha256>` below DIRECTORY, so copies of one book (a
+    re-download under a new codec suffix, a second account) take the disk
+    space and page cache of one file. Where hardlinks fail, names are
+    reflinks, or copies as a last resort.
+
+    `inputs/<fingerprint>.json` remembers what an input (see
+    `FfmpegFileDecrypter.fingerprint`) turned into, so the same input is
+    linked to its new names instead of decrypted again.
+
+    An object whose names are hardlinks is in use while it has more than
+    one link. Names that are reflinks or copies are listed in
+    `copies/<sha256>.json` instead, and keep their object while one of
+    them is left.
+    """
+
+    def __init__(self, directory: t.Union[pathlib.Path, str]) -> None:
+        self.directory = pathlib.Path(directory)
+        (self.directory / "objects").mkdir(parents=True, exist_ok=True)
+        (self.directory / "inputs").mkdir(exist_ok=True)
+        (self.directory / "copies").mkdir(exist_ok=True)
+        self._lock = threading.Lock()
+
+    def object_path(self, digest: str) -> pathlib.Path:
+        return self.directory / "objects" / digest[:2] / digest
+
+    def put(self, file: pathlib.Path) -> str:
+        """Store FILE, making it a link of its object; its sha256"""
+        # dropped from the cache along with the rest of the job's output
+        digest = file_digest(file, drop=False)
+        obj = self.object_path(digest)
+        obj.parent.mkdir(exist_ok=True)
+        try:
+            os.link(file, obj)
+        except FileExistsError:
+            if not obj.samefile(file) and not _link(obj, file):
+                self._add_copy(digest, file)
+        except OSError as exc:
+            if exc.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            if not _link(file, obj):
+                self._add_copy(digest, file)
+        return digest
+
+    def record(
+        self,
+        fingerprint: str,
+        outputs: t.Dict[str, pathlib.Path]
+    ) -> None:
+        """Store OUTPUTS (role: file), made from the input FINGERPRINT"""
+        digests = {role: self.put(file) for role, file in outputs.items()}
+        record = self._input_path(fingerprint)
+        tmpfile = record.with_name(f".{record.name}.{uuid.uuid4().hex}.tmp")
+        tmpfile.write_text(json.dumps(digests))
+        os.replace(tmpfile, record)
+
+    def restore(
+        self,
+        fingerprint: str,
+        outputs: t.Dict[str, pathlib.Path]
+    ) -> bool:
+        """Link OUTPUTS from the objects the input FINGERPRINT made
+
+        False, and nothing linked, unless every role of OUTPUTS was
+        recorded for that input and its object is still stored.
+        """
+        try:
+            digests = json.loads(self._input_path(fingerprint).read_text())
+        except (OSError, ValueError):
+            return False
+        if not set(outputs) <= set(digests):
+            return False
+        objects = {role: self.object_path(digests[role]) for role in outputs}
+        if not all(obj.exists() for obj in objects.values()):
+            return False
+        for role, file in outputs.items():
+            if not _link(objects[role], file):
+                self._add_copy(digests[role], file)
+        return True
+
+    def prune(self) -> int:
+        """Remove objects no asset links to anymore, return how many"""
+        removed = 0
+        with os.scandir(self.directory / "objects") as shards:
+            for shard in shards:
+                if not shard.is_dir():
+                    continue
+                with os.scandir(shard.path) as entries:
+                    for entry in entries:
+                        stat = entry.stat()
+                        if stat.st_nlink == 1 \
+                                and not self._has_copies(entry.name, stat):
+                            os.unlink(entry.path)
+                            removed += 1
+        return removed
+
+    def _input_path(self, fingerprint: str) -> pathlib.Path:
+        return self.directory / "inputs" / f"{fingerprint}.json"
+
+    def _copies_path(self, digest: str) -> pathlib.Path:
+        return self.directory / "copies" / f"{digest}.json"
+
+    def _read_copies(self, digest: str) -> t.List[str]:
+        try:
+            return json.loads(self._copies_path(digest).read_text())
+        except (OSError, ValueError):
+            return []
+
+    def _write_copies(self, digest: str, copies: t.List[str]) -> None:
+        path = self._copies_path(digest)
+        if not copies:
+            path.unlink(missing_ok=True)
+            return
+        tmpfile = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        tmpfile.write_text(json.dumps(sorted(copies)))
+        os.replace(tmpfile, path)
+
+    def _add_copy(self, digest: str, file: pathlib.Path) -> None:
+        """Remember FILE as a reflink or copy of object DIGEST"""
+        with self._lock:
+            copies = set(self._read_copies(digest))
+            copies.add(str(file.resolve()))
+            self._write_copies(digest, list(copies))
+
+    def _has_copies(self, digest: str, stat: os.stat_result) -> bool:
+        """Whether a reflink or copy of object DIGEST (STAT) is left
+
+        Names that are gone or changed size are forgotten.
+        """
+        with self._lock:
+            copies = self._read_copies(digest)
+            left = []
+            for copy in copies:
+                try:
+                    if os.stat(copy).st_size == stat.st_size:
+                        left.append(copy)
+                except OSError:
+                    pass
+            if left != copies:
+                self._write_copies(digest, left)
+            return bool(left)
+
+
+def _link(source: pathlib.Path, target: pathlib.Path) -> bool:
+    """Replace TARGET by a hardlink, else a reflink or copy, of SOURCE
+
+    Returns whether it is a hardlink.
+    """
+    tmpfile = target.with_name(f".{target.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        try:
+            os.link(source, tmpfile)
+            hardlink = True
+        except OSError:
+            _reflink_or_copy(source, tmpfile)
+            hardlink = False
+        os.replace(tmpfile, target)
+    finally:
+        tmpfile.unlink(missing_ok=True)
+    return hardlink
+
+
+def _reflink_or_copy(source: pathlib.Path, target: pathlib.Path) -> None:
+    with source.open("rb") as src, target.open("wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+        except OSError:
+            shutil.copyfileobj(src, dst)
+    shutil.copystat(source, target)
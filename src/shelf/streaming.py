@@ -0,0 +1,52 @@
+import pathlib
+import typing as t
+
+HLS_PLAYLIST = "index.m3u8"
+HLS_INIT = "init.mp4"
+HLS_MIME_TYPE = "application/vnd.apple.mpegurl"
+
+# short enough for quick seeks, long enough to keep request counts down
+HLS_SEGMENT_SECONDS = 10
+
+FASTSTART_ARGS = ["-movflags", "+faststart"]
+
+
+def get_hls_dir(file: pathlib.Path, target_dir: pathlib.Path) -> pathlib.Path:
+    """Folder of the HLS package of FILE, e.g. `B0..._Title-AAX_44_128.hls`"""
+    return target_dir / file.with_suffix(".hls").name
+
+
+def hls_output_args(
+    package_dir: pathlib.Path,
+    input_index: int = 0,
+    segment_seconds: int = HLS_SEGMENT_SECONDS
+) -> t.List[str]:
+    """Output options writing input INPUT_INDEX's audio as fMP4 HLS
+
+    Segments are cut from the stream copy, so this adds no decoding to the
+    process it is part of.
+    """
+    return [
+        "-map",
+        f"{input_index}:a:0",
+        "-c",
+        "copy",
+        "-f",
+        "hls",
+        "-hls_time",
+        str(segment_seconds),
+        "-hls_playlist_type",
+        "vod",
+        "-hls_segment_type",
+        "fmp4",
+        "-hls_fmp4_init_filename",
+        HLS_INIT,
+        "-hls_segment_filename",
+        str(package_dir / "seg_%05d.m4s"),
+        str(package_dir / HLS_PLAYLIST),
+    ]
+
+
+def hls_size(package_dir: pathlib.Path) -> int:
+    """Bytes a client downloads to play the whole package"""
+    return sum(f.stat().st_size for f in package_dir.iterdir() if f.is_file())
@@ -0,0 +1,82 @@
+import json
+import os
+import pathlib
+import threading
+import typing as t
+
+# bytes per second of input, until runs on this machine say otherwise
+DEFAULT_RATES = {
+    # stream copy, bound by the disk
+    "decrypt": 100 * 1024 * 1024,
+    "batch": 100 * 1024 * 1024,
+    # decode, scale and encode one jpeg
+    "cover": 2 * 1024 * 1024,
+    # decode and encode a whole book
+    "variant": 3 * 1024 * 1024,
+    # ffprobe reads little more than the header
+    "probe": 20 * 1024 * 1024,
+    "render": 1024 * 1024,
+}
+
+# weight of the newest run in the moving average
+SMOOTHING = 0.3
+
+
+def default_path() -> pathlib.Path:
+    if "SHELF_TELEMETRY" in os.environ:
+        return pathlib.Path(os.environ["SHELF_TELEMETRY"])
+    state_home = os.environ.get("XDG_STATE_HOME") \
+        or pathlib.Path.home() / ".local" / "state"
+    return pathlib.Path(state_home) / "shelf" / "telemetry.json"
+
+
+class Telemetry:
+    """Throughput of past jobs per category, to estimate the next ones
+
+    Keeps an exponential moving average of bytes per second for every job
+    category ("decrypt", "cover", "variant", "probe", ...) in a small JSON
+    file. Without a PATH nothing is loaded or saved.
+    """
+
+    def __init__(self, path: t.Optional[pathlib.Path] = None) -> None:
+        self._path = path
+        self._lock = threading.Lock()
+        self._rates: t.Dict[str, float] = {}
+        self._dirty = False
+        if path is not None and path.exists():
+            try:
+                self._rates = {
+                    k: float(v)
+                    for k, v in json.loads(path.read_text()).items()
+                }
+            except (OSError, ValueError, AttributeError):
+                self._rates = {}
+
+    def rate(self, category: str) -> float:
+        return self._rates.get(category) or DEFAULT_RATES.get(
+            category, DEFAULT_RATES["decrypt"]
+        )
+
+    def estimate(self, category: str, size: int) -> float:
+        """Seconds a CATEGORY job over SIZE input bytes should take"""
+        return size / self.rate(category)
+
+    def record(self, category: str, size: int, seconds: float) -> None:
+        if size <= 0 or seconds <= 0:
+            return
+        observed = size / seconds
+        with self._lock:
+            old = self._rates.get(category)
+            self._rates[category] = observed if old is None \
+                else old + SMOOTHING * (observed - old)
+            self._dirty = True
+
+    def save(self) -> None:
+        with self._lock:
+            if self._path is None or not self._dirty:
+                return
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            tmpfile = self._path.with_name(f".{self._path.name}.tmp")
+            tmpfile.write_text(json.dumps(self._rates, indent=2))
+            os.replace(tmpfile, self._path)
+            self._dirty = False
@@ -0,0 +1,191 @@
+import os
+import pathlib
+import re
+import subprocess  # noqa: S404
+import typing as t
+
+from click import echo
+
+from .exceptions import ShelfError
+from .scheduler import Priority
+from .streaming import FASTSTART_ARGS
+
+if t.TYPE_CHECKING:
+    from .layout import Layout
+
+# codec name in a variant spec: (ffmpeg encoder, muxer)
+CODECS = {
+    "aac": ("aac", "ipod"),
+    "opus": ("libopus", "mp4"),
+}
+
+_SPEC = re.compile(r"\A(?P<codec>[a-z]+)-(?P<kbps>[0-9]+)k\Z")
+
+
+class Variant:
+    """A smaller encoding of every book, e.g. `opus-32k` or `aac-64k`
+
+    Variants are written as `.m4a` (MP4 container, chapters and tags kept)
+    into a folder named after the variant, next to the full files, laid
+    out the same way as they are.
+    """
+
+    def __init__(self, codec: str, kbps: int) -> None:
+        if codec not in CODECS:
+            raise ShelfError(
+                f"unknown codec {codec}, use one of {', '.join(CODECS)}"
+            )
+        if kbps <= 0:
+            raise ShelfError("variant bitrate must be positive")
+        self.codec = codec
+        self.kbps = kbps
+
+    @classmethod
+    def parse(cls, spec: str) -> "Variant":
+        match = _SPEC.match(spec.strip().lower())
+        if not match:
+            raise ShelfError(
+                f"invalid variant {spec}, expected e.g. opus-32k or aac-64k"
+            )
+        return cls(match.group("codec"), int(match.group("kbps")))
+
+    @property
+    def name(self) -> str:
+        return f"{self.codec}-{self.kbps}k"
+
+    def outfile(
+        self,
+        source: pathlib.Path,
+        target_dir: pathlib.Path,
+        layout: t.Optional["Layout"] = None
+    ) -> pathlib.Path:
+        directory = target_dir / self.name
+        if layout is not None:
+            directory = layout.directory(directory, source)
+        return directory / source.with_suffix(".m4a").name
+
+    def output_args(
+        self,
+        outfile: pathlib.Path,
+        input_index: int = 0,
+        faststart: bool = False
+    ) -> t.List[str]:
+        encoder, muxer = CODECS[self.codec]
+        movflags = FASTSTART_ARGS if faststart else []
+        return movflags + [
+            "-map",
+            f"{input_index}:a:0",
+            "-map",
+            f"{input_index}:v:0?",
+            "-map_metadata",
+            str(input_index),
+            "-map_chapters",
+            str(input_index),
+            "-c:a",
+            encoder,
+            "-b:a",
+            f"{self.kbps}k",
+            "-c:v",
+            "copy",
+            "-f",
+            muxer,
+            str(outfile),
+        ]
+
+    def expected_size(self, duration: float) -> int:
+        # bitrate plus a little for container, cover and chapters
+        return int(self.kbps * 1000 / 8 * duration * 1.05)
+
+    def __repr__(self) -> str:
+        return f"<Variant {self.name}>"
+
+
+class VariantEncoder:
+    """Encode all VARIANTS of one decrypted book in one ffmpeg process
+
+    The book is decoded once and the decoded audio fed to every encoder.
+    Outputs are written under a temporary name and renamed when done, so
+    `audible rss --watch` never sees a half-written variant.
+    """
+
+    def __init__(
+        self,
+        source: pathlib.Path,
+        variants: t.Iterable[Variant],
+        target_dir: t.Optional[pathlib.Path] = None,
+        overwrite: bool = False,
+        faststart: bool = False,
+        priority: t.Optional[Priority] = None,
+        layout: t.Optional["Layout"] = None
+    ) -> None:
+        self._source = source
+        self._variants = list(variants)
+        self._layout = layout
+        if target_dir is None:
+            target_dir = layout.root(source) if layout is not None \
+                else source.parent
+        self._target_dir = target_dir
+        self._overwrite = overwrite
+        self._faststart = faststart
+        self._priority = priority or Priority()
+
+    @property
+    def source(self) -> pathlib.Path:
+        return self._source
+
+    @property
+    def target_dir(self) -> pathlib.Path:
+        return self._target_dir
+
+    def outputs(self) -> t.List[t.Tuple[Variant, pathlib.Path]]:
+        return [
+            (v, v.outfile(self._source, self._target_dir, self._layout))
+            for v in self._variants
+        ]
+
+    def pending(self) -> t.List[t.Tuple[Variant, pathlib.Path]]:
+        return [
+            (v, outfile) for v, outfile in self.outputs()
+            if self._overwrite or not outfile.exists()
+        ]
+
+    def is_needed(self) -> bool:
+        return bool(self.pending())
+
+    def expected_output_size(self, duration: float) -> int:
+        return sum(v.expected_size(duration) for v, _ in self.pending())
+
+    def run(self) -> None:
+        pending = self.pending()
+        if not pending:
+            return
+
+        base_cmd = [
+            "ffmpeg",
+            "-v",
+            "error",
+            "-y",
+            "-i",
+            str(self._source),
+        ]
+        temp_files = []
+        for variant, outfile in pending:
+            outfile.parent.mkdir(parents=True, exist_ok=True)
+            temp = outfile.with_name(f".{outfile.name}.tmp")
+            temp_files.append((temp, outfile))
+            base_cmd.extend(
+                variant.output_args(temp, faststart=self._faststart)
+            )
+
+        try:
+            subprocess.check_output(  # noqa: S603
+                self._priority.wrap(base_cmd), text=True
+            )
+            for temp, outfile in temp_files:
+                os.replace(temp, outfile)
+        finally:
+            for temp, _ in temp_files:
+                temp.unlink(missing_ok=True)
+
+        names = ", ".join(v.name for v, _ in pending)
+        echo(f"Variants encoded: {self._source.name} ({names})")
@@ -0,0 +1,321 @@
+import mmap
+import pathlib
+import random
+import struct
+import subprocess  # noqa: S404
+import typing as t
+from array import array
+
+from .scheduler import Priority
+
+# boxes whose payload is nothing but child boxes
+CONTAINER_BOXES = {
+    b"moov", b"trak", b"mdia", b"minf", b"stbl", b"udta", b"edts", b"dinf",
+    b"ilst", b"tref",
+}
+
+# allowed share of mdat bytes not referenced by any sample table
+MAX_UNCOVERED = 0.001
+# `chpl` counts chapters in 8 bits, ffmpeg writes no more than this there
+CHPL_MAX = 255
+
+
+class Box:
+    __slots__ = ("type", "start", "payload", "end")
+
+    def __init__(self, type_: bytes, start: int, payload: int, end: int):
+        self.type = type_
+        self.start = start
+        self.payload = payload
+        self.end = end
+
+
+def _iter_boxes(buf, start: int, end: int) -> t.Iterator[Box]:
+    offset = start
+    while offset + 8 <= end:
+        size, type_ = struct.unpack_from(">I4s", buf, offset)
+        header = 8
+        if size == 1:
+            (size,) = struct.unpack_from(">Q", buf, offset + 8)
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            raise ValueError(f"invalid {type_!r} box at {offset}")
+        yield Box(type_, offset, offset + header, offset + size)
+        offset += size
+
+
+def _children(buf, box: Box) -> t.List[Box]:
+    start = box.payload
+    if box.type == b"meta":
+        start += 4  # full box, version and flags come first
+    return list(_iter_boxes(buf, start, box.end))
+
+
+def _find(buf, box: Box, *path: bytes) -> t.Optional[Box]:
+    for child in _children(buf, box):
+        if child.type == path[0]:
+            return child if len(path) == 1 else _find(buf, child, *path[1:])
+    return None
+
+
+def _uint32_table(buf, offset: int, count: int) -> array:
+    table = array("I", bytes(buf[offset:offset + 4 * count]))
+    if table.itemsize != 4:
+        raise RuntimeError("array('I') is not 32 bit here")
+    if struct.pack("=I", 1) != struct.pack(">I", 1):
+        table.byteswap()
+    return table
+
+
+class Mp4Index:
+    """The parts of an MP4's index needed to tell if it is intact
+
+    Only the box structure and sample tables are read, never the media,
+    so this costs a few page faults per file no matter how long the book.
+    """
+
+    def __init__(self, buf, file_size: int) -> None:
+        self.file_size = file_size
+        self.mdat: t.List[t.Tuple[int, int]] = []
+        self.duration_ms: t.Optional[int] = None
+        self.tracks: t.List[t.Dict[str, t.Any]] = []
+        self.chapter_count: t.Optional[int] = None
+        # only the capped `chpl` count is known, there may be more
+        self.chapters_capped = False
+        self.tags: t.Set[bytes] = set()
+
+        moov = None
+        for box in _iter_boxes(buf, 0, file_size):
+            if box.end > file_size:
+                raise ValueError(f"{box.type!r} box runs past end of file")
+            if box.type == b"moov":
+                moov = box
+            elif box.type == b"mdat":
+                self.mdat.append((box.payload, box.end))
+        if moov is None:
+            raise ValueError("no moov box")
+
+        mvhd = _find(buf, moov, b"mvhd")
+        if mvhd is not None:
+            self.duration_ms = self._duration_ms(buf, mvhd.payload)
+
+        for box in _children(buf, moov):
+            if box.type == b"trak":
+                self.tracks.append(self._parse_track(buf, box))
+
+        # the chapter text track has a sample per chapter, however many
+        text = [tr for tr in self.tracks if tr["handler"] == b"text"]
+        chpl = _find(buf, moov, b"udta", b"chpl")
+        if text:
+            self.chapter_count = text[0]["sample_count"]
+        elif chpl is not None:
+            # version/flags, 4 reserved bytes, then an 8 bit count
+            self.chapter_count = buf[chpl.payload + 8]
+            self.chapters_capped = self.chapter_count == CHPL_MAX
+
+        ilst = _find(buf, moov, b"udta", b"meta", b"ilst")
+        if ilst is not None:
+            self.tags = {box.type for box in _children(buf, ilst)}
+
+    @classmethod
+    def from_file(cls, file: t.Union[pathlib.Path, str]) -> "Mp4Index":
+        with open(file, "rb") as fp:
+            size = pathlib.Path(file).stat().st_size
+            if size == 0:
+                raise ValueError("empty file")
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                if hasattr(mmap, "MADV_RANDOM"):
+                    buf.madvise(mmap.MADV_RANDOM)
+                return cls(buf, size)
+
+    @staticmethod
+    def _duration_ms(buf, offset: int) -> int:
+        version = buf[offset]
+        if version == 1:
+            timescale, duration = struct.unpack_from(">IQ", buf, offset + 20)
+        else:
+            timescale, duration = struct.unpack_from(">II", buf, offset + 12)
+        return round(duration * 1000 / timescale) if timescale else 0
+
+    def _parse_track(self, buf, trak: Box) -> t.Dict[str, t.Any]:
+        track = {"handler": None, "duration_ms": None, "sample_count": 0,
+                 "chunks": []}
+        mdia = _find(buf, trak, b"mdia")
+        if mdia is None:
+            return track
+        hdlr = _find(buf, mdia, b"hdlr")
+        if hdlr is not None:
+            track["handler"] = bytes(buf[hdlr.payload + 8:hdlr.payload + 12])
+        mdhd = _find(buf, mdia, b"mdhd")
+        if mdhd is not None:
+            track["duration_ms"] = self._duration_ms(buf, mdhd.payload)
+        stbl = _find(buf, mdia, b"minf", b"stbl")
+        if stbl is None:
+            return track
+
+        stsz = _find(buf, stbl, b"stsz")
+        stsc = _find(buf, stbl, b"stsc")
+        stco = _find(buf, stbl, b"stco")
+        co64 = _find(buf, stbl, b"co64")
+        if stsz is None or stsc is None or (stco is None and co64 is None):
+            return track
+
+        sample_size, sample_count = struct.unpack_from(
+            ">II", buf, stsz.payload + 4
+        )
+        track["sample_count"] = sample_count
+        sizes = None
+        if sample_size == 0:
+            sizes = _uint32_table(buf, stsz.payload + 12, sample_count)
+
+        if stco is not None:
+            (count,) = struct.unpack_from(">I", buf, stco.payload + 4)
+            offsets = list(_uint32_table(buf, stco.payload + 8, count))
+        else:
+            (count,) = struct.unpack_from(">I", buf, co64.payload + 4)
+            offsets = list(struct.unpack_from(
+                f">{count}Q", buf, co64.payload + 8
+            ))
+
+        (entries,) = struct.unpack_from(">I", buf, stsc.payload + 4)
+        stsc_table = _uint32_table(buf, stsc.payload + 8, entries * 3)
+        runs = [
+            (stsc_table[i], stsc_table[i + 1])
+            for i in range(0, len(stsc_table), 3)
+        ]
+
+        sample = 0
+        chunks = []
+        for index, (first_chunk, per_chunk) in enumerate(runs):
+            last_chunk = runs[index + 1][0] - 1 if index + 1 < len(runs) \
+                else len(offsets)
+            for chunk in range(first_chunk, last_chunk + 1):
+                if chunk > len(offsets) or sample >= sample_count:
+                    break
+                n = min(per_chunk, sample_count - sample)
+                if sizes is None:
+                    size = n * sample_size
+                else:
+                    size = sum(sizes[sample:sample + n])
+                chunks.append((offsets[chunk - 1], size))
+                sample += n
+        track["chunks"] = chunks
+        return track
+
+    def problems(self) -> t.List[str]:
+        """Structural problems: sample tables vs. mdat"""
+        problems = []
+        if not self.mdat:
+            return ["no mdat box"]
+
+        covered = 0
+        for track in self.tracks:
+            for offset, size in track["chunks"]:
+                inside = any(
+                    start <= offset and offset + size <= end
+                    for start, end in self.mdat
+                )
+                if not inside:
+                    problems.append(
+                        f"{track['handler']!r} chunk at {offset} (+{size}) "
+                        "outside mdat, truncated?"
+                    )
+                    break
+                covered += size
+        payload = sum(end - start for start, end in self.mdat)
+        if payload and (payload - covered) / payload > MAX_UNCOVERED:
+            problems.append(
+                f"sample tables cover {covered} of {payload} mdat bytes"
+            )
+        if not any(tr["handler"] == b"soun" for tr in self.tracks):
+            problems.append("no audio track")
+        return problems
+
+
+class VerifyResult:
+    def __init__(self, file: pathlib.Path, problems: t.List[str]) -> None:
+        self.file = file
+        self.problems = problems
+
+    @property
+    def ok(self) -> bool:
+        return not self.problems
+
+    def __repr__(self) -> str:
+        return f"<VerifyResult {self.file.name} ok={self.ok}>"
+
+
+def verify_file(
+    file: t.Union[pathlib.Path, str],
+    runtime_length_ms: t.Optional[int] = None,
+    chapter_count: t.Optional[int] = None,
+    require_episode_id: bool = False,
+    tolerance_ms: int = 2000
+) -> VerifyResult:
+    """Check FILE's index against what the voucher says it should hold"""
+    file = pathlib.Path(file)
+    try:
+        index = Mp4Index.from_file(file)
+    except (OSError, ValueError, struct.error, IndexError) as exc:
+        return VerifyResult(file, [f"unreadable: {exc}"])
+
+    problems = index.problems()
+    if runtime_length_ms is not None:
+        durations = [
+            tr["duration_ms"] for tr in index.tracks
+            if tr["handler"] == b"soun"
+        ] or [index.duration_ms]
+        duration = durations[0] or 0
+        if abs(duration - runtime_length_ms) > tolerance_ms:
+            problems.append(
+                f"duration {duration}ms, expected {runtime_length_ms}ms"
+            )
+    if chapter_count is not None and index.chapter_count != chapter_count \
+            and not (index.chapters_capped
+                     and chapter_count > index.chapter_count):
+        problems.append(
+            f"{index.chapter_count} chapters, expected {chapter_count}"
+        )
+    if require_episode_id and b"tven" not in index.tags:
+        problems.append("no episode_id tag")
+    return VerifyResult(file, problems)
+
+
+def sample_decode(
+    file: t.Union[pathlib.Path, str],
+    duration_ms: int,
+    samples: int = 3,
+    seconds: int = 10,
+    priority: t.Optional[Priority] = None
+) -> t.List[str]:
+    """Decode SAMPLES random SECONDS-long windows, return decoder errors"""
+    priority = priority or Priority()
+    problems = []
+    span = max(0, duration_ms // 1000 - seconds)
+    for _ in range(samples):
+        position = random.randint(0, span) if span else 0  # noqa: S311
+        base_cmd = [
+            "ffmpeg",
+            "-v",
+            "error",
+            "-ss",
+            str(position),
+            "-t",
+            str(seconds),
+            "-i",
+            str(file),
+            "-map",
+            "0:a:0",
+            "-f",
+            "null",
+            "-",
+        ]
+        child = subprocess.run(  # noqa: S603
+            priority.wrap(base_cmd), capture_output=True, text=True
+        )
+        if child.returncode != 0 or child.stderr.strip():
+            error = child.stderr.strip().splitlines()[:1] or ["failed"]
+            problems.append(f"decode at {position}s: {error[0]}")
+    return problems
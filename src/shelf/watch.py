@@ -0,0 +1,313 @@
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import pathlib
+import select
+import struct
+import sys
+import time
+import typing as t
+
+from click import echo, secho
+
+from .exceptions import ShelfError
+from .feed import EpisodeCreator, FeedOptions
+from .files import MediaFiles
+
+if t.TYPE_CHECKING:
+    from .core import Shelf
+
+# from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# a file is done once it was closed after writing, or renamed into place
+# (audible-cli downloads to a temporary name first)
+IN_WRITTEN = IN_CLOSE_WRITE | IN_MOVED_TO
+IN_GONE = IN_DELETE | IN_MOVED_FROM
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """Minimal ctypes binding for inotify(7), no dependencies"""
+
+    def __init__(self) -> None:
+        if not sys.platform.startswith("linux"):
+            raise ShelfError("watch mode needs inotify, i.e. Linux")
+
+        # musl (alpine) may not resolve "c", the running binary has it too
+        self._libc = ctypes.CDLL(
+            ctypes.util.find_library("c"), use_errno=True
+        )
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._watches: t.Dict[int, pathlib.Path] = {}
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def add_watch(self, path: t.Union[pathlib.Path, str], mask: int) -> int:
+        path = pathlib.Path(path).resolve()
+        wd = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(path), ctypes.c_uint32(mask)
+        )
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), str(path))
+        self._watches[wd] = path
+        return wd
+
+    def read(self) -> t.List[t.Tuple[pathlib.Path, int]]:
+        """Return (path, mask) of all queued events, without blocking"""
+        try:
+            buf = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(buf, offset)
+            offset += _EVENT_HEADER.size
+            name = buf[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if wd in self._watches and name:
+                events.append((self._watches[wd] / os.fsdecode(name), mask))
+        return events
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def __enter__(self) -> "Inotify":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class DirectoryWatcher:
+    """Debounced inotify events for files with one of SUFFIXES
+
+    `batches()` blocks until at least one file had no new events for
+    DEBOUNCE seconds, then yields {path: combined event mask} for all such
+    files. The process sleeps in select() while nothing happens.
+    """
+
+    def __init__(
+        self,
+        directories: t.Iterable[t.Union[pathlib.Path, str]],
+        suffixes: t.Iterable[str],
+        debounce: float = 2.0
+    ) -> None:
+        self._suffixes = set(suffixes)
+        self._debounce = debounce
+        self._inotify = Inotify()
+        for directory in directories:
+            self._inotify.add_watch(directory, IN_WRITTEN | IN_GONE)
+
+    def close(self) -> None:
+        self._inotify.close()
+
+    def __enter__(self) -> "DirectoryWatcher":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def batches(self) -> t.Iterator[t.Dict[pathlib.Path, int]]:
+        pending: t.Dict[pathlib.Path, t.Tuple[float, int]] = {}
+        while True:
+            timeout = None
+            if pending:
+                oldest = min(seen for seen, _ in pending.values())
+                timeout = max(0.0, oldest + self._debounce - time.monotonic())
+
+            readable, _, _ = select.select([self._inotify], [], [], timeout)
+            now = time.monotonic()
+            if readable:
+                for path, mask in self._inotify.read():
+                    if path.suffix not in self._suffixes:
+                        continue
+                    _, old_mask = pending.get(path, (now, 0))
+                    pending[path] = (now, old_mask | mask)
+
+            ready = {
+                path: mask for path, (seen, mask) in pending.items()
+                if now - seen >= self._debounce
+            }
+            if ready:
+                for path in ready:
+                    del pending[path]
+                yield ready
+
+
+def _decryptable(path: pathlib.Path) -> t.Optional[pathlib.Path]:
+    """Map a dl/ event to the file to decrypt, once it is complete"""
+    if path.suffix == ".aax":
+        return path if path.exists() else None
+    if path.suffix in (".aaxc", ".voucher"):
+        aaxc = path.with_suffix(".aaxc")
+        if aaxc.exists() and aaxc.with_suffix(".voucher").exists():
+            return aaxc
+    return None
+
+
+def watch_decrypt(
+    shelf: "Shelf",
+    dl_dir: t.Union[pathlib.Path, str],
+    target_dir: t.Union[pathlib.Path, str],
+    activation_bytes: t.Optional[str] = None,
+    debounce: float = 2.0,
+    **decrypter_options
+) -> None:
+    """Decrypt every download that lands in DL_DIR, forever
+
+    An `.aaxc` is decrypted once its `.voucher` exists as well, whichever
+    of the two is written last. Errors are reported and the file skipped.
+    """
+    suffixes = (".aax", ".aaxc", ".voucher")
+    with DirectoryWatcher([dl_dir], suffixes, debounce) as watcher:
+        echo(f"Watching {dl_dir} for new downloads...")
+        for batch in watcher.batches():
+            files = {
+                _decryptable(path) for path, mask in batch.items()
+                if mask & IN_WRITTEN
+            }
+            for file in sorted(f for f in files if f is not None):
+                try:
+                    results = shelf.decrypt(
+                        [file],
+                        target_dir=target_dir,
+                        activation_bytes=activation_bytes,
+                        **decrypter_options
+                    )
+                except Exception as exc:  # noqa: B902
+                    secho(f"Decrypt of {file} failed: {exc}", fg="red")
+                    continue
+                for _, error in results:
+                    if error is not None:
+                        secho(f"Decrypt of {file} failed: {error}", fg="red")
+
+
+class IncrementalFeed:
+    """Episodes of a feed, kept between renders
+
+    `update()` re-creates the episodes of changed files only (the probe
+    cache skips ffprobe for the rest) and drops the ones of removed files.
+    """
+
+    def __init__(
+        self,
+        shelf: "Shelf",
+        url_prefix: str,
+        make_public: bool = False,
+        media_prefix: t.Optional[str] = None,
+        hls: bool = False
+    ) -> None:
+        self._shelf = shelf
+        self._url_prefix = url_prefix
+        self._make_public = make_public
+        self._media_prefix = media_prefix
+        self._hls = hls
+        self._episodes: t.Dict[pathlib.Path, EpisodeCreator] = {}
+
+    @property
+    def episodes(self) -> t.List[EpisodeCreator]:
+        return list(self._episodes.values())
+
+    def update(
+        self,
+        changed: t.Iterable[pathlib.Path] = (),
+        removed: t.Iterable[pathlib.Path] = ()
+    ) -> t.List[EpisodeCreator]:
+        """Return the episodes created for CHANGED"""
+        for path in removed:
+            if self._episodes.pop(pathlib.Path(path).resolve(), None):
+                echo(f"removing {path}")
+        created = []
+        for path in changed:
+            path = pathlib.Path(path).resolve()
+            if not path.exists():
+                continue
+            try:
+                created.extend(self._shelf.episodes(
+                    [path],
+                    url_prefix=self._url_prefix,
+                    make_public=self._make_public,
+                    media_prefix=self._media_prefix,
+                    hls=self._hls
+                ))
+            except (RuntimeError, KeyError) as exc:
+                secho(f"Skip {path}: {exc}", fg="red")
+                self._episodes.pop(path, None)
+                continue
+            self._episodes[path] = created[-1]
+        return created
+
+
+async def watch_feed(
+    shelf: "Shelf",
+    feed: IncrementalFeed,
+    options: FeedOptions,
+    media_dir: t.Union[pathlib.Path, str],
+    client=None,
+    use_library_api: bool = False,
+    sort_by_purchase_date: bool = False,
+    debounce: float = 2.0,
+    ping_hub: bool = True,
+    **library_options
+) -> None:
+    """Re-render the feed whenever media in MEDIA_DIR changes, forever
+
+    With a sharded `shelf.layout`, all of MEDIA_DIR's shard folders are
+    watched (and created, so new books are seen in any of them). FEED must
+    already hold the current episodes. The library is only
+    synced again if a new episode's ASIN is not in the snapshot yet.
+    """
+    needs_library = use_library_api or sort_by_purchase_date
+    suffixes = MediaFiles.get_supported_list()
+    directories = shelf.layout.directories(
+        pathlib.Path(media_dir), create=True
+    )
+    with DirectoryWatcher(directories, suffixes, debounce) as watcher:
+        echo(f"Watching {media_dir} for new episodes...")
+        batches = watcher.batches()
+        while True:
+            batch = await asyncio.to_thread(next, batches)
+            changed = [p for p, mask in batch.items() if p.exists()]
+            removed = [p for p, mask in batch.items() if not p.exists()]
+            created = feed.update(changed=changed, removed=removed)
+            if not created and not removed:
+                continue
+
+            books = None
+            episodes = feed.episodes
+            if needs_library:
+                books = shelf.library.books or {}
+                if any(ep.asin not in books for ep in created):
+                    shelf.library.invalidate()
+                books = await shelf.sync_library(client, **library_options)
+                for ep in created:
+                    if ep.asin not in books:
+                        secho(f"Skip {ep.source}: not in library", fg="red")
+                episodes = [ep for ep in episodes if ep.asin in books]
+
+            shelf.render_feed(
+                options,
+                episodes,
+                books=books,
+                use_library_api=use_library_api,
+                sort_by_purchase_date=sort_by_purchase_date,
+                ping_hub=ping_hub
+            )
+            echo(f"feed saved to {options.outfile}")
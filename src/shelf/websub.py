@@ -0,0 +1,325 @@
+"""WebSub: tell a hub when a feed changed, and a small hub to run locally
+
+Podcast clients that subscribe at the hub advertised in the feed get the
+new feed pushed to them instead of polling it. See
+https://www.w3.org/TR/websub/ for the protocol.
+"""
+
+import concurrent.futures
+import hashlib
+import hmac
+import http.server
+import json
+import os
+import pathlib
+import secrets
+import threading
+import time
+import typing as t
+import urllib.parse
+
+import httpx
+from click import echo, secho
+
+from .exceptions import ShelfError
+from .feed import feed_digest
+
+# lease for subscriptions that ask for none, and the longest one granted
+DEFAULT_LEASE = 10 * 24 * 3600
+MAX_LEASE = 30 * 24 * 3600
+
+
+def _ping_state(feed: pathlib.Path) -> pathlib.Path:
+    return feed.with_name(f".{feed.name}.websub")
+
+
+def ping_hub(
+    hub_url: str,
+    feed_url: str,
+    feed: pathlib.Path,
+    force: bool = False
+) -> bool:
+    """Tell the hub at HUB_URL that FEED_URL changed, if it did
+
+    The digest of the FEED file last announced is kept next to it
+    (`.<feed>.websub`), so a feed rendered again with the same episodes
+    is not announced again. Returns whether the hub was pinged.
+    """
+    digest = feed_digest(feed.read_bytes())
+    state_file = _ping_state(feed)
+    try:
+        state = json.loads(state_file.read_text())
+    except (OSError, ValueError):
+        state = {}
+    if not force and state.get(hub_url) == digest:
+        return False
+
+    try:
+        response = httpx.post(
+            hub_url,
+            data={"hub.mode": "publish", "hub.url": feed_url},
+            timeout=30
+        )
+    except httpx.HTTPError as exc:
+        raise ShelfError(f"WebSub hub {hub_url}: {exc}") from None
+    if not response.is_success:
+        raise ShelfError(
+            f"WebSub hub {hub_url}: HTTP {response.status_code} "
+            f"{response.text[:200]}"
+        )
+
+    state[hub_url] = digest
+    tmpfile = state_file.with_name(f"{state_file.name}.tmp")
+    tmpfile.write_text(json.dumps(state))
+    os.replace(tmpfile, state_file)
+    return True
+
+
+class Subscription:
+    def __init__(
+        self,
+        callback: str,
+        expires: float,
+        secret: t.Optional[str] = None
+    ) -> None:
+        self.callback = callback
+        self.expires = expires
+        self.secret = secret
+
+
+class Hub:
+    """A WebSub hub for a few feeds, enough to stand in for a public one
+
+    Subscriptions are verified with the subscriber before they count and
+    kept in STATE_FILE, if given, across restarts. On a publish ping the
+    feed is fetched once and pushed to every subscriber, unless its
+    content did not change since the last push. Only topics starting with
+    one of TOPIC_PREFIXES are accepted (all, if empty), so the hub does not
+    relay arbitrary URLs.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        topic_prefixes: t.Iterable[str] = (),
+        state_file: t.Optional[pathlib.Path] = None,
+        jobs: int = 4,
+        client: t.Optional[httpx.Client] = None
+    ) -> None:
+        self.url = url
+        self._topic_prefixes = tuple(topic_prefixes)
+        self._state_file = state_file
+        self._client = client or httpx.Client(timeout=30)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=jobs, thread_name_prefix="websub"
+        )
+        self._lock = threading.Lock()
+        self._subscriptions: t.Dict[str, t.Dict[str, Subscription]] = {}
+        self._digests: t.Dict[str, str] = {}
+        self._load()
+
+    def subscribers(self, topic: str) -> t.List[Subscription]:
+        now = time.time()
+        with self._lock:
+            subscriptions = self._subscriptions.get(topic, {})
+            for callback in [
+                c for c, s in subscriptions.items() if s.expires <= now
+            ]:
+                del subscriptions[callback]
+            return list(subscriptions.values())
+
+    def handle(self, form: t.Dict[str, str]) -> t.Tuple[int, str]:
+        """Answer a POST to the hub, (status, message)
+
+        Verification and delivery happen in the background.
+        """
+        mode = form.get("hub.mode")
+        if mode in ("subscribe", "unsubscribe"):
+            topic = form.get("hub.topic", "")
+            callback = form.get("hub.callback", "")
+            if not self._allowed(topic):
+                return 403, f"topic not served here: {topic}"
+            if not callback.startswith(("http://", "https://")):
+                return 400, "hub.callback must be an http(s) URL"
+            try:
+                lease = min(
+                    int(form.get("hub.lease_seconds", DEFAULT_LEASE)),
+                    MAX_LEASE
+                )
+            except ValueError:
+                return 400, "hub.lease_seconds must be a number"
+            self._executor.submit(
+                self._verify, mode, topic, callback, lease,
+                form.get("hub.secret")
+            )
+            return 202, ""
+        if mode == "publish":
+            topic = form.get("hub.url") or form.get("hub.topic", "")
+            if not self._allowed(topic):
+                return 403, f"topic not served here: {topic}"
+            self._executor.submit(self._distribute, topic)
+            return 202, ""
+        return 400, f"unsupported hub.mode {mode}"
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        self._client.close()
+
+    def _allowed(self, topic: str) -> bool:
+        if not topic.startswith(("http://", "https://")):
+            return False
+        return not self._topic_prefixes \
+            or topic.startswith(self._topic_prefixes)
+
+    def _verify(
+        self,
+        mode: str,
+        topic: str,
+        callback: str,
+        lease: int,
+        secret: t.Optional[str]
+    ) -> None:
+        challenge = secrets.token_urlsafe(24)
+        params = {
+            "hub.mode": mode,
+            "hub.topic": topic,
+            "hub.challenge": challenge,
+        }
+        if mode == "subscribe":
+            params["hub.lease_seconds"] = str(lease)
+        try:
+            response = self._client.get(callback, params=params)
+        except httpx.HTTPError as exc:
+            secho(f"Verify {callback}: {exc}", fg="yellow")
+            return
+        if not response.is_success or response.text.strip() != challenge:
+            secho(f"{callback} did not confirm {mode} to {topic}",
+                  fg="yellow")
+            return
+
+        with self._lock:
+            subscriptions = self._subscriptions.setdefault(topic, {})
+            if mode == "subscribe":
+                subscriptions[callback] = Subscription(
+                    callback, time.time() + lease, secret
+                )
+            else:
+                subscriptions.pop(callback, None)
+        echo(f"{callback} {mode}d to {topic}")
+        self._save()
+
+    def _distribute(self, topic: str) -> None:
+        subscribers = self.subscribers(topic)
+        if not subscribers:
+            return
+        try:
+            response = self._client.get(topic)
+            response.raise_for_status()
+        except httpx.HTTPError as exc:
+            secho(f"Fetch {topic}: {exc}", fg="yellow")
+            return
+        body = response.content
+        digest = feed_digest(body)
+        with self._lock:
+            if self._digests.get(topic) == digest:
+                return
+            self._digests[topic] = digest
+
+        headers = {
+            "Content-Type": response.headers.get(
+                "Content-Type", "application/rss+xml"
+            ),
+            "Link": f'<{self.url}>; rel="hub", <{topic}>; rel="self"',
+        }
+        for subscription in subscribers:
+            self._executor.submit(
+                self._deliver, subscription, body, headers
+            )
+
+    def _deliver(
+        self,
+        subscription: Subscription,
+        body: bytes,
+        headers: t.Dict[str, str]
+    ) -> None:
+        headers = dict(headers)
+        if subscription.secret:
+            signature = hmac.new(
+                subscription.secret.encode(), body, hashlib.sha256
+            ).hexdigest()
+            headers["X-Hub-Signature"] = f"sha256={signature}"
+        try:
+            response = self._client.post(
+                subscription.callback, content=body, headers=headers
+            )
+        except httpx.HTTPError as exc:
+            secho(f"Deliver to {subscription.callback}: {exc}", fg="yellow")
+            return
+        if response.status_code == 410:
+            # the subscriber is gone for good
+            with self._lock:
+                for subscriptions in self._subscriptions.values():
+                    subscriptions.pop(subscription.callback, None)
+            self._save()
+
+    def _load(self) -> None:
+        if self._state_file is None:
+            return
+        try:
+            data = json.loads(self._state_file.read_text())
+        except (OSError, ValueError):
+            return
+        for topic, subscriptions in data.items():
+            self._subscriptions[topic] = {
+                s["callback"]: Subscription(**s) for s in subscriptions
+            }
+
+    def _save(self) -> None:
+        if self._state_file is None:
+            return
+        with self._lock:
+            data = json.dumps({
+                topic: [vars(s) for s in subscriptions.values()]
+                for topic, subscriptions in self._subscriptions.items()
+            })
+        tmpfile = self._state_file.with_name(f".{self._state_file.name}.tmp")
+        tmpfile.write_text(data)
+        os.replace(tmpfile, self._state_file)
+
+
+def serve(hub: Hub, host: str, port: int) -> None:
+    """Answer WebSub requests for HUB until interrupted"""
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length).decode("utf-8", "replace")
+            form = {
+                k: v[-1] for k, v in urllib.parse.parse_qs(body).items()
+            }
+            status, message = hub.handle(form)
+            self._reply(status, message)
+
+        def do_GET(self):
+            self._reply(200, "WebSub hub, POST hub.mode=subscribe|publish")
+
+        def _reply(self, status: int, message: str) -> None:
+            data = message.encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    echo(f"WebSub hub {hub.url} listening on {host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        hub.close()
@@ -0,0 +1,206 @@
+"""`SegmentedDownload` and `audible fetch` against a local HTTP server
+
+Run with `PYTHONPATH=src python -m unittest discover tests`.
+"""
+
+import http.server
+import importlib.util
+import json
+import os
+import pathlib
+import re
+import tempfile
+import threading
+import types
+import unittest
+from unittest import mock
+
+import httpx
+from click.testing import CliRunner
+
+from shelf.download import SegmentedDownload
+
+PLUGINS = pathlib.Path(__file__).parent.parent / "src" / "audible-cli" \
+    / "plugins"
+BOOK = os.urandom(256 * 1024 + 17)
+ETAG = '"v1"'
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    """Serves BOOK at any path, with Range and If-Range unless `ranges`"""
+
+    protocol_version = "HTTP/1.1"
+    ranges = True
+    seen: list = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        header = self.headers.get("Range")
+        self.seen.append(header)
+        match = re.match(r"bytes=(\d+)-(\d*)\Z", header or "")
+        if_range = self.headers.get("If-Range")
+        if self.ranges and match and if_range in (None, ETAG):
+            start = int(match.group(1))
+            end = int(match.group(2) or len(BOOK) - 1)
+            body = BOOK[start:end + 1]
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{end}/{len(BOOK)}"
+            )
+        else:
+            body = BOOK
+            self.send_response(200)
+        self.send_header("ETag", ETAG)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class Server(http.server.ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # the download hangs up on a 200 to its probe, that is fine
+        pass
+
+
+class ServerTestCase(unittest.TestCase):
+    def setUp(self):
+        RangeHandler.ranges = True
+        RangeHandler.seen = []
+        self.server = Server(("127.0.0.1", 0), RangeHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True) \
+            .start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/book.aax"
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = pathlib.Path(self.tmp.name)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+
+class SegmentedDownloadTest(ServerTestCase):
+    def download(self, target: pathlib.Path) -> SegmentedDownload:
+        with httpx.Client() as client:
+            download = SegmentedDownload(
+                self.url, target, client, segments=4, min_segment=32 * 1024
+            )
+            download.run()
+        return download
+
+    def test_segments(self):
+        target = self.dir / "book.aax"
+        download = self.download(target)
+        self.assertEqual(target.read_bytes(), BOOK)
+        self.assertFalse(download.part.exists())
+        self.assertFalse(download.state_file.exists())
+        # the probe, then one request per segment
+        self.assertEqual(len(RangeHandler.seen), 5)
+
+    def test_resume(self):
+        target = self.dir / "book.aax"
+        half = len(BOOK) // 2
+        target.with_name(f".{target.name}.part").write_bytes(
+            BOOK[:half] + bytes(len(BOOK) - half)
+        )
+        target.with_name(f".{target.name}.part.json").write_text(json.dumps({
+            "size": len(BOOK),
+            "validator": ETAG,
+            "segments": [[0, len(BOOK), half]],
+        }))
+        self.download(target)
+        self.assertEqual(target.read_bytes(), BOOK)
+        self.assertEqual(
+            RangeHandler.seen, ["bytes=0-0", f"bytes={half}-{len(BOOK) - 1}"]
+        )
+
+    def test_no_ranges(self):
+        RangeHandler.ranges = False
+        target = self.dir / "book.aax"
+        self.download(target)
+        self.assertEqual(target.read_bytes(), BOOK)
+
+
+class StubSession:
+    def __init__(self, link: str) -> None:
+        self.link = link
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def head(self, url, **kwargs):
+        return httpx.Response(302, headers={"Location": self.link})
+
+
+class StubClient:
+    """Just what `fetch_library` and `get_aax_url` use of the API client"""
+
+    def __init__(self, items: list, link: str) -> None:
+        self.items = items
+        self.session = StubSession(link)
+        self.auth = types.SimpleNamespace(
+            locale=types.SimpleNamespace(domain="com")
+        )
+
+    async def get(self, path, response_callback=None, **params):
+        return httpx.Response(
+            200,
+            json={"items": self.items},
+            headers={"total-count": str(len(self.items))}
+        )
+
+
+def load_plugin(name: str):
+    spec = importlib.util.spec_from_file_location(name, PLUGINS / f"{name}.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FetchCommandTest(ServerTestCase):
+    def invoke(self, *args: str):
+        items = [{
+            "asin": asin,
+            "title": f"Book {asin[-1]}",
+            "purchase_date": "2021-01-01T00:00:00.000Z",
+            "available_codecs": [
+                {"enhanced_codec": "LC_64_22050_stereo", "name": "aax_22_64"}
+            ],
+        } for asin in ("B000000001", "B000000002")]
+        (self.dir / "assets").mkdir()
+        (self.dir / "assets" / "B000000001_Book_1-AAX_22_64.m4a").touch()
+        client = StubClient(items, self.url)
+        cli = load_plugin("cmd_fetch").cli
+        with mock.patch(
+            "audible_cli.config.Session.get_client", return_value=client
+        ):
+            return CliRunner().invoke(cli, [
+                "--assets", str(self.dir / "assets"),
+                "--dir", str(self.dir / "dl"),
+                *args
+            ])
+
+    def test_dry_run(self):
+        result = self.invoke("--dry-run")
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("1 books to fetch, 1 on the shelf", result.output)
+        self.assertIn("B000000002_Book_2-AAX_22_64.aax", result.output)
+        self.assertFalse((self.dir / "dl").exists())
+
+    def test_fetch(self):
+        result = self.invoke("--bunch-size", "10")
+        self.assertEqual(result.exit_code, 0, result.output)
+        downloaded = list((self.dir / "dl").iterdir())
+        self.assertEqual(
+            [f.name for f in downloaded], ["B000000002_Book_2-AAX_22_64.aax"]
+        )
+        self.assertEqual(downloaded[0].read_bytes(), BOOK)
+
+
+if __name__ == "__main__":
+    unittest.main()
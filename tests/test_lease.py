@@ -0,0 +1,135 @@
+"""`LeaseDir` shared by several processes
+
+Run with `PYTHONPATH=src python -m unittest discover tests`.
+"""
+
+import contextlib
+import io
+import multiprocessing
+import os
+import pathlib
+import tempfile
+import time
+import unittest
+
+from shelf.exceptions import LeaseHeld
+from shelf.lease import LeaseDir
+
+PROCESSES = 4
+KEYS = [f"book-{n:03d}" for n in range(300)]
+# the leases of a node that died, taken over by the others
+DEAD_KEYS = KEYS[::6]
+
+
+def claim(directory: str, work: str, out: str, start) -> None:
+    """Go through KEYS like `Shelf.run_jobs`, write the keys done to OUT
+
+    A key's work marks it done in WORK; a node that gets its lease after
+    that finds nothing left to do. Doing the work of a key another process
+    is in the middle of fails.
+    """
+    done = []
+
+    def do(key: str) -> None:
+        marker = pathlib.Path(work) / key
+        if marker.exists():
+            return
+        busy = marker.with_name(f"{key}.busy")
+        os.close(os.open(busy, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        marker.touch()
+        done.append(key)
+        busy.unlink()
+
+    start.wait()
+    with contextlib.redirect_stdout(io.StringIO()), \
+            LeaseDir(directory) as leases:
+        for key in KEYS:
+            try:
+                leases.run(key, lambda: do(key))
+            except LeaseHeld:
+                pass
+    pathlib.Path(out).write_text("\n".join(done))
+
+
+def back_date(path: pathlib.Path, seconds: float) -> None:
+    mtime = time.time() - seconds
+    os.utime(path, (mtime, mtime))
+
+
+class LeaseDirTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = pathlib.Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_processes(self):
+        leases = self.dir / "leases"
+        work = self.dir / "work"
+        work.mkdir()
+        dead = LeaseDir(leases, node="dead")
+        for key in DEAD_KEYS:
+            dead.path(key).write_text("dead 0")
+            back_date(dead.path(key), 10 * dead.ttl)
+
+        start = multiprocessing.Event()
+        processes = [
+            multiprocessing.Process(
+                target=claim,
+                args=(str(leases), str(work), str(self.dir / f"done-{n}"),
+                      start)
+            )
+            for n in range(PROCESSES)
+        ]
+        for process in processes:
+            process.start()
+        start.set()
+        for process in processes:
+            process.join(60)
+            self.assertEqual(process.exitcode, 0)
+
+        done = [
+            (self.dir / f"done-{n}").read_text().split()
+            for n in range(PROCESSES)
+        ]
+        # each key done exactly once, the dead node's included
+        self.assertEqual(sorted(sum(done, [])), KEYS)
+        # and no lease left behind
+        self.assertEqual(
+            [p.name for p in leases.iterdir() if p.suffix == ".lease"], []
+        )
+
+    def test_takeover(self):
+        with contextlib.redirect_stdout(io.StringIO()), \
+                LeaseDir(self.dir, node="a") as a, \
+                LeaseDir(self.dir, node="b") as b:
+            self.assertTrue(a.acquire("book"))
+            self.assertFalse(b.acquire("book"))
+            self.assertEqual(b.holder("book"), "a")
+            with self.assertRaises(LeaseHeld):
+                b.run("book", lambda: None)
+
+            # not renewed for longer than the TTL
+            back_date(a.path("book"), a.ttl + 60)
+            self.assertTrue(b.acquire("book"))
+            self.assertEqual(a.holder("book"), "b")
+
+            # a's release must not remove the lease b took over
+            a.release("book")
+            self.assertEqual(a.holder("book"), "b")
+            b.release("book")
+            self.assertIsNone(a.holder("book"))
+
+    def test_renewed(self):
+        with LeaseDir(self.dir, node="a", ttl=60) as a, \
+                LeaseDir(self.dir, node="b", ttl=60) as b:
+            self.assertTrue(a.acquire("book"))
+            # half a TTL without renewal is not enough to take it over
+            back_date(a.path("book"), 30)
+            self.assertFalse(b.acquire("book"))
+            self.assertEqual(b.holder("book"), "a")
+
+
+if __name__ == "__main__":
+    unittest.main()